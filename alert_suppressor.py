@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Alert Suppressor – gộp các cảnh báo trùng lặp trong cửa sổ thời gian
+
+- Key: (remote_ip, URI template, tập pattern) – cùng IP đánh cùng endpoint bằng cùng kiểu payload
+- Sự kiện đầu tiên được phát đầy đủ; các sự kiện sau trong cửa sổ chỉ được đếm
+- Hết mỗi cửa sổ: nếu có sự kiện bị gộp thì phát một bản rollup (số lượng, score cao nhất,...)
+  và tiếp tục gộp; nếu không thì key hết hạn
+- Trạng thái giới hạn số key (LRU), key bị đẩy ra vẫn phát rollup còn dang dở
+"""
+
+import heapq
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# /products/1234/reviews → /products/{n}/reviews, UUID/hex id → {id}
+_URI_ID_RE = re.compile(
+    r"/(?:\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{16,})(?=/|$)",
+    re.IGNORECASE
+)
+
+
+def uri_template(uri: str) -> str:
+    """Chuẩn hoá URI thành template: bỏ query string, thay segment dạng id bằng placeholder"""
+    path = (uri or '').split('?', 1)[0]
+    return _URI_ID_RE.sub(lambda m: '/{n}' if m.group(0)[1:].isdigit() else '/{id}', path) or '/'
+
+
+class AlertSuppressor:
+    """Dedup + rollup cho cảnh báo SQLi.
+
+    Tham số:
+    - window_seconds: độ dài cửa sổ gộp (cũng là chu kỳ phát rollup khi tấn công còn tiếp diễn)
+    - max_keys: số key tối đa giữ trong bộ nhớ
+    """
+
+    def __init__(self, window_seconds=60.0, max_keys=10000):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._deadlines = []
+        self._pending_rollups = []
+        self._lock = threading.Lock()
+        self.stats = {'emitted': 0, 'suppressed': 0, 'rollups': 0, 'evicted': 0}
+
+    @staticmethod
+    def alert_key(log_entry, detection_result):
+        patterns = detection_result.get('detected_patterns', detection_result.get('patterns')) or []
+        if not isinstance(patterns, (list, tuple, set)):
+            patterns = [patterns]
+        return (
+            log_entry.get('remote_ip', ''),
+            uri_template(log_entry.get('uri', '')),
+            tuple(sorted({str(p) for p in patterns}))
+        )
+
+    def should_emit(self, log_entry, detection_result, now=None):
+        """True nếu sự kiện cần được phát đầy đủ, False nếu chỉ được đếm vào rollup"""
+        if not self.window_seconds:
+            return True
+        now = time.time() if now is None else now
+        key = self.alert_key(log_entry, detection_result)
+        score = float(detection_result.get('score', 0.0) or 0.0)
+        with self._lock:
+            self._expire_locked(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry['suppressed'] += 1
+                entry['last_seen'] = now
+                entry['max_score'] = max(entry['max_score'], score)
+                self.stats['suppressed'] += 1
+                return False
+            if len(self._entries) >= self.max_keys:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self.stats['evicted'] += 1
+                if old_entry['suppressed']:
+                    self._pending_rollups.append(self._rollup_locked(old_key, old_entry, now))
+            deadline = now + self.window_seconds
+            self._entries[key] = {
+                'first_seen': now,
+                'window_start': now,
+                'last_seen': now,
+                'deadline': deadline,
+                'suppressed': 0,
+                'max_score': score
+            }
+            heapq.heappush(self._deadlines, (deadline, key))
+            self.stats['emitted'] += 1
+            return True
+
+    def _rollup_locked(self, key, entry, now):
+        self.stats['rollups'] += 1
+        remote_ip, template, patterns = key
+        return {
+            'type': 'rollup',
+            'timestamp': datetime.now().isoformat(),
+            'remote_ip': remote_ip,
+            'uri_template': template,
+            'patterns': list(patterns),
+            'suppressed': entry['suppressed'],
+            'max_score': entry['max_score'],
+            'window_start': datetime.fromtimestamp(entry['window_start']).isoformat(),
+            'window_end': datetime.fromtimestamp(min(now, entry['deadline'])).isoformat(),
+            'first_seen': datetime.fromtimestamp(entry['first_seen']).isoformat(),
+            'last_seen': datetime.fromtimestamp(entry['last_seen']).isoformat()
+        }
+
+    def _expire_locked(self, now):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self._deadlines)
+            entry = self._entries.get(key)
+            if entry is None or entry['deadline'] != deadline:
+                continue
+            if entry['suppressed']:
+                # Attack still going: report the window and keep suppressing
+                self._pending_rollups.append(self._rollup_locked(key, entry, now))
+                entry['suppressed'] = 0
+                entry['max_score'] = 0.0
+                entry['window_start'] = deadline
+                entry['deadline'] = deadline + self.window_seconds
+                heapq.heappush(self._deadlines, (entry['deadline'], key))
+            else:
+                del self._entries[key]
+
+    def drain_rollups(self, now=None, final=False):
+        """Lấy các rollup đến hạn; final=True phát luôn mọi rollup dang dở (khi dừng)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire_locked(now)
+            if final:
+                for key, entry in self._entries.items():
+                    if entry['suppressed']:
+                        self._pending_rollups.append(self._rollup_locked(key, entry, now))
+                self._entries.clear()
+                self._deadlines = []
+            rollups, self._pending_rollups = self._pending_rollups, []
+        return rollups
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['active_keys'] = len(self._entries)
+        stats['window_seconds'] = self.window_seconds
+        return stats
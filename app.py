@@ -12,29 +12,39 @@ import os
 import json
 import threading
 import time
+import zlib
 from datetime import datetime
 from typing import Dict, List, Any, Optional
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import queue
+from collections import Counter, deque
 import logging
+import signal
+import sys
 
-from flask import Flask, request, jsonify, render_template
-from optimized_sqli_detector import OptimizedSQLIDetector
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from optimized_sqli_detector import OptimizedSQLIDetector, BenignPrefilter, DEFAULT_PREFILTER_MODE, Verdict, extract_features_chunk
+from client_aggregator import ClientActivityAggregator
+from event_store import RecentEventStore
+from event_broadcaster import EventBroadcaster, format_sse
+from latency_histogram import LatencyHistogram
+from worker_cluster import WorkerCluster, merge_performance, merge_prefilter, merge_by_timestamp, merge_by_seq
+from history_store import DetectionHistoryStore, CLASS_NAMES, parse_time
+from json_codec import dumps as json_dumps
+from async_logging import setup_async_logging, stop_async_logging
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('ai_sqli_detection.log'),
-        logging.StreamHandler()
-    ]
-)
+# Setup logging: records are queued and written by a background listener thread
+setup_async_logging('ai_sqli_detection.log', json_lines=os.environ.get('SQLI_LOG_JSON') == '1')
 logger = logging.getLogger(__name__)
 
 # Global variables with thread safety
+# Active models: the dict is never mutated, only replaced, so request threads read it
+# without locking; model_load_lock only serializes (re)loading
 detector = None
 model_cache = {}
+model_load_lock = threading.Lock()
 thread_lock = threading.RLock()
 stats_lock = threading.Lock()
 performance_stats = {
@@ -44,72 +54,152 @@ performance_stats = {
     'false_positives': 0,
     'detection_rate': 0.0,
     'false_positive_rate': 0.0,
-    'avg_processing_time': 0.0
+    'avg_processing_time': 0.0,
+    'suppressed_alerts': 0
 }
-recent_logs = []
-recent_all_logs = []
 max_recent_logs = 100
 max_all_logs = 1000
+# Ring buffer of recent detections + pattern/threat aggregates maintained on insert
+recent_events = RecentEventStore(capacity=max_all_logs, recent_capacity=max_recent_logs,
+                                 pattern_window=max_recent_logs)
+# Request latency per endpoint kind (HDR-style buckets, per-thread shards: no stats_lock)
+latency_histograms = {
+    'single': LatencyHistogram(),
+    'batch': LatencyHistogram(),
+    # One record per scored chunk of /api/batch-detect/stream
+    'stream': LatencyHistogram(),
+    'realtime': LatencyHistogram()
+}
+# Rollups of repeated alerts suppressed by the collector
+recent_rollups = deque(maxlen=max_recent_logs)
+
+# Optional shared secret; when set, producers must send it in X-Ingest-Token
+ingest_token = os.environ.get('SQLI_INGEST_TOKEN')
+# Realtime ingest: trusted producers (the log collector) post finished verdicts.
+# 'record' stores them as-is, 'rescore' always re-runs the local model. Without a token anyone
+# could post "is_sqli: false", so verdicts are only trusted by default when one is configured.
+realtime_ingest_mode = os.environ.get('SQLI_REALTIME_INGEST_MODE', 'record' if ingest_token else 'rescore')
+if realtime_ingest_mode == 'record' and not ingest_token:
+    logger.warning("⚠️ SQLI_REALTIME_INGEST_MODE=record without SQLI_INGEST_TOKEN: "
+                   "/api/realtime-detect stores unauthenticated verdicts as-is")
+# Re-run detection when the producer's model version differs from ours
+rescore_on_version_mismatch = True
+
+# Benign fast-track: skip the model for lines that cannot be SQLi ('request', 'strict', 'off')
+prefilter = BenignPrefilter(os.environ.get('SQLI_PREFILTER_MODE', DEFAULT_PREFILTER_MODE))
+
+# Per-client sliding windows (fixed-memory sketches) for scanning-campaign queries
+client_activity = ClientActivityAggregator(key_mode=os.environ.get('SQLI_CLIENT_KEY_MODE', 'ip'))
 
-# Thread pool for concurrent processing
-executor = ThreadPoolExecutor(max_workers=4)
+# Batch detection: chunks are scored with one vectorized model call each; for large batches
+# feature extraction (pure Python, CPU-bound) runs in a process pool created on first use
+batch_chunk_size = int(os.environ.get('SQLI_BATCH_CHUNK_SIZE', '1000'))
+batch_process_pool_min = int(os.environ.get('SQLI_BATCH_POOL_MIN', '5000'))
+feature_pool_workers = min(4, os.cpu_count() or 1)
+feature_pool = None
+# Set once shutdown starts: new detection requests get 503 while in-flight work drains
+shutting_down = threading.Event()
+# Detection requests (POST, NDJSON streams until their last chunk) still running; shutdown waits on it
+inflight_changed = threading.Condition()
+inflight_requests = 0
+shutdown_timeout = float(os.environ.get('SQLI_SHUTDOWN_TIMEOUT', '30'))
+# Dashboard push feed (/api/stream): per-client bounded queues, a client that falls behind is
+# disconnected (EventSource reconnects and gets a fresh snapshot); stats changes are pushed
+# at most every stats_push_interval seconds by a thread started with the first client
+event_broadcaster = EventBroadcaster(client_queue_size=int(os.environ.get('SQLI_SSE_QUEUE_SIZE', '256')),
+                                     max_clients=int(os.environ.get('SQLI_SSE_MAX_CLIENTS', '100')))
+stats_push_interval = 1.0
+stats_pusher = None
+# Prefork mode (prefork_server.py): each worker publishes its state, read endpoints merge
+# the other workers' snapshots in; None = single process, endpoints use local state only
+cluster = None
+# Persistent detection history (SQLite WAL, /api/history): written in batches by a background
+# thread; SQLi only unless SQLI_HISTORY_ALL=1. Opened lazily per process (prefork workers
+# each get their own writer on the shared file); SQLI_HISTORY_PATH= (empty) disables it
+history_path = os.environ.get('SQLI_HISTORY_PATH', 'detection_history.db')
+history_retention_days = float(os.environ.get('SQLI_HISTORY_RETENTION_DAYS', '30'))
+history_record_clean = os.environ.get('SQLI_HISTORY_ALL') == '1'
+history_store = None
 
 app = Flask(__name__)
 
-# JSON sanitization for numpy/scalar types
-try:
-    import numpy as _np  # optional
-except Exception:  # pragma: no cover
-    _np = None
+@app.before_request
+def reject_during_shutdown():
+    """Không nhận detection mới khi đang shutdown (producer sẽ retry sang instance khác)"""
+    global inflight_requests
+    if request.method != 'POST':
+        return None
+    if shutting_down.is_set():
+        return jsonify({'error': 'Server is shutting down'}), 503
+    with inflight_changed:
+        inflight_requests += 1
+    g.inflight = True
+    return None
 
-def _to_serializable(obj):
-    """Recursively convert objects to JSON-serializable python natives.
-    Handles numpy scalars/arrays, sets/tuples, and nested dict/list structures.
+@app.teardown_request
+def finish_inflight(exc=None):
+    # Streaming responses keep the request context (stream_with_context) until the last chunk
+    global inflight_requests
+    if g.pop('inflight', False):
+        with inflight_changed:
+            inflight_requests -= 1
+            inflight_changed.notify_all()
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() encode thẳng ra bytes qua json_codec (orjson nếu có).
+
+    Kết quả detection đã là kiểu JSON gốc từ detector (Verdict), không cần bước chuyển kiểu đệ quy.
     """
-    # Numpy scalars
-    if _np is not None:
-        if isinstance(obj, (_np.generic,)):
-            return obj.item()
-        if isinstance(obj, (_np.ndarray,)):
-            return obj.tolist()
-    # Basic scalars
-    if isinstance(obj, (str, int, float, bool)) or obj is None:
-        return obj
-    # Dict
-    if isinstance(obj, dict):
-        return {str(k): _to_serializable(v) for k, v in obj.items()}
-    # List/Tuple/Set
-    if isinstance(obj, (list, tuple, set)):
-        return [_to_serializable(v) for v in obj]
-    # Fallback to string
-    return str(obj)
 
-def load_model_cached(model_path: str = 'models/optimized_sqli_detector.pkl'):
-    """Load model with caching and thread safety"""
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_dumps(obj), mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
+def _load_model(model_path: str):
+    # Check if model file exists
+    if not os.path.exists(model_path):
+        logger.error(f"Model file not found: {model_path}")
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+    model = OptimizedSQLIDetector()
+    model.load_model(model_path)
+    return model
+
+def _publish_model(model_path: str, model):
+    """Swap in a loaded model: readers see either the old or the new dict, never a partial one"""
     global detector, model_cache
+    model_cache = {**model_cache, model_path: model}
+    detector = model
+
+def load_model_cached(model_path: str = 'models/optimized_sqli_detector.pkl'):
+    """Return the cached model; only the first caller for a path loads it (under model_load_lock)"""
+    model = model_cache.get(model_path)
+    if model is not None:
+        return model
     
-    with thread_lock:
-        if model_path in model_cache:
-            logger.info(f"Model loaded from cache: {model_path}")
-            return model_cache[model_path]
-        
+    with model_load_lock:
+        # Another thread may have finished loading while we waited
+        model = model_cache.get(model_path)
+        if model is not None:
+            return model
         try:
-            # Check if model file exists
-            if not os.path.exists(model_path):
-                logger.error(f"Model file not found: {model_path}")
-                raise FileNotFoundError(f"Model file not found: {model_path}")
-            
-            detector = OptimizedSQLIDetector()
-            detector.load_model(model_path)
-            
-            # Cache the model
-            model_cache[model_path] = detector
+            model = _load_model(model_path)
+            _publish_model(model_path, model)
             logger.info(f"Model loaded and cached: {model_path}")
-            return detector
+            return model
         except Exception as e:
             logger.error(f"Error loading model: {e}")
             raise
 
+def reload_model(model_path: str = 'models/optimized_sqli_detector.pkl'):
+    """Load a fresh copy from disk and swap it in; requests keep using the old one until then"""
+    with model_load_lock:
+        model = _load_model(model_path)
+        _publish_model(model_path, model)
+    logger.info(f"🔄 Model reloaded: {model_path} (version {model.version})")
+    return model
+
 def update_stats_thread_safe(is_sqli: bool, processing_time: float):
     """Thread-safe stats update"""
     global performance_stats
@@ -139,66 +229,209 @@ def update_stats_thread_safe(is_sqli: bool, processing_time: float):
             (current_avg * (total_logs - 1) + processing_time) / total_logs
         )
 
+def get_history_store() -> Optional[DetectionHistoryStore]:
+    """History store của process hiện tại (tạo khi dùng lần đầu; None nếu bị tắt/lỗi)"""
+    global history_store, history_path
+    store = history_store
+    if store is not None and store.pid == os.getpid():
+        return store
+    if not history_path:
+        return None
+    with thread_lock:
+        if history_store is None or history_store.pid != os.getpid():
+            try:
+                history_store = DetectionHistoryStore(history_path, record_clean=history_record_clean,
+                                                      retention_days=history_retention_days)
+            except Exception as e:
+                logger.error(f"❌ Could not open detection history {history_path}, disabling it: {e}")
+                history_path = None
+                return None
+        return history_store
+
 def add_log_thread_safe(log_entry: Dict[str, Any]):
     """Thread-safe log addition"""
-    global recent_logs, recent_all_logs
-    
+    data = recent_events.add(log_entry)
+    store = get_history_store()
+    if store is not None:
+        store.record([log_entry], [data])
+    if event_broadcaster.has_subscribers:
+        # Reuse the bytes cached by the store
+        event_broadcaster.publish('detections', b'[' + data + b']')
+
+def update_stats_batch(total: int, sqli: int, processing_time: float):
+    """Thread-safe stats update for a whole chunk (processing_time: sum over its logs)"""
+    if not total:
+        return
+    with stats_lock:
+        previous_total = performance_stats['total_logs']
+        performance_stats['total_logs'] += total
+        performance_stats['sqli_detected'] += sqli
+        performance_stats['clean_logs'] += total - sqli
+        
+        total_logs = performance_stats['total_logs']
+        performance_stats['detection_rate'] = performance_stats['sqli_detected'] / total_logs
+        performance_stats['false_positive_rate'] = performance_stats['false_positives'] / total_logs
+        performance_stats['avg_processing_time'] = (
+            (performance_stats['avg_processing_time'] * previous_total + processing_time) / total_logs
+        )
+
+def add_logs_thread_safe(log_entries: List[Dict[str, Any]]):
+    """Thread-safe addition of many logs (one lock acquisition)"""
+    # Older entries would be evicted by the same call anyway
+    encoded = recent_events.extend(log_entries[-max_all_logs:])
+    store = get_history_store()
+    if store is not None:
+        # Entries beyond the ring buffer have no cached JSON: the writer thread encodes them
+        store.record(log_entries, [None] * (len(log_entries) - len(encoded)) + encoded)
+    if encoded and event_broadcaster.has_subscribers:
+        # The dashboard keeps max_recent_logs entries, older ones would never be shown
+        event_broadcaster.publish('detections', b'[' + b','.join(encoded[-max_recent_logs:]) + b']')
+
+def _extract_features_parallel(log_entries: List[Dict[str, Any]]):
+    """Feature extraction trên process pool (mỗi worker nhận vài chunk liên tiếp)"""
+    global feature_pool
     with thread_lock:
-        # Add to recent logs
-        recent_logs.append(log_entry)
-        if len(recent_logs) > max_recent_logs:
-            recent_logs.pop(0)
+        if feature_pool is None:
+            # Threaded server (and prefork workers): fork() here would copy other threads' held
+            # locks into the children; forkserver children start from a clean single-thread process
+            feature_pool = ProcessPoolExecutor(max_workers=feature_pool_workers,
+                                               mp_context=multiprocessing.get_context('forkserver'))
+    part_size = max(1, -(-len(log_entries) // (feature_pool_workers * 4)))
+    parts = [log_entries[i:i + part_size] for i in range(0, len(log_entries), part_size)]
+    return [features for part in feature_pool.map(extract_features_chunk, parts) for features in part]
+
+def _batch_error_result(log_entry, error: str, processing_time: float = 0.0):
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'log': log_entry,
+        'detection': {
+            'is_sqli': False,
+            'score': 0.0,
+            'patterns': [],
+            'confidence': 'Error',
+            'processing_time': processing_time,
+            'error': error
+        }
+    }
+
+def detect_sqli_batch(log_entries: List[Any], model_path: str = 'models/optimized_sqli_detector.pkl'):
+    """Batch detection: prefilter → một predict_batch cho mỗi chunk → stats/logs mỗi chunk một lần"""
+    detector = load_model_cached(model_path)
+    valid = [isinstance(log_entry, dict) for log_entry in log_entries]
+    prefiltered = [ok and prefilter.is_benign(log_entry) for ok, log_entry in zip(valid, log_entries)]
+    to_score = [i for i, (ok, skip) in enumerate(zip(valid, prefiltered)) if ok and not skip]
+    
+    # Large batches: extract every feature vector in parallel up front, score per chunk below
+    features_by_index = None
+    if len(to_score) >= batch_process_pool_min and feature_pool_workers > 1:
+        features = _extract_features_parallel([log_entries[i] for i in to_score])
+        features_by_index = dict(zip(to_score, features))
+    
+    results = []
+    for start in range(0, len(log_entries), batch_chunk_size):
+        chunk_start = time.time()
+        indices = range(start, min(start + batch_chunk_size, len(log_entries)))
+        score_indices = [i for i in indices if valid[i] and not prefiltered[i]]
+        verdicts = {}
+        error = None
+        if score_indices:
+            try:
+                chunk_features = [features_by_index[i] for i in score_indices] if features_by_index else None
+                scored = detector.predict_batch([log_entries[i] for i in score_indices], features_list=chunk_features)
+                verdicts = dict(zip(score_indices, scored))
+            except Exception as e:
+                logger.error(f"Error in batch detection chunk: {e}")
+                error = str(e)
+        processing_time = (time.time() - chunk_start) / len(indices)
         
-        # Add to all logs
-        recent_all_logs.append(log_entry)
-        if len(recent_all_logs) > max_all_logs:
-            recent_all_logs.pop(0)
+        chunk_results = []
+        sqli_count = 0
+        for i in indices:
+            log_entry = log_entries[i]
+            if not valid[i]:
+                chunk_results.append(_batch_error_result(log_entry, 'Log entry must be a JSON object'))
+                continue
+            if i in verdicts:
+                verdict = verdicts[i]
+            elif prefiltered[i]:
+                # No model score for fast-tracked lines (score None, prefiltered True)
+                verdict = Verdict(False, None, [], 'Low')
+            else:
+                chunk_results.append(_batch_error_result(log_entry, error, processing_time))
+                continue
+            sqli_count += verdict.is_sqli
+            client_activity.record(log_entry, suspicious=verdict.is_sqli)
+            detection = verdict.to_dict()
+            detection['processing_time'] = processing_time
+            detection['prefiltered'] = prefiltered[i]
+            result = {
+                'timestamp': datetime.now().isoformat(),
+                'log': log_entry,
+                'detection': detection
+            }
+            if verdict.is_sqli:
+                logger.warning("🚨 SQLi DETECTED!", extra={'event': {
+                    'remote_ip': log_entry.get('remote_ip', 'unknown'),
+                    'uri': log_entry.get('uri', 'unknown'),
+                    'score': verdict.score,
+                    'patterns': verdict.patterns,
+                    'processing_time': processing_time
+                }})
+            chunk_results.append(result)
+        
+        recorded = [r for r in chunk_results if 'error' not in r['detection']]
+        update_stats_batch(len(recorded), sqli_count, processing_time * len(recorded))
+        add_logs_thread_safe(recorded)
+        results.extend(chunk_results)
+    return results
 
 def detect_sqli_async(log_entry: Dict[str, Any], model_path: str = 'models/optimized_sqli_detector.pkl'):
     """Async SQLi detection with performance monitoring"""
     start_time = time.time()
     
     try:
-        # Load model (cached)
-        detector = load_model_cached(model_path)
-        
-        # Detect SQLi
-        is_sqli, score, patterns, confidence = detector.predict_single(log_entry)
+        # Fast-track obviously clean lines before touching the model
+        prefiltered = prefilter.is_benign(log_entry)
+        if prefiltered:
+            # No model score for fast-tracked lines (score None, prefiltered True)
+            verdict = Verdict(False, None, [], 'Low')
+        else:
+            # Load model (cached)
+            detector = load_model_cached(model_path)
+            
+            # Detect SQLi (Verdict: JSON-native values)
+            verdict = detector.predict_single(log_entry)
         
         processing_time = time.time() - start_time
         
         # Update stats
-        update_stats_thread_safe(is_sqli, processing_time)
+        update_stats_thread_safe(verdict.is_sqli, processing_time)
+        client_activity.record(log_entry, suspicious=verdict.is_sqli)
         
         # Create result
+        detection = verdict.to_dict()
+        detection['processing_time'] = processing_time
+        detection['prefiltered'] = prefiltered
         result = {
             'timestamp': datetime.now().isoformat(),
             'log': log_entry,
-            'detection': {
-                'is_sqli': is_sqli,
-                'score': score,
-                'patterns': patterns,
-                'confidence': confidence,
-                'processing_time': processing_time
-            }
+            'detection': detection
         }
 
-        # Sanitize result for JSON/log storage
-        safe_result = _to_serializable(result)
-
         # Add to logs
-        add_log_thread_safe(safe_result)
+        add_log_thread_safe(result)
         
         # Log detection
-        if is_sqli:
-            logger.warning("🚨 SQLi DETECTED!")
-            logger.warning(f"   IP: {log_entry.get('remote_ip', 'unknown')}")
-            logger.warning(f"   URI: {log_entry.get('uri', 'unknown')}")
-            logger.warning(f"   Score: {score:.3f}")
-            logger.warning(f"   Patterns: {patterns}")
-            logger.warning(f"   Processing time: {processing_time:.3f}s")
+        if verdict.is_sqli:
+            logger.warning("🚨 SQLi DETECTED!", extra={'event': {
+                'remote_ip': log_entry.get('remote_ip', 'unknown'),
+                'uri': log_entry.get('uri', 'unknown'),
+                'score': verdict.score,
+                'patterns': verdict.patterns,
+                'processing_time': processing_time
+            }})
         
-        return safe_result
+        return result
         
     except Exception as e:
         logger.error(f"Error in detection: {e}")
@@ -215,6 +448,214 @@ def detect_sqli_async(log_entry: Dict[str, Any], model_path: str = 'models/optim
             }
         }
 
+def record_precomputed_detection(log_entry: Dict[str, Any], detection: Dict[str, Any]):
+    """Record a verdict computed by a trusted producer without re-scoring"""
+    patterns = detection.get('patterns', detection.get('detected_patterns', []))
+    if not isinstance(patterns, list):
+        patterns = []
+    processing_time = float(detection.get('processing_time', 0.0) or 0.0)
+    is_sqli = bool(detection.get('is_sqli', False))
+    
+    update_stats_thread_safe(is_sqli, processing_time)
+    client_activity.record(log_entry, suspicious=is_sqli)
+    
+    result = {
+        'timestamp': datetime.now().isoformat(),
+        'log': log_entry,
+        'detection': {
+            'is_sqli': is_sqli,
+            'score': detection.get('score', 0.0),
+            'patterns': patterns,
+            'confidence': detection.get('confidence', 'Unknown'),
+            'processing_time': processing_time,
+            'source': 'precomputed',
+            'model_version': detection.get('model_version')
+        }
+    }
+    if detection.get('client_activity'):
+        result['detection']['client_activity'] = detection['client_activity']
+    # Everything here came from the request JSON: already JSON-native
+    add_log_thread_safe(result)
+    return result
+
+def record_alert_rollups(rollups: List[Dict[str, Any]]):
+    """Record suppressed-alert rollups posted by the collector"""
+    rollups = [r for r in rollups if isinstance(r, dict)]
+    suppressed = sum(int(r.get('suppressed', 0) or 0) for r in rollups)
+    with stats_lock:
+        performance_stats['suppressed_alerts'] += suppressed
+    with thread_lock:
+        recent_rollups.extend(rollups)
+    return suppressed
+
+def _needs_rescore(data: Dict[str, Any], detection: Dict[str, Any]) -> bool:
+    """Decide whether a realtime submission must be scored locally"""
+    if realtime_ingest_mode == 'rescore' or data.get('rescore'):
+        return True
+    if request.args.get('rescore', '').lower() in ('1', 'true', 'yes'):
+        return True
+    if not detection or 'is_sqli' not in detection:
+        return True
+    # Producer fell back to rules (model slow/failing there): score with our model instead
+    if detection.get('detection_mode') == 'rules':
+        return True
+    if ingest_token and request.headers.get('X-Ingest-Token') != ingest_token:
+        return True
+    if rescore_on_version_mismatch:
+        producer_version = detection.get('model_version')
+        local_version = getattr(detector, 'version', None)
+        if producer_version and local_version and producer_version != local_version:
+            return True
+    return False
+
+def _reset_local_state():
+    """Xoá recent events và reset thống kê của process này"""
+    global performance_stats
+    recent_events.clear()
+    with stats_lock:
+        performance_stats = {
+            'total_logs': 0,
+            'sqli_detected': 0,
+            'clean_logs': 0,
+            'false_positives': 0,
+            'detection_rate': 0.0,
+            'false_positive_rate': 0.0,
+            'avg_processing_time': 0.0,
+            'suppressed_alerts': 0
+        }
+    event_broadcaster.publish('reset', {'timestamp': datetime.now().isoformat()})
+
+def local_snapshot() -> Dict[str, Any]:
+    """Trạng thái của worker này (JSON-native) để các worker khác gộp vào endpoint đọc"""
+    with stats_lock:
+        performance = dict(performance_stats)
+    top_patterns, total_threats = recent_events.pattern_summary()
+    with thread_lock:
+        rollups = list(recent_rollups)
+    return {
+        'pid': os.getpid(),
+        'time': time.time(),
+        'performance': performance,
+        'prefilter': prefilter.get_stats(),
+        'latency': {kind: histogram.export_state() for kind, histogram in latency_histograms.items()},
+        'events': [{'seq': seq, **event} for seq, event in recent_events.latest_entries(raw=False)],
+        'patterns': dict(top_patterns),
+        'threats': total_threats,
+        'rollups': rollups
+    }
+
+def enable_cluster_mode(directory: str, publish_interval: float = 1.0, workers: int = 1):
+    """Gọi trong mỗi worker của prefork_server sau khi fork"""
+    global cluster, feature_pool_workers
+    # Workers already use every core: split the feature pool budget (1 = no pool) between them
+    feature_pool_workers = max(1, min(feature_pool_workers, (os.cpu_count() or 1) // max(1, workers)))
+    cluster = WorkerCluster(directory, publish_interval=publish_interval)
+    cluster.publish(local_snapshot())
+    cluster.start_publishing(_cluster_snapshot, _reset_local_state)
+    return cluster
+
+def _cluster_snapshot() -> Dict[str, Any]:
+    # Client sketches are binary and large: published as their own file, next to the JSON snapshot
+    cluster.publish_sketch(client_activity)
+    return local_snapshot()
+
+def _client_activity_view() -> ClientActivityAggregator:
+    """client_activity, gộp với sketch của mọi worker khác ở chế độ prefork"""
+    peers = cluster.peer_sketches() if cluster is not None else []
+    if not peers:
+        return client_activity
+    merged = client_activity.empty_copy()
+    merged.merge_state(client_activity.export_state())
+    for state in peers:
+        merged.merge_state(state)
+    return merged
+
+def _peer_snapshots() -> List[Dict[str, Any]]:
+    return cluster.peer_snapshots() if cluster is not None else []
+
+def _performance_counters(peers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """performance_stats + prefilter, gộp với các worker khác ở chế độ prefork"""
+    with stats_lock:
+        stats = performance_stats.copy()
+    stats['prefilter'] = prefilter.get_stats()
+    if peers:
+        prefilter_stats = stats['prefilter']
+        stats = merge_performance([stats] + [p['performance'] for p in peers if p.get('performance')])
+        stats['prefilter'] = merge_prefilter([prefilter_stats] + [p['prefilter'] for p in peers if p.get('prefilter')])
+    if cluster is not None:
+        stats['workers'] = 1 + sum(1 for p in peers if 'pid' in p)
+    return stats
+
+def _recent_logs(limit: int, peers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    logs = [{'seq': seq, **event} for seq, event in recent_events.latest_entries(limit, raw=False)]
+    if peers:
+        logs = merge_by_seq([logs] + [p.get('events') or [] for p in peers])[-max(0, min(limit, max_recent_logs)):]
+    return logs
+
+def _merge_peer_log_entries(entries, peers, since, limit, cursor):
+    """Gộp [(seq, bytes)] của worker này với sự kiện trong snapshot của các worker khác.
+
+    Snapshot trễ tới publish_interval: cursor trả về không vượt quá thời điểm snapshot cũ nhất
+    của worker đang chạy (seq ≈ micro giây), nên sự kiện tới muộn không bị bỏ qua – đổi lại
+    client có thể nhận lại vài entry (loại trùng theo seq).
+    """
+    floor = since if since is not None else -1
+    merged = list(entries) + [
+        (event['seq'], json_dumps(event))
+        for p in peers for event in (p.get('events') or []) if event.get('seq', 0) > floor
+    ]
+    merged.sort(key=lambda entry: entry[0])
+    merged = merged[:limit] if since is not None else merged[-limit:] if limit else []
+    if merged:
+        cursor = merged[-1][0]
+    live = [int(p['time'] * 1_000_000) for p in peers if 'pid' in p and p.get('time')]
+    if live:
+        cursor = max(min(cursor, min(live)), since or 0)
+    return merged, cursor
+
+def _logs_etag(peers: List[Dict[str, Any]], since: Optional[int], limit: int) -> str:
+    """ETag của một trang /api/logs: seq đầu/cuối của mỗi nguồn cùng since/limit xác định nội dung"""
+    first, last = recent_events.bounds()
+    if not peers:
+        return f"{first}-{last}-{since if since is not None else ''}-{limit}"
+    parts = [(first, last), (since, limit)] + [
+        (p['events'][0].get('seq', 0), p['events'][-1].get('seq', 0)) if p.get('events') else (0, 0)
+        for p in peers
+    ]
+    # Order-independent: every worker computes the same tag once snapshots are current
+    return f"{zlib.crc32(repr(sorted(parts)).encode()):08x}"
+
+def _push_stats_loop():
+    """Đẩy các trường stats đã thay đổi (giá trị tuyệt đối) và detection của worker khác"""
+    last = {}
+    last_peer_seq = time.time_ns() // 1000
+    while not shutting_down.wait(stats_push_interval):
+        if not event_broadcaster.has_subscribers:
+            continue
+        try:
+            peers = _peer_snapshots()
+            stats = _performance_counters(peers)
+            changed = {key: value for key, value in stats.items() if last.get(key) != value}
+            if changed:
+                event_broadcaster.publish('stats', changed)
+                last = stats
+            if peers:
+                # Peer snapshots are published every second: forward what they added since
+                new_events = [e for e in merge_by_seq([p.get('events') or [] for p in peers])
+                              if e.get('seq', 0) > last_peer_seq]
+                if new_events:
+                    last_peer_seq = new_events[-1]['seq']
+                    event_broadcaster.publish('detections', new_events[-max_recent_logs:])
+        except Exception as e:
+            logger.warning(f"⚠️ Stats push error: {e}")
+
+def _ensure_stats_pusher():
+    global stats_pusher
+    with thread_lock:
+        if stats_pusher is None or not stats_pusher.is_alive():
+            stats_pusher = threading.Thread(target=_push_stats_loop, name='sse-stats', daemon=True)
+            stats_pusher.start()
+
 @app.route('/')
 def index():
     """Main dashboard"""
@@ -273,7 +714,9 @@ def detect_sqli():
             load_model_cached()
         
         # Process detection
+        start = time.perf_counter()
         result = detect_sqli_async(data)
+        latency_histograms['single'].record(time.perf_counter() - start)
         
         return jsonify({
             'is_sqli': result['detection']['is_sqli'],
@@ -290,30 +733,19 @@ def detect_sqli():
 
 @app.route('/api/batch-detect', methods=['POST'])
 def batch_detect():
-    """Improved batch detection with concurrent processing"""
+    """Batch detection (chunked, vectorized scoring)"""
     try:
         data = request.get_json()
         if not data or 'logs' not in data:
             return jsonify({'error': 'No logs provided'}), 400
         
-        # Process batch detection
-        futures = []
-        for log_entry in data['logs']:
-            future = executor.submit(detect_sqli_async, log_entry)
-            futures.append(future)
+        if not isinstance(data['logs'], list):
+            return jsonify({'error': 'logs must be a list'}), 400
         
-        results = []
-        for future in futures:
-            try:
-                result = future.result(timeout=30)  # 30s timeout
-                results.append(result)
-            except Exception as e:
-                logger.error(f"Batch detection error: {e}")
-                results.append({
-                    'timestamp': datetime.now().isoformat(),
-                    'log': {},
-                    'detection': {'error': str(e)}
-                })
+        # Vectorized: one model call per chunk instead of one thread-pool task per log
+        start = time.perf_counter()
+        results = detect_sqli_batch(data['logs'])
+        latency_histograms['batch'].record(time.perf_counter() - start)
         
         return jsonify({
             'results': results,
@@ -325,80 +757,267 @@ def batch_detect():
         logger.error(f"Error in batch detection: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _parse_ndjson_line(raw):
+    """(log_entry, lỗi) cho một dòng NDJSON"""
+    try:
+        return json.loads(raw), None
+    except (ValueError, UnicodeDecodeError) as e:
+        return None, f"Invalid JSON: {e}"
+
+def stream_detect_ndjson(lines, positives_only: bool = False, include_log: bool = True):
+    """Chấm một luồng dòng NDJSON theo chunk, yield từng dòng kết quả NDJSON.
+
+    Mỗi lần chỉ giữ một chunk (batch_chunk_size dòng) trong bộ nhớ; kết quả có 'line'
+    (số dòng, bắt đầu từ 1) để đối chiếu khi bỏ 'log'. Dòng cuối là {"summary": {...}}.
+    """
+    started = time.time()
+    summary = {'total_processed': 0, 'sqli_detected': 0, 'errors': 0, 'interrupted': False}
+    
+    def score(chunk):
+        # chunk: [(line_no, log_entry, parse_error)]
+        chunk_start = time.perf_counter()
+        results = iter(detect_sqli_batch([log_entry for _, log_entry, error in chunk if error is None]))
+        latency_histograms['stream'].record(time.perf_counter() - chunk_start)
+        out = []
+        for line_no, log_entry, error in chunk:
+            result = next(results) if error is None else _batch_error_result(None, error)
+            detection = result['detection']
+            summary['total_processed'] += 1
+            summary['errors'] += 'error' in detection
+            summary['sqli_detected'] += bool(detection['is_sqli'])
+            if positives_only and not detection['is_sqli'] and 'error' not in detection:
+                continue
+            # Results are shared with recent_events: build a new dict instead of popping 'log'
+            record = {'line': line_no}
+            record.update((key, value) for key, value in result.items() if include_log or key != 'log')
+            out.append(json_dumps(record))
+        return b'\n'.join(out) + b'\n' if out else b''
+    
+    chunk = []
+    for line_no, raw in enumerate(lines, 1):
+        if not raw.strip():
+            continue
+        log_entry, error = _parse_ndjson_line(raw)
+        chunk.append((line_no, log_entry, error))
+        if len(chunk) >= batch_chunk_size:
+            yield score(chunk)
+            chunk = []
+            if shutting_down.is_set():
+                # Tell the client where to resume instead of holding up shutdown
+                summary['interrupted'] = True
+                summary['resume_after_line'] = line_no
+                break
+    if chunk:
+        yield score(chunk)
+    summary['duration'] = time.time() - started
+    yield json_dumps({'summary': summary}) + b'\n'
+
+@app.route('/api/batch-detect/stream', methods=['POST'])
+def batch_detect_stream():
+    """Streaming bulk detection: NDJSON request body (chunked ok) → NDJSON results.
+
+    ?positives=1 chỉ trả về dòng SQLi (và dòng lỗi); ?include_log=0 bỏ 'log' được echo lại.
+    """
+    positives_only = request.args.get('positives', '0').lower() in ('1', 'true', 'yes')
+    include_log = request.args.get('include_log', '1').lower() not in ('0', 'false', 'no')
+    generator = stream_detect_ndjson(request.stream, positives_only=positives_only, include_log=include_log)
+    return Response(stream_with_context(generator), mimetype='application/x-ndjson')
+
 @app.route('/api/performance')
 def get_performance():
     """Get performance statistics with thread safety"""
     try:
-        with stats_lock:
-            return jsonify(_to_serializable(performance_stats.copy()))
+        peers = _peer_snapshots()
+        stats = _performance_counters(peers)
+        # p50/p90/p99/p99.9 overall and per minute; ?buckets=0 omits the raw buckets
+        # (sparse [[index, count], ...], mergeable across workers)
+        include_buckets = request.args.get('buckets', '1').lower() not in ('0', 'false', 'no')
+        stats['latency'] = {
+            kind: histogram.snapshot(include_buckets=include_buckets,
+                                     extra_states=[p['latency'][kind] for p in peers
+                                                   if kind in (p.get('latency') or {})])
+            for kind, histogram in latency_histograms.items()
+        }
+        return jsonify(stats)
     except Exception as e:
         logger.error(f"Error getting performance: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/logs')
 def get_logs():
-    """Get recent threat logs with thread safety"""
+    """Recent detections (cũ trước), mỗi entry có 'seq' tăng dần.
+
+    ?since=<seq>: chỉ sự kiện mới hơn cursor, tối đa limit; đọc tiếp bằng header X-Log-Cursor
+    (X-Log-Truncated: 1 = đã có sự kiện sau cursor rời buffer). ETag theo nội dung buffer và
+    since/limit: If-None-Match khớp → 304 không body. Trang ?since bị cắt bởi limit không có ETag
+    (còn trang sau, client phải đọc tiếp chứ không revalidate). Body được nối từ bytes JSON cache sẵn.
+    """
+    try:
+        limit = max(0, min(request.args.get('limit', 50, type=int), max_recent_logs))
+        since = request.args.get('since', type=int)
+        peers = _peer_snapshots()
+        etag = _logs_etag(peers, since, limit)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            if since is None:
+                entries, truncated = recent_events.latest_entries(limit), False
+            else:
+                entries, truncated = recent_events.since(since, limit)
+            cursor = entries[-1][0] if entries else (recent_events.last_seq if since is None else since)
+            if peers:
+                entries, cursor = _merge_peer_log_entries(entries, peers, since, limit, cursor)
+            response = Response(b'[' + b','.join(data for _, data in entries) + b']', mimetype='application/json')
+            response.headers['X-Log-Cursor'] = str(cursor)
+            if truncated:
+                response.headers['X-Log-Truncated'] = '1'
+            if since is not None and len(entries) >= limit:
+                # Cut short by limit: a later page exists, so this tag must never be revalidated
+                etag = None
+        if etag is not None:
+            response.set_etag(etag)
+        # Browsers revalidate on every poll (If-None-Match → 304) instead of refetching
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        logger.error(f"Error getting logs: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/history')
+def get_history():
+    """Lịch sử detection lâu dài (mới nhất trước), lọc theo thời gian / IP / URI template / nhóm pattern.
+
+    ?start=&end= (ISO 8601 hoặc epoch giây), ?remote_ip=, ?uri_template=, ?pattern_class=,
+    ?include_clean=1, ?limit= (≤ 1000), ?cursor= (next_cursor của trang trước).
+    """
+    store = get_history_store()
+    if store is None:
+        return jsonify({'error': 'Detection history is disabled'}), 503
+    try:
+        pattern_class = request.args.get('pattern_class') or None
+        if pattern_class and pattern_class not in CLASS_NAMES:
+            return jsonify({'error': f"Unknown pattern_class, expected one of {list(CLASS_NAMES)}"}), 400
+        try:
+            start = parse_time(request.args.get('start'))
+            end = parse_time(request.args.get('end'))
+            records, next_cursor = store.query(
+                start=start, end=end,
+                remote_ip=request.args.get('remote_ip') or None,
+                uri_template=request.args.get('uri_template') or None,
+                pattern_class=pattern_class,
+                sqli_only=request.args.get('include_clean') != '1',
+                limit=request.args.get('limit', 50, type=int),
+                cursor=request.args.get('cursor') or None
+            )
+        except ValueError as e:
+            return jsonify({'error': f"Invalid parameter: {e}"}), 400
+        # Records are stored as JSON text: the body is assembled without re-encoding them
+        body = '{"next_cursor":' + json.dumps(next_cursor) + ',"detections":[' + ','.join(records) + ']}'
+        return Response(body, mimetype='application/json')
+    except Exception as e:
+        logger.error(f"Error querying history: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stream')
+def event_stream():
+    """Server-sent events cho dashboard: 'snapshot' khi kết nối, sau đó 'detections' mới,
+    'stats' (chỉ các trường thay đổi) và 'reset'"""
+    # Subscribe before building the snapshot so nothing added in between is lost; detections in
+    # both are sent twice and the dashboard drops the repeats by seq
+    subscription = event_broadcaster.subscribe()
+    if subscription is None:
+        return jsonify({'error': 'Too many stream clients'}), 503
+    _ensure_stats_pusher()
+    peers = _peer_snapshots()
+    snapshot = format_sse('snapshot', {
+        'logs': _recent_logs(max_recent_logs, peers),
+        'stats': _performance_counters(peers)
+    })
+    response = Response(event_broadcaster.stream(subscription, [snapshot]), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Reverse proxies (nginx) must not buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/rollups')
+def get_rollups():
+    """Recent rollups of suppressed duplicate alerts"""
     try:
         limit = request.args.get('limit', 50, type=int)
         with thread_lock:
-            logs = recent_logs[-limit:] if recent_logs else []
-        return jsonify(_to_serializable(logs))
+            rollups = list(recent_rollups)[-limit:] if limit > 0 else []
+        peers = _peer_snapshots()
+        if peers and limit > 0:
+            rollups = merge_by_timestamp([rollups] + [p.get('rollups') or [] for p in peers], limit)
+        return jsonify(rollups)
     except Exception as e:
-        logger.error(f"Error getting logs: {e}")
+        logger.error(f"Error getting rollups: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/patterns')
 def get_patterns():
-    """Get pattern analysis with improved performance"""
+    """Pattern counts over the recent window (maintained incrementally, no rescan)"""
     try:
-        with thread_lock:
-            if not recent_all_logs:
-                return jsonify({'patterns': [], 'message': 'No data available'})
-            
-            # Analyze patterns from recent logs
-            patterns = {}
-            for log_entry in recent_all_logs[-100:]:  # Last 100 entries
-                detection = log_entry.get('detection', {})
-                if detection.get('is_sqli', False):
-                    pattern = detection.get('patterns', 'Unknown')
-                    if pattern in patterns:
-                        patterns[pattern] += 1
-                    else:
-                        patterns[pattern] = 1
-            
-            # Sort by frequency
-            sorted_patterns = sorted(patterns.items(), key=lambda x: x[1], reverse=True)
-            
-            return jsonify({
-                'patterns': sorted_patterns,
-                'total_threats': len([log for log in recent_all_logs if log.get('detection', {}).get('is_sqli', False)])
-            })
+        limit = request.args.get('limit', 10, type=int)
+        peers = _peer_snapshots()
+        if not len(recent_events) and not any(p.get('events') for p in peers):
+            return jsonify({'patterns': [], 'message': 'No data available'})
+        if peers:
+            # Each worker counts over its own recent window
+            top_patterns, total_threats = recent_events.pattern_summary()
+            counts = Counter(dict(top_patterns))
+            for p in peers:
+                counts.update(p.get('patterns') or {})
+                total_threats += p.get('threats', 0)
+            top_patterns = counts.most_common(limit)
+        else:
+            top_patterns, total_threats = recent_events.pattern_summary(limit)
+        return jsonify({
+            'patterns': top_patterns,
+            'total_threats': total_threats
+        })
         
     except Exception as e:
         logger.error(f"Error getting patterns: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/clients')
+def get_clients():
+    """Clients currently flagged as scanning campaigns (sliding window)"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        view = _client_activity_view()
+        return jsonify({
+            'campaigns': view.campaigns(limit=limit),
+            'window_seconds': view.window_seconds,
+            'stats': view.get_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error getting client activity: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/clients/<remote_ip>')
+def get_client(remote_ip):
+    """Windowed request / suspicious / distinct-URI estimates for one client"""
+    try:
+        return jsonify(_client_activity_view().query(remote_ip, request.args.get('user_agent')))
+    except Exception as e:
+        logger.error(f"Error getting client activity: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/clear-cache', methods=['POST'])
 def clear_cache():
     """Clear cache and reset statistics"""
     try:
-        global model_cache, performance_stats, recent_logs, recent_all_logs
+        global model_cache
         
-        with thread_lock:
-            model_cache.clear()
-            recent_logs.clear()
-            recent_all_logs.clear()
-        
-        with stats_lock:
-            performance_stats = {
-                'total_logs': 0,
-                'sqli_detected': 0,
-                'clean_logs': 0,
-                'false_positives': 0,
-                'detection_rate': 0.0,
-                'false_positive_rate': 0.0,
-                'avg_processing_time': 0.0
-            }
+        # Requests already holding a model finish with it; the next one reloads
+        with model_load_lock:
+            model_cache = {}
+        _reset_local_state()
+        if cluster is not None:
+            # Other workers reset on their next publish tick
+            cluster.request_reset()
         
         logger.info("Cache cleared and statistics reset")
         return jsonify({'message': 'Cache cleared successfully'})
@@ -407,6 +1026,23 @@ def clear_cache():
         logger.error(f"Error clearing cache: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/reload-model', methods=['POST'])
+def reload_model_endpoint():
+    """Reload the model from disk without blocking detection requests (prefork: rolling reload via the master)"""
+    if ingest_token and request.headers.get('X-Ingest-Token') != ingest_token:
+        return jsonify({'error': 'Invalid ingest token'}), 403
+    try:
+        if cluster is not None:
+            # Prefork: the master reloads once and replaces every worker (rolling, see prefork_server)
+            os.kill(os.getppid(), signal.SIGHUP)
+            return jsonify({'message': 'Model reload requested (rolling restart of all workers)',
+                            'model_version': load_model_cached().version})
+        model = reload_model()
+        return jsonify({'message': 'Model reloaded', 'model_version': model.version})
+    except Exception as e:
+        logger.error(f"Error reloading model: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/realtime-detect', methods=['GET', 'POST'])
 def realtime_detect():
     """Realtime detection endpoint with improved handling"""
@@ -418,16 +1054,30 @@ def realtime_detect():
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
+        # Periodic rollup of alerts the collector suppressed as duplicates
+        if data.get('type') == 'rollup':
+            if ingest_token and request.headers.get('X-Ingest-Token') != ingest_token:
+                return jsonify({'error': 'Invalid ingest token'}), 403
+            suppressed = record_alert_rollups(data.get('rollups') or [])
+            return jsonify({'status': 'success', 'message': 'Rollups recorded', 'suppressed': suppressed})
+        
         # Extract log and detection data
         log_entry = data.get('log', {})
-        detection = data.get('detection', {})
+        detection = data.get('detection') or {}
         
-        # Process detection
-        result = detect_sqli_async(log_entry)
+        # Trusted verdicts are only recorded (record mode); otherwise scored locally
+        start = time.perf_counter()
+        if _needs_rescore(data, detection):
+            result = detect_sqli_async(log_entry)
+            message = 'Detection processed'
+        else:
+            result = record_precomputed_detection(log_entry, detection)
+            message = 'Detection recorded'
+        latency_histograms['realtime'].record(time.perf_counter() - start)
         
         return jsonify({
             'status': 'success',
-            'message': 'Detection processed',
+            'message': message,
             'is_sqli': result['detection']['is_sqli'],
             'score': result['detection']['score'],
             'patterns': result['detection']['patterns'],
@@ -438,13 +1088,47 @@ def realtime_detect():
         logger.error(f"Error in realtime detection: {e}")
         return jsonify({'error': str(e)}), 500
 
-def shutdown_handler():
-    """Graceful shutdown handler"""
-    logger.info("Shutting down application...")
-    executor.shutdown(wait=True)
-    logger.info("Application shutdown complete")
+def shutdown_handler(timeout=None):
+    """Graceful shutdown: chờ detection đang chạy trong deadline, dừng feature pool, flush log"""
+    if shutting_down.is_set():
+        return
+    shutting_down.set()
+    # Dashboard streams never finish on their own
+    event_broadcaster.close()
+    timeout = shutdown_timeout if timeout is None else timeout
+    logger.info(f"Shutting down application (drain deadline {timeout:.0f}s)...")
+    started = time.time()
+    
+    # Batch/stream requests still running (NDJSON streams stop at their next chunk boundary)
+    deadline = started + timeout
+    with inflight_changed:
+        while inflight_requests and time.time() < deadline:
+            inflight_changed.wait(deadline - time.time())
+        pending = inflight_requests
+    if pending:
+        logger.warning(f"⏱️ Drain deadline reached with {pending} detection requests still running")
+    if feature_pool is not None:
+        # Parts of a batch still queued are cancelled; the request waiting on them fails
+        feature_pool.shutdown(wait=False, cancel_futures=True)
+    if cluster is not None:
+        # Final counters; the prefork master folds them into the retired totals
+        cluster.stop_publishing(local_snapshot())
+    if history_store is not None and history_store.pid == os.getpid():
+        history_store.close(max(1.0, timeout - (time.time() - started)))
+
+    with stats_lock:
+        summary = dict(performance_stats)
+    logger.info(f"Application shutdown complete in {time.time() - started:.1f}s: "
+                f"{summary['total_logs']} processed, {summary['sqli_detected']} SQLi")
+    stop_async_logging()
+
+def _handle_sigterm(signum, frame):
+    # Leave app.run() so the finally block below drains and flushes
+    logger.info("Received SIGTERM, shutting down gracefully...")
+    sys.exit(0)
 
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, _handle_sigterm)
     try:
         # Load AI model
         load_model_cached()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Async Logging – đưa I/O của logging ra khỏi luồng detection
+
+- Logger chỉ đẩy LogRecord vào queue (không format, không ghi file trên thread gọi)
+- Một QueueListener ở background format và ghi ra file + stderr
+- Record có thuộc tính `event` (dict) được ghi thành một dòng JSON duy nhất
+- Queue có giới hạn: khi đầy, record bị bỏ và được đếm thay vì chặn detection
+- Sau fork (prefork server, process pool) process con tự khởi động listener riêng
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+# Handlers held locked across fork() (see _before_fork)
+_fork_locked = []
+
+
+class StructuredFormatter(logging.Formatter):
+    """Format như cũ; nếu record mang `event` thì message là JSON một dòng (json_lines=True: cả dòng là JSON)"""
+
+    def __init__(self, fmt=LOG_FORMAT, json_lines=False):
+        super().__init__(fmt)
+        self.json_lines = json_lines
+
+    def format(self, record):
+        event = getattr(record, 'event', None)
+        if self.json_lines:
+            data = {
+                'time': self.formatTime(record),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage()
+            }
+            if event is not None:
+                data['event'] = event
+            if record.exc_info:
+                data['exc_info'] = self.formatException(record.exc_info)
+            return json.dumps(data, ensure_ascii=False, default=str)
+        if event is not None:
+            record = logging.makeLogRecord(record.__dict__)
+            record.msg = f"{record.getMessage()} {json.dumps(event, ensure_ascii=False, default=str)}"
+            record.args = None
+        return super().format(record)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler không format trên thread gọi và không chặn khi queue đầy"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Same process: no need to pre-format/pickle; only freeze the message arguments
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def setup_async_logging(log_file=None, level=logging.INFO, json_lines=False, queue_size=10000):
+    """Cấu hình root logger: QueueHandler → QueueListener(FileHandler, StreamHandler).
+
+    Thay thế mọi handler đã có trên root (kể cả do basicConfig của module khác).
+    Trả về listener; listener được dừng (flush hết queue) khi process thoát.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    formatter = StructuredFormatter(json_lines=json_lines)
+    handlers = []
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_async_logging():
+    """Flush queue và dừng listener (idempotent)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _before_fork():
+    # A write in progress on the listener thread would leave the child's copy of the file
+    # buffer locked forever: hold every handler lock so fork() happens between records
+    if _listener is not None:
+        for handler in _listener.handlers:
+            handler.acquire()
+            _fork_locked.append(handler)
+
+
+def _after_fork_in_parent():
+    while _fork_locked:
+        _fork_locked.pop().release()
+
+
+def _restart_after_fork():
+    """Listener thread không tồn tại trong process con: tạo queue + listener mới, giữ nguyên handlers"""
+    global _listener
+    # logging re-creates handler locks in the child; just forget them
+    _fork_locked.clear()
+    if _listener is None:
+        return
+    handlers = _listener.handlers
+    # The parent's queue may have been locked mid-operation at fork time; never touch it
+    log_queue = queue.Queue(maxsize=_listener.queue.maxsize)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+atexit.register(stop_async_logging)
+os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent,
+                    after_in_child=_restart_after_fork)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Backfill Scanner – quét lại log lịch sử (kể cả access.log.N.gz) bằng model hiện tại
+
+- Nhận file hoặc glob; file thường đọc qua mmap, file .gz giải nén dạng stream
+- File lớn được chia thành các đoạn byte (căn theo dòng) và chia cho process pool
+- Chấm điểm theo lô bằng predict_batch
+- Ghi báo cáo NDJSON các detection + file thống kê tổng hợp
+- Có checkpoint để resume sau khi bị ngắt, log tiến độ và throughput
+
+Ví dụ:
+    python backfill_scanner.py '/var/log/apache2/access.log*' --log-format combined \\
+        --report backfill_report.ndjson --workers 8
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import logging
+import mmap
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from log_line_parser import create_log_parser
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = 'models/optimized_sqli_detector.pkl'
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+DEFAULT_BATCH_SIZE = 512
+
+# Per-process state, set by _init_worker
+_worker_detector = None
+_worker_parser = None
+_worker_batch_size = DEFAULT_BATCH_SIZE
+
+
+def expand_inputs(patterns):
+    """Mở rộng danh sách file/glob thành danh sách file (giữ thứ tự, bỏ trùng)"""
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            path = os.path.abspath(path)
+            if path not in seen and os.path.isfile(path):
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def plan_tasks(paths, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Chia công việc: file .gz là một task, file thường chia thành các đoạn byte"""
+    tasks = []
+    for path in paths:
+        st = os.stat(path)
+        # size + mtime in the id so a changed file is rescanned on resume
+        fingerprint = f"{st.st_size}:{int(st.st_mtime)}"
+        if path.endswith('.gz'):
+            tasks.append({'id': f"{path}|{fingerprint}|gz", 'path': path, 'start': 0, 'end': None})
+            continue
+        if st.st_size == 0:
+            continue
+        for start in range(0, st.st_size, chunk_bytes):
+            end = min(start + chunk_bytes, st.st_size)
+            tasks.append({'id': f"{path}|{fingerprint}|{start}-{end}", 'path': path, 'start': start, 'end': end})
+    return tasks
+
+
+def _iter_mmap_lines(path, start, end):
+    """(byte offset, dòng) cho các dòng có byte đầu tiên nằm trong [start, end) – đọc qua mmap"""
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            if start == 0:
+                pos = 0
+            else:
+                nl = mm.find(b'\n', start - 1)
+                pos = size if nl == -1 else nl + 1
+            while pos < end:
+                nl = mm.find(b'\n', pos)
+                line_end = size if nl == -1 else nl
+                yield pos, mm[pos:line_end]
+                pos = line_end + 1
+
+
+def _iter_gzip_lines(path):
+    """(số dòng, dòng) – giải nén dạng stream"""
+    with gzip.open(path, 'rb') as f:
+        for line_no, line in enumerate(f, 1):
+            yield line_no, line.rstrip(b'\n')
+
+
+def _init_worker(model_path, log_format, batch_size):
+    """Mỗi process load model một lần"""
+    global _worker_detector, _worker_parser, _worker_batch_size
+    from optimized_sqli_detector import OptimizedSQLIDetector
+
+    logging.getLogger('optimized_sqli_detector').setLevel(logging.WARNING)
+    _worker_detector = OptimizedSQLIDetector()
+    _worker_detector.load_model(model_path)
+    # Parallelism comes from the process pool; avoid oversubscribing each worker
+    _worker_detector.isolation_forest.n_jobs = 1
+    _worker_parser = create_log_parser(log_format)
+    _worker_batch_size = batch_size
+
+
+def _score_batch(entries, positions, path, position_key, detections, pattern_counts):
+    results = _worker_detector.predict_batch(entries)
+    for entry, position, (is_sqli, score, patterns, confidence) in zip(entries, positions, results):
+        if not is_sqli:
+            continue
+        patterns = list(patterns)
+        pattern_counts.update(patterns)
+        detections.append({
+            'source_file': path,
+            position_key: position,
+            'log': entry,
+            'detection': {
+                'is_sqli': True,
+                'score': float(score),
+                'patterns': patterns,
+                'confidence': confidence
+            }
+        })
+
+
+def scan_task(task):
+    """Quét một task trong worker process, trả về detections + thống kê"""
+    path = task['path']
+    if task['end'] is None:
+        lines = _iter_gzip_lines(path)
+        position_key = 'line'
+    else:
+        lines = _iter_mmap_lines(path, task['start'], task['end'])
+        position_key = 'offset'
+
+    stats = Counter()
+    detections = []
+    pattern_counts = Counter()
+    ips = Counter()
+    entries, positions = [], []
+    for position, raw in lines:
+        stats['lines'] += 1
+        stats['bytes'] += len(raw) + 1
+        if not raw.strip():
+            continue
+        entry = _worker_parser.parse(raw.decode('utf-8', errors='replace'))
+        if not entry:
+            stats['parse_failures'] += 1
+            continue
+        entries.append(entry)
+        positions.append(position)
+        if len(entries) >= _worker_batch_size:
+            _score_batch(entries, positions, path, position_key, detections, pattern_counts)
+            stats['scored'] += len(entries)
+            entries, positions = [], []
+    if entries:
+        _score_batch(entries, positions, path, position_key, detections, pattern_counts)
+        stats['scored'] += len(entries)
+
+    for d in detections:
+        ips[d['log'].get('remote_ip', '')] += 1
+    stats['detections'] = len(detections)
+    return {
+        'id': task['id'],
+        'detections': detections,
+        'stats': dict(stats),
+        'patterns': dict(pattern_counts),
+        'ips': dict(ips)
+    }
+
+
+class BackfillCheckpoint:
+    """Checkpoint dạng JSONL: mỗi task hoàn thành một dòng (kèm thống kê để resume tổng hợp)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        self.completed[rec['id']] = rec
+                    except (json.JSONDecodeError, KeyError):
+                        continue  # torn last line after a crash
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def mark_done(self, result):
+        rec = {k: result[k] for k in ('id', 'stats', 'patterns', 'ips')}
+        self.completed[rec['id']] = rec
+        self._file.write(json.dumps(rec) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _merge(summary, result):
+    summary['stats'].update(result['stats'])
+    summary['patterns'].update(result['patterns'])
+    summary['ips'].update(result['ips'])
+
+
+def run_backfill(inputs, report_path='backfill_report.ndjson', model_path=DEFAULT_MODEL_PATH,
+                 log_format='json', workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                 batch_size=DEFAULT_BATCH_SIZE, resume=True, progress_interval=5.0):
+    """Chạy backfill, trả về dict thống kê tổng hợp"""
+    paths = expand_inputs(inputs)
+    if not paths:
+        raise FileNotFoundError(f"No input files match {inputs}")
+    tasks = plan_tasks(paths, chunk_bytes)
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+
+    checkpoint_path = report_path + '.checkpoint'
+    if not resume:
+        for stale in (report_path, checkpoint_path):
+            if os.path.exists(stale):
+                os.remove(stale)
+    checkpoint = BackfillCheckpoint(checkpoint_path)
+
+    summary = {'stats': Counter(), 'patterns': Counter(), 'ips': Counter()}
+    pending = []
+    for task in tasks:
+        done = checkpoint.completed.get(task['id'])
+        if done:
+            _merge(summary, done)
+        else:
+            pending.append(task)
+    if len(pending) < len(tasks):
+        logger.info(f"♻️ Resuming: {len(tasks) - len(pending)}/{len(tasks)} tasks already done")
+
+    workers = workers or os.cpu_count() or 1
+    logger.info(f"🚀 Backfill: {len(paths)} files, {total_bytes / 1e6:.1f} MB, "
+                f"{len(pending)} tasks, {workers} workers")
+
+    start = time.time()
+    last_progress = start
+    session = Counter()
+    with open(report_path, 'a', encoding='utf-8') as report, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(model_path, log_format, batch_size)) as pool:
+        try:
+            futures = [pool.submit(scan_task, task) for task in pending]
+            for n, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                # Report first, then checkpoint: an interruption in between re-scans one task
+                for detection in result['detections']:
+                    report.write(json.dumps(detection, default=str) + '\n')
+                report.flush()
+                checkpoint.mark_done(result)
+                _merge(summary, result)
+                session.update(result['stats'])
+
+                now = time.time()
+                if now - last_progress >= progress_interval or n == len(futures):
+                    elapsed = max(now - start, 1e-9)
+                    logger.info(
+                        f"📊 {n}/{len(futures)} tasks | {session['lines']:,} lines "
+                        f"({session['lines'] / elapsed:,.0f}/s, {session['bytes'] / elapsed / 1e6:.1f} MB/s) | "
+                        f"{summary['stats']['detections']:,} detections"
+                    )
+                    last_progress = now
+        except KeyboardInterrupt:
+            logger.warning("Interrupted – completed tasks are checkpointed, rerun to resume")
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            checkpoint.close()
+
+    elapsed = time.time() - start
+    stats = summary['stats']
+    result = {
+        'finished_at': datetime.now().isoformat(),
+        'inputs': paths,
+        'log_format': log_format,
+        'model_path': model_path,
+        'total_lines': stats['lines'],
+        'total_bytes': stats['bytes'],
+        'scored': stats['scored'],
+        'parse_failures': stats['parse_failures'],
+        'detections': stats['detections'],
+        'detection_rate': stats['detections'] / stats['scored'] if stats['scored'] else 0.0,
+        'elapsed_seconds': elapsed,
+        'lines_per_second': session['lines'] / elapsed if elapsed > 0 else 0.0,
+        'top_patterns': summary['patterns'].most_common(20),
+        'top_ips': summary['ips'].most_common(20)
+    }
+    with open(report_path + '.summary.json', 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    logger.info(f"✅ Backfill done: {result['detections']:,} detections in {result['scored']:,} logs "
+                f"({result['lines_per_second']:,.0f} lines/s) → {report_path}")
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Quét lại log lịch sử bằng model SQLi hiện tại')
+    ap.add_argument('inputs', nargs='+', help='File hoặc glob (hỗ trợ .gz)')
+    ap.add_argument('--report', default='backfill_report.ndjson', help='File NDJSON kết quả')
+    ap.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    ap.add_argument('--log-format', default='json',
+                    help="'json', 'combined', 'common' hoặc chuỗi LogFormat của Apache")
+    ap.add_argument('--workers', type=int, default=None, help='Số process (mặc định: số CPU)')
+    ap.add_argument('--chunk-mb', type=int, default=DEFAULT_CHUNK_BYTES // (1024 * 1024))
+    ap.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    ap.add_argument('--no-resume', action='store_true', help='Bỏ checkpoint cũ, quét lại từ đầu')
+    args = ap.parse_args(argv)
+
+    try:
+        summary = run_backfill(
+            args.inputs, report_path=args.report, model_path=args.model, log_format=args.log_format,
+            workers=args.workers, chunk_bytes=args.chunk_mb * 1024 * 1024,
+            batch_size=args.batch_size, resume=not args.no_resume
+        )
+    except KeyboardInterrupt:
+        return 130
+    except FileNotFoundError as e:
+        logger.error(f"❌ {e}")
+        return 1
+    print(json.dumps({k: v for k, v in summary.items() if k != 'inputs'}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark các parser log: json.loads / JsonLogParser (access_full_json.log)
+so với ApacheLogFormatParser (combined/common)
+
+Chạy: python bench_log_parsers.py [--lines 20000] [--repeat 15]
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from log_line_parser import ApacheLogFormatParser, JsonLogParser, fast_json_loads
+
+SAMPLE_REQUESTS = [
+    ('GET', '/index.php', '', 200, 5120),
+    ('GET', '/static/css/site.css', '', 200, 18230),
+    ('GET', '/products.php', 'id=42&sort=price', 200, 7311),
+    ('POST', '/login.php', '', 302, 512),
+    ('GET', '/vulnerabilities/sqli/', "id=1%27+OR+1%3D1--+&Submit=Submit", 200, 4410),
+    ('GET', '/search', 'q=union+select+1,2,3+from+information_schema.tables', 200, 3301),
+]
+SAMPLE_UA = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+def build_samples(count):
+    """Sinh cùng một tập request ở cả hai định dạng"""
+    json_lines, combined_lines = [], []
+    for i in range(count):
+        method, uri, qs, status, size = SAMPLE_REQUESTS[i % len(SAMPLE_REQUESTS)]
+        ip = f"10.0.{(i >> 8) & 255}.{i & 255}"
+        entry = {
+            'time': '2025-10-10T13:55:36+07:00', 'remote_ip': ip, 'method': method, 'uri': uri,
+            'query_string': qs, 'status': status, 'bytes_sent': size, 'response_time_ms': 12,
+            'referer': 'http://example.com/', 'user_agent': SAMPLE_UA, 'request_length': 431,
+            'response_length': size + 230, 'cookie': 'PHPSESSID=abc123; security=low', 'payload': ''
+        }
+        json_lines.append(json.dumps(entry))
+        request = f"{method} {uri}{'?' + qs if qs else ''} HTTP/1.1"
+        combined_lines.append(
+            f'{ip} - - [10/Oct/2025:13:55:36 +0700] "{request}" {status} {size} '
+            f'"http://example.com/" "{SAMPLE_UA}"'
+        )
+    return json_lines, combined_lines
+
+
+def _run(func, lines):
+    start = time.perf_counter()
+    for line in lines:
+        func(line)
+    return time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--lines', type=int, default=20000)
+    ap.add_argument('--repeat', type=int, default=15)
+    args = ap.parse_args()
+
+    json_lines, combined_lines = build_samples(args.lines)
+    common_parser = ApacheLogFormatParser('common')
+    common_lines = [line.rsplit(' "', 2)[0] for line in combined_lines]
+
+    benches = [
+        ('json.loads (stdlib, JSON format)', json.loads, json_lines),
+        ('fast_json_loads (JSON format)', fast_json_loads, json_lines),
+        ('JsonLogParser.parse (JSON format)', JsonLogParser().parse, json_lines),
+        ('ApacheLogFormatParser (combined)', ApacheLogFormatParser('combined').parse, combined_lines),
+        ('ApacheLogFormatParser (common)', common_parser.parse, common_lines),
+    ]
+    # Rounds are interleaved so machine noise hits every parser alike; the ratio is the
+    # median of per-round ratios rather than a comparison of two unrelated best cases
+    timings = {name: [] for name, _, _ in benches}
+    for _ in range(args.repeat):
+        for name, func, lines in benches:
+            timings[name].append(_run(func, lines))
+
+    print(f"{args.lines} lines, best of {args.repeat} interleaved rounds")
+    for name, _, lines in benches:
+        best = min(timings[name])
+        print(f"{name:<40} {best / len(lines) * 1e6:8.2f} us/line {len(lines) / best:12,.0f} lines/s")
+    ratios = [j / c for j, c in zip(timings['json.loads (stdlib, JSON format)'],
+                                    timings['ApacheLogFormatParser (combined)'])]
+    print(f"combined vs json.loads: {statistics.median(ratios):.2f}x (median of {len(ratios)} rounds, "
+          f"range {min(ratios):.2f}x-{max(ratios):.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Client Aggregator – thống kê theo client (remote_ip, tuỳ chọn IP + user agent) trên cửa sổ trượt
+
+- Bộ nhớ cố định bất kể số client: count-min sketch cho số request / số hit đáng ngờ,
+  ma trận HyperLogLog (mỗi ô CMS một HLL nhỏ) để ước lượng số URI khác nhau
+- Cửa sổ trượt gồm nhiều bucket thời gian; bucket hết hạn được xoá khi quay vòng
+- Bảng ứng viên giới hạn (top-K) để liệt kê các client đang scan mà không cần lưu mọi IP
+- Gộp được giữa nhiều process (prefork): CMS cộng từng ô, HLL lấy max từng register,
+  bucket căn theo epoch thời gian nên mọi process dùng cùng một lưới
+"""
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+KEY_MODES = ('ip', 'ip_ua')
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'replace'), digest_size=8).digest(), 'little')
+
+
+class ClientActivityAggregator:
+    """Sliding-window per-client counters với bộ nhớ cố định.
+
+    Tham số:
+    - window_seconds / bucket_seconds: độ dài cửa sổ và độ mịn của việc hết hạn
+    - width / depth: kích thước count-min sketch (sai số ~ e/width * tổng request, xác suất e^-depth)
+    - hll_registers: số register HLL mỗi ô (lũy thừa 2; 64 → sai số ~13%)
+    - top_k: số client ứng viên được theo dõi để liệt kê campaign
+    - admit_requests: chỉ client có ít nhất số request này trong một bucket mới vào bảng ứng viên;
+      khi bảng đầy, client mới chỉ thay được ứng viên yếu nhất (im lặng hết cửa sổ, hoặc đỉnh
+      request/bucket thấp nhất) nếu số request của nó lớn hơn → IP chỉ gửi vài request (kể cả khi
+      CMS ước lượng dư) không đẩy được scanner đang tạm dừng ra khỏi bảng
+    - key_mode: 'ip' hoặc 'ip_ua'
+    - min_requests / suspicious_ratio / min_suspicious / min_distinct_uris: ngưỡng gắn cờ scan
+    - check_interval: check_campaign đánh giá lại mỗi client tối đa một lần trong khoảng này
+    """
+
+    def __init__(self, window_seconds=300, bucket_seconds=30, width=2048, depth=4,
+                 hll_registers=64, top_k=1000, key_mode='ip', min_requests=100,
+                 suspicious_ratio=0.2, min_suspicious=20, min_distinct_uris=100, admit_requests=None,
+                 check_interval=1.0):
+        if key_mode not in KEY_MODES:
+            raise ValueError(f"key_mode must be one of {KEY_MODES}, got {key_mode!r}")
+        if hll_registers & (hll_registers - 1):
+            raise ValueError("hll_registers must be a power of two")
+        if depth > 8:
+            raise ValueError("depth must be <= 8")
+        self._options = dict(
+            window_seconds=window_seconds, bucket_seconds=bucket_seconds, width=width, depth=depth,
+            hll_registers=hll_registers, top_k=top_k, key_mode=key_mode, min_requests=min_requests,
+            suspicious_ratio=suspicious_ratio, min_suspicious=min_suspicious,
+            min_distinct_uris=min_distinct_uris, admit_requests=admit_requests, check_interval=check_interval
+        )
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = max(1, -(-window_seconds // bucket_seconds))
+        self.width = width
+        self.depth = depth
+        self.hll_registers = hll_registers
+        self._hll_bits = hll_registers.bit_length() - 1
+        self.top_k = top_k
+        self.key_mode = key_mode
+        self.min_requests = min_requests
+        self.suspicious_ratio = suspicious_ratio
+        self.min_suspicious = min_suspicious
+        self.min_distinct_uris = min_distinct_uris
+        self.admit_requests = admit_requests if admit_requests is not None else max(1, min_requests // 10)
+        self.check_interval = check_interval
+
+        shape = (self.bucket_count, depth, width)
+        self._requests = np.zeros(shape, dtype=np.uint32)
+        self._suspicious = np.zeros(shape, dtype=np.uint32)
+        self._hll = np.zeros(shape + (hll_registers,), dtype=np.uint8)
+        self._bucket_epoch = np.full(self.bucket_count, -1, dtype=np.int64)
+        self._rows = np.arange(depth)
+        # HLL bias correction (Flajolet et al.)
+        m = hll_registers
+        self._hll_alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+
+        self._candidates = {}
+        # Các ứng viên yếu nhất [(giá trị, key)] giảm dần, cache theo bucket: từ chối/thay thế O(1)
+        self._victims = []
+        self._victims_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'records': 0, 'candidate_evictions': 0, 'candidate_rejections': 0}
+
+    def client_key(self, remote_ip, user_agent=None):
+        if self.key_mode == 'ip_ua':
+            return f"{remote_ip}|{user_agent or ''}"
+        return remote_ip or ''
+
+    def _columns(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8', 'replace'), digest_size=4 * self.depth).digest()
+        return np.frombuffer(digest, dtype='<u4') % self.width
+
+    def _slot(self, now):
+        epoch = int(now // self.bucket_seconds)
+        slot = epoch % self.bucket_count
+        if self._bucket_epoch[slot] != epoch:
+            # Bucket quay vòng: xoá dữ liệu cũ hơn cửa sổ
+            self._requests[slot] = 0
+            self._suspicious[slot] = 0
+            self._hll[slot] = 0
+            self._bucket_epoch[slot] = epoch
+        return slot
+
+    def _live_slots(self, now):
+        epoch = int(now // self.bucket_seconds)
+        return np.nonzero(self._bucket_epoch > epoch - self.bucket_count)[0]
+
+    def record(self, log_entry, suspicious=False, now=None):
+        """Ghi nhận một request; trả về key của client"""
+        now = time.time() if now is None else now
+        key = self.client_key(log_entry.get('remote_ip', ''), log_entry.get('user_agent'))
+        cols = self._columns(key)
+        uri_hash = _hash64(log_entry.get('uri', '') or '')
+        register = uri_hash & (self.hll_registers - 1)
+        rest = uri_hash >> self._hll_bits
+        rank = min(64 - self._hll_bits - rest.bit_length() + 1, 255)
+        with self._lock:
+            slot = self._slot(now)
+            requests, suspicious_hits, hll = self._requests[slot], self._suspicious[slot], self._hll[slot]
+            # Scalar updates: with depth <= 8 this is far cheaper than numpy fancy indexing
+            bucket_requests = None
+            for row, col in enumerate(cols.tolist()):
+                requests[row, col] += 1
+                count = requests[row, col]
+                bucket_requests = count if bucket_requests is None or count < bucket_requests else bucket_requests
+                if suspicious:
+                    suspicious_hits[row, col] += 1
+                if hll[row, col, register] < rank:
+                    hll[row, col, register] = rank
+            self.stats['records'] += 1
+            candidate = self._candidates.get(key)
+            if candidate is not None:
+                candidate['last_seen'] = now
+                if bucket_requests > candidate['peak']:
+                    candidate['peak'] = int(bucket_requests)
+            elif bucket_requests >= self.admit_requests:
+                self._admit_candidate_locked(key, log_entry, now, int(bucket_requests))
+        return key
+
+    def _candidate_value(self, candidate, now):
+        """Giá trị giữ chỗ của ứng viên: 0 nếu im lặng hết cửa sổ, ngược lại đỉnh request/bucket"""
+        if candidate['last_seen'] < now - self.window_seconds:
+            return 0
+        return candidate['peak']
+
+    def _victim_locked(self, now):
+        victims = self._victims
+        if now - self._victims_at >= self.bucket_seconds:
+            victims.clear()
+        while True:
+            while victims:
+                value, key = victims[-1]
+                candidate = self._candidates.get(key)
+                if candidate is not None and self._candidate_value(candidate, now) == value:
+                    return key, value
+                victims.pop()  # đã bị thay hoặc đã nhận thêm request từ lần quét trước
+            # O(top_k), tối đa một lần mỗi bucket hoặc mỗi 64 lần thay ứng viên
+            victims[:] = heapq.nsmallest(64, ((self._candidate_value(c, now), k)
+                                              for k, c in self._candidates.items()))
+            victims.reverse()
+            self._victims_at = now
+            if not victims:
+                return None, float('inf')  # top_k = 0
+
+    def _admit_candidate_locked(self, key, log_entry, now, bucket_requests):
+        if len(self._candidates) >= self.top_k:
+            victim_key, victim_value = self._victim_locked(now)
+            if bucket_requests <= victim_value:
+                self.stats['candidate_rejections'] += 1
+                return
+            del self._candidates[victim_key]
+            self._victims.pop()
+            self.stats['candidate_evictions'] += 1
+        self._candidates[key] = {
+            'remote_ip': log_entry.get('remote_ip', ''),
+            'user_agent': log_entry.get('user_agent', '') if self.key_mode == 'ip_ua' else None,
+            'first_seen': now,
+            'last_seen': now,
+            'peak': bucket_requests,
+            'checked_at': 0.0,
+            'flagged': False
+        }
+
+    def _estimate_locked(self, key, now):
+        cols = self._columns(key)
+        slots = self._live_slots(now)
+        if len(slots) == 0:
+            return 0, 0, 0
+        index = (slots[:, None], self._rows[None, :], cols[None, :])
+        requests = int(self._requests[index].sum(axis=0).min())
+        suspicious = int(self._suspicious[index].sum(axis=0).min())
+        # HLL union over the window = register-wise max; every row over-estimates, take the min
+        registers = self._hll[index].max(axis=0).astype(np.float64)
+        m = self.hll_registers
+        estimates = self._hll_alpha * m * m / np.power(2.0, -registers).sum(axis=1)
+        zeros = (registers == 0).sum(axis=1)
+        small = (estimates <= 2.5 * m) & (zeros > 0)
+        estimates[small] = m * np.log(m / zeros[small])
+        distinct = int(round(estimates.min()))
+        return requests, suspicious, min(distinct, requests)
+
+    def _assess(self, requests, suspicious, distinct):
+        reasons = []
+        if requests >= self.min_requests:
+            if suspicious >= self.min_suspicious and suspicious >= requests * self.suspicious_ratio:
+                reasons.append('suspicious_volume')
+            if distinct >= self.min_distinct_uris:
+                reasons.append('uri_enumeration')
+        return reasons
+
+    def query(self, remote_ip, user_agent=None, now=None):
+        """Thống kê cửa sổ hiện tại của một client"""
+        now = time.time() if now is None else now
+        key = self.client_key(remote_ip, user_agent)
+        with self._lock:
+            requests, suspicious, distinct = self._estimate_locked(key, now)
+        reasons = self._assess(requests, suspicious, distinct)
+        return {
+            'client': key,
+            'remote_ip': remote_ip,
+            'requests': requests,
+            'suspicious': suspicious,
+            'distinct_uris': distinct,
+            'window_seconds': self.window_seconds,
+            'scanning': bool(reasons),
+            'reasons': reasons
+        }
+
+    def check_campaign(self, log_entry, now=None):
+        """Trả về thống kê nếu client vừa bị gắn cờ scan lần đầu trong cửa sổ, ngược lại None"""
+        now = time.time() if now is None else now
+        key = self.client_key(log_entry.get('remote_ip', ''), log_entry.get('user_agent'))
+        with self._lock:
+            candidate = self._candidates.get(key)
+            if candidate is None or now - candidate['checked_at'] < self.check_interval:
+                return None
+            candidate['checked_at'] = now
+            requests, suspicious, distinct = self._estimate_locked(key, now)
+            reasons = self._assess(requests, suspicious, distinct)
+            newly_flagged = bool(reasons) and not candidate['flagged']
+            candidate['flagged'] = bool(reasons)
+        if not newly_flagged:
+            return None
+        return {'client': key, 'remote_ip': candidate['remote_ip'], 'requests': requests,
+                'suspicious': suspicious, 'distinct_uris': distinct, 'reasons': reasons}
+
+    def campaigns(self, limit=50, now=None):
+        """Các client ứng viên đang bị gắn cờ scan, nhiều hit đáng ngờ nhất trước"""
+        now = time.time() if now is None else now
+        flagged = []
+        with self._lock:
+            horizon = now - self.window_seconds
+            for key, candidate in self._candidates.items():
+                if candidate['last_seen'] < horizon:
+                    continue
+                requests, suspicious, distinct = self._estimate_locked(key, now)
+                reasons = self._assess(requests, suspicious, distinct)
+                if reasons:
+                    flagged.append({
+                        'client': key,
+                        'remote_ip': candidate['remote_ip'],
+                        'user_agent': candidate['user_agent'],
+                        'requests': requests,
+                        'suspicious': suspicious,
+                        'distinct_uris': distinct,
+                        'reasons': reasons,
+                        'first_seen': candidate['first_seen'],
+                        'last_seen': candidate['last_seen']
+                    })
+        flagged.sort(key=lambda c: (c['suspicious'], c['requests']), reverse=True)
+        return flagged[:limit]
+
+    # Cross-process merge (prefork workers)
+    _SKETCH_OPTIONS = ('window_seconds', 'bucket_seconds', 'width', 'depth', 'hll_registers', 'key_mode')
+
+    def empty_copy(self):
+        """Aggregator rỗng cùng cấu hình (dùng làm đích gộp)"""
+        return ClientActivityAggregator(**self._options)
+
+    def export_state(self, now=None):
+        """Bản sao sketch + các ứng viên còn trong cửa sổ (numpy arrays và list dict)"""
+        horizon = (time.time() if now is None else now) - self.window_seconds
+        with self._lock:
+            return {
+                'options': {name: self._options[name] for name in self._SKETCH_OPTIONS},
+                'records': self.stats['records'],
+                'bucket_epoch': self._bucket_epoch.copy(),
+                'requests': self._requests.copy(),
+                'suspicious': self._suspicious.copy(),
+                'hll': self._hll.copy(),
+                'candidates': [
+                    {'client': key, 'remote_ip': c['remote_ip'], 'user_agent': c['user_agent'],
+                     'first_seen': c['first_seen'], 'last_seen': c['last_seen'], 'peak': c['peak']}
+                    for key, c in self._candidates.items() if c['last_seen'] >= horizon
+                ]
+            }
+
+    def save_state(self, path):
+        """Ghi export_state() ra file .npz (atomic: ghi file tạm rồi đổi tên)"""
+        state = self.export_state()
+        meta = {'options': state['options'], 'records': state['records'], 'candidates': state['candidates']}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), bucket_epoch=state['bucket_epoch'],
+                     requests=state['requests'], suspicious=state['suspicious'], hll=state['hll'])
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load_state(path):
+        """Đọc state do save_state() ghi"""
+        with np.load(path) as data:
+            state = json.loads(str(data['meta']))
+            for name in ('bucket_epoch', 'requests', 'suspicious', 'hll'):
+                state[name] = data[name]
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        aggregator = cls(**state['options'])
+        aggregator.merge_state(state)
+        return aggregator
+
+    def merge_state(self, state):
+        """Gộp state của process khác vào đây; False nếu cấu hình sketch không khớp"""
+        options = state.get('options') or {}
+        if any(options.get(name) != self._options[name] for name in self._SKETCH_OPTIONS):
+            logger.warning(f"⚠️ Client sketch with different configuration ignored: {options}")
+            return False
+        with self._lock:
+            for slot, epoch in enumerate(state['bucket_epoch'].tolist()):
+                mine = int(self._bucket_epoch[slot])
+                if epoch < 0 or epoch < mine:
+                    continue
+                if epoch > mine:
+                    # Their bucket is newer: ours holds an expired epoch
+                    self._requests[slot] = state['requests'][slot]
+                    self._suspicious[slot] = state['suspicious'][slot]
+                    self._hll[slot] = state['hll'][slot]
+                    self._bucket_epoch[slot] = epoch
+                else:
+                    self._requests[slot] += state['requests'][slot]
+                    self._suspicious[slot] += state['suspicious'][slot]
+                    np.maximum(self._hll[slot], state['hll'][slot], out=self._hll[slot])
+            for c in state['candidates']:
+                candidate = self._candidates.get(c['client'])
+                if candidate is None:
+                    self._candidates[c['client']] = {
+                        'remote_ip': c['remote_ip'], 'user_agent': c['user_agent'],
+                        'first_seen': c['first_seen'], 'last_seen': c['last_seen'], 'peak': c['peak'],
+                        'checked_at': 0.0, 'flagged': False
+                    }
+                else:
+                    candidate['first_seen'] = min(candidate['first_seen'], c['first_seen'])
+                    candidate['last_seen'] = max(candidate['last_seen'], c['last_seen'])
+                    candidate['peak'] = max(candidate['peak'], c['peak'])
+            self.stats['records'] += state['records']
+        self._victims.clear()
+        return True
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['candidates'] = len(self._candidates)
+        stats['memory_bytes'] = self._requests.nbytes + self._suspicious.nbytes + self._hll.nbytes
+        stats['window_seconds'] = self.window_seconds
+        stats['key_mode'] = self.key_mode
+        return stats
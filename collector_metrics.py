@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Collector Metrics – endpoint HTTP cục bộ (Prometheus text format) cho realtime collector
+
+- Throughput (dòng/bytes đọc, dòng/giây), parse theo strategy, độ sâu queue, lag theo file
+- Histogram độ trễ detection, kết quả webhook, RSS/CPU của process (psutil)
+- Chỉ đọc trạng thái sẵn có của collector khi được scrape; không có chi phí trên luồng detection
+  ngoài việc cập nhật histogram/counter
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# 1 ms … 5 s: prefilter/fast path ở đầu, model (~5-10 ms) ở giữa, overload ở cuối
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.0075, 0.01, 0.015, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Histogram tích luỹ kiểu Prometheus (thread-safe)"""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """(danh sách (le, số đếm tích luỹ), tổng count, sum)"""
+        with self._lock:
+            counts = list(self._counts)
+            total_sum = self._sum
+        cumulative, running = [], 0
+        for le, count in zip(self.buckets, counts):
+            running += count
+            cumulative.append((le, running))
+        running += counts[-1]
+        return cumulative, running, total_sum
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _MetricWriter:
+    def __init__(self):
+        self.lines = []
+        self._declared = set()
+
+    def metric(self, name, kind, help_text, value, labels=None):
+        if name not in self._declared:
+            self._declared.add(name)
+            self.lines.append(f"# HELP {name} {help_text}")
+            self.lines.append(f"# TYPE {name} {kind}")
+        if labels:
+            label_str = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            self.lines.append(f"{name}{{{label_str}}} {float(value)!r}")
+        else:
+            self.lines.append(f"{name} {float(value)!r}")
+
+    def histogram(self, name, help_text, histogram):
+        cumulative, count, total_sum = histogram.snapshot()
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for le, bucket_count in cumulative:
+            self.lines.append(f'{name}_bucket{{le="{le}"}} {bucket_count}')
+        self.lines.append(f'{name}_bucket{{le="+Inf"}} {count}')
+        self.lines.append(f"{name}_sum {total_sum!r}")
+        self.lines.append(f"{name}_count {count}")
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+class CollectorMetrics:
+    """Thu thập snapshot từ RealtimeLogCollector và render Prometheus text"""
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.process = psutil.Process(os.getpid()) if psutil else None
+        self._last_lines = None
+        self._last_time = None
+        self._lock = threading.Lock()
+
+    def _file_lag(self):
+        """(path, vhost, offset, lag_bytes, lag_seconds, lines, bytes) cho từng file đang follow"""
+        follower = self.collector.follower
+        if follower is None:
+            return []
+        with follower._lock:
+            followers = list(follower.followers.values())
+        now = time.time()
+        rows = []
+        for f in followers:
+            try:
+                size = os.stat(f.path).st_size
+            except OSError:
+                size = f.offset
+            lag_bytes = max(0, size - f.offset)
+            lag_seconds = now - f.caught_up_at if lag_bytes and f.caught_up_at else 0.0
+            rows.append((f.path, f.vhost, f.offset, lag_bytes, lag_seconds, f.lines_read, f.bytes_read))
+        return rows
+
+    def render(self):
+        c = self.collector
+        w = _MetricWriter()
+        now = time.time()
+        files = self._file_lag()
+
+        # Throughput
+        lines_read = sum(row[5] for row in files)
+        bytes_read = sum(row[6] for row in files)
+        ingest = c.ingest_server.stats if c.ingest_server is not None else None
+        if ingest:
+            lines_read += ingest['lines']
+            bytes_read += ingest['bytes']
+        for path, vhost, offset, lag_bytes, lag_seconds, lines, nbytes in files:
+            labels = {'file': path, 'vhost': vhost or '-'}
+            w.metric('sqli_collector_file_lines_read_total', 'counter', 'Lines read per followed file', lines, labels)
+            w.metric('sqli_collector_file_bytes_read_total', 'counter', 'Bytes read per followed file', nbytes, labels)
+            w.metric('sqli_collector_file_lag_bytes', 'gauge', 'Bytes written to the file but not read yet', lag_bytes, labels)
+            w.metric('sqli_collector_file_lag_seconds', 'gauge', 'Seconds since the follower was last caught up (0 when caught up)', lag_seconds, labels)
+        w.metric('sqli_collector_lines_read_total', 'counter', 'Lines read from all files and ingest sockets', lines_read)
+        w.metric('sqli_collector_bytes_read_total', 'counter', 'Bytes read from all files and ingest sockets', bytes_read)
+        with self._lock:
+            if self._last_time is not None and now > self._last_time:
+                rate = (lines_read - self._last_lines) / (now - self._last_time)
+            else:
+                rate = 0.0
+            self._last_lines, self._last_time = lines_read, now
+        w.metric('sqli_collector_lines_per_second', 'gauge', 'Lines read per second since the previous scrape', rate)
+        if ingest:
+            for key in ('connections', 'active_connections', 'datagrams', 'oversized', 'errors'):
+                kind = 'gauge' if key == 'active_connections' else 'counter'
+                suffix = '' if kind == 'gauge' else '_total'
+                w.metric(f'sqli_collector_ingest_{key}{suffix}', kind, f'Ingest server {key.replace("_", " ")}', ingest[key])
+
+        # Parsing
+        for strategy, count in c.parser.get_stats().items():
+            if strategy != 'total':
+                w.metric('sqli_collector_parse_total', 'counter', 'Parsed lines by strategy (failed = unparseable)',
+                         count, {'strategy': strategy})
+
+        # Detection
+        w.metric('sqli_collector_processed_total', 'counter', 'Log entries processed by detection workers', c.stats['total_logs'])
+        w.metric('sqli_collector_sqli_detected_total', 'counter', 'Entries the model flagged as SQLi', c.stats['sqli_detected'])
+        w.metric('sqli_collector_errors_total', 'counter', 'Detection/processing errors', c.stats['errors'])
+        prefilter = c.prefilter.get_stats()
+        w.metric('sqli_collector_prefilter_bypassed_total', 'counter', 'Entries fast-tracked as benign without the model', prefilter['bypassed'])
+        w.histogram('sqli_collector_detection_latency_seconds', 'Model detection latency per entry', c.detection_latency)
+        guard = c.detection_guard.get_stats()
+        for reason in ('timeout', 'error', 'circuit_open'):
+            w.metric('sqli_collector_detection_fallback_total', 'counter', 'Entries given the rule-only verdict by reason',
+                     guard[reason], {'reason': reason})
+        w.metric('sqli_collector_detection_degraded', 'gauge', '1 while the circuit breaker forces rule-only detection',
+                 0 if guard['circuit']['state'] == 'closed' else 1)
+
+        # Queueing / load shedding
+        shed = c.shedder.get_stats()
+        w.metric('sqli_collector_queue_depth', 'gauge', 'Entries waiting for a detection worker', shed['queue_depth'])
+        w.metric('sqli_collector_backlog_size', 'gauge', 'Entries deferred while overloaded', shed['backlog_size'])
+        w.metric('sqli_collector_overloaded', 'gauge', '1 while the collector is shedding load', 1 if shed['overloaded'] else 0)
+        w.metric('sqli_collector_queue_lag_seconds', 'gauge', 'Queue wait (EWMA)', shed['lag_seconds'], {'lane': 'all'})
+        w.metric('sqli_collector_queue_lag_seconds', 'gauge', 'Queue wait (EWMA)', shed['priority_lag_seconds'], {'lane': 'priority'})
+        w.metric('sqli_collector_shed_total', 'counter', 'Entries deferred to the backlog', shed['deferred'])
+        w.metric('sqli_collector_backlog_dropped_total', 'counter', 'Deferred entries dropped because the backlog was full', shed['backlog_dropped'])
+
+        # Alerts / webhook
+        alerts = c.alert_suppressor.get_stats()
+        w.metric('sqli_collector_alerts_total', 'counter', 'Alerts by outcome', alerts['emitted'], {'outcome': 'emitted'})
+        w.metric('sqli_collector_alerts_total', 'counter', 'Alerts by outcome', alerts['suppressed'], {'outcome': 'suppressed'})
+        for outcome, count in c.webhook_stats.items():
+            w.metric('sqli_collector_webhook_requests_total', 'counter', 'Webhook posts by outcome', count, {'outcome': outcome})
+        w.metric('sqli_collector_threat_log_records_total', 'counter', 'Records written to the threat log',
+                 c.threat_writer.stats['records_written'])
+
+        # Process
+        w.metric('sqli_collector_uptime_seconds', 'gauge', 'Seconds since the collector started',
+                 now - c.stats['start_time'].timestamp())
+        if self.process is not None:
+            try:
+                with self.process.oneshot():
+                    cpu = self.process.cpu_times()
+                    w.metric('process_resident_memory_bytes', 'gauge', 'Resident set size', self.process.memory_info().rss)
+                    w.metric('process_cpu_seconds_total', 'counter', 'User + system CPU time', cpu.user + cpu.system)
+                    w.metric('process_threads', 'gauge', 'OS threads', self.process.num_threads())
+            except psutil.Error as e:
+                logger.debug(f"psutil error: {e}")
+        return w.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        try:
+            body = self.metrics.render().encode('utf-8')
+        except Exception as e:
+            logger.error(f"Error rendering metrics: {e}")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the collector log
+        pass
+
+
+class MetricsServer:
+    """HTTP server nhỏ (thread riêng) phục vụ GET /metrics"""
+
+    def __init__(self, metrics, host='127.0.0.1', port=9108):
+        handler = type('MetricsHandler', (_MetricsHandler,), {'metrics': metrics})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.address = self.httpd.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+        logger.info(f"📊 Metrics on http://{self.address[0]}:{self.address[1]}/metrics")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
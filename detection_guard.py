@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Detection Guard – giới hạn thời gian cho mỗi lần detection + circuit breaker
+
+- Mỗi lần gọi model chạy với time budget; quá hạn → dùng verdict rule-only và đếm lại
+- Circuit breaker theo cửa sổ trượt: tỉ lệ lỗi/timeout hoặc tỉ lệ call chậm vượt ngưỡng → mở
+  (degraded, chỉ dùng rule), sau cooldown thử lại vài call (half-open) rồi tự đóng
+- Worst-case latency của một dòng ≈ time_budget, kể cả khi model treo hoặc không load được
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Circuit breaker theo N call gần nhất.
+
+    Tham số:
+    - window: số call gần nhất được xét
+    - min_calls: số call tối thiểu trong cửa sổ trước khi có thể mở
+    - failure_ratio: tỉ lệ lỗi/timeout để mở
+    - slow_call_seconds / slow_ratio: call chậm hơn slow_call_seconds, tỉ lệ vượt slow_ratio để mở
+    - cooldown: số giây ở trạng thái open trước khi thử lại
+    - probe_calls: số call thành công liên tiếp ở half-open để đóng lại
+    """
+
+    def __init__(self, window=100, min_calls=20, failure_ratio=0.5, slow_call_seconds=0.1,
+                 slow_ratio=0.5, cooldown=30.0, probe_calls=5):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_ratio = slow_ratio
+        self.cooldown = cooldown
+        self.probe_calls = probe_calls
+
+        self.state = STATE_CLOSED
+        self._calls = deque(maxlen=window)
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'closed': 0, 'rejected': 0}
+
+    def allow(self):
+        """True nếu call này được dùng model; False = dùng fallback (circuit đang mở)"""
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    self.stats['rejected'] += 1
+                    return False
+                self.state = STATE_HALF_OPEN
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+                logger.info("🔌 Detection circuit half-open, probing the model")
+            if self._probes_in_flight >= self.probe_calls:
+                self.stats['rejected'] += 1
+                return False
+            self._probes_in_flight += 1
+            return True
+
+    def record(self, ok, latency):
+        """Ghi kết quả một call đã được allow()"""
+        slow = ok and latency >= self.slow_call_seconds
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if not ok or slow:
+                    self._open_locked(f"probe {'failed' if not ok else f'took {latency * 1000:.0f} ms'}")
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.probe_calls:
+                    self.state = STATE_CLOSED
+                    self._calls.clear()
+                    self._failures = self._slow = 0
+                    self.stats['closed'] += 1
+                    logger.info("✅ Detection circuit closed, model back in use")
+                return
+            if self.state != STATE_CLOSED:
+                return
+            if len(self._calls) == self._calls.maxlen:
+                old_ok, old_slow = self._calls[0]
+                self._failures -= not old_ok
+                self._slow -= old_slow
+            self._calls.append((ok, slow))
+            self._failures += not ok
+            self._slow += slow
+            calls = len(self._calls)
+            if calls < self.min_calls:
+                return
+            if self._failures / calls >= self.failure_ratio:
+                self._open_locked(f"{self._failures}/{calls} recent calls failed or timed out")
+            elif self._slow / calls >= self.slow_ratio:
+                self._open_locked(f"{self._slow}/{calls} recent calls slower than "
+                                  f"{self.slow_call_seconds * 1000:.0f} ms")
+
+    def _open_locked(self, reason):
+        self.state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        self._failures = self._slow = 0
+        self.stats['opened'] += 1
+        logger.warning(f"⚠️ Detection circuit open ({reason}), rule-only mode for {self.cooldown:.0f}s")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['state'] = self.state
+        return stats
+
+
+class DetectionGuard:
+    """Chạy detect(log_entry) trong time budget, fallback(log_entry, reason) khi quá hạn/lỗi/circuit mở.
+
+    Python không dừng được một thread đang chạy: call quá hạn tiếp tục chạy nền trên pool
+    (kết quả bị bỏ), pool giới hạn max_threads nên call treo làm các call sau timeout và
+    circuit mở thay vì sinh thêm thread.
+    - time_budget: giây cho một call (None/0 = gọi trực tiếp, không giới hạn)
+    - detect trả về None được tính là lỗi
+    """
+
+    def __init__(self, detect, fallback, time_budget=0.25, breaker=None, max_threads=4):
+        self.detect_fn = detect
+        self.fallback_fn = fallback
+        self.time_budget = time_budget
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='guarded-detect') \
+            if time_budget else None
+        self._lock = threading.Lock()
+        self.stats = {'model': 0, 'timeout': 0, 'error': 0, 'circuit_open': 0}
+
+    def _count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def detect(self, log_entry):
+        if not self.breaker.allow():
+            self._count('circuit_open')
+            return self.fallback_fn(log_entry, 'circuit_open')
+        start = time.perf_counter()
+        try:
+            if self._executor is None:
+                result = self.detect_fn(log_entry)
+            else:
+                future = self._executor.submit(self.detect_fn, log_entry)
+                try:
+                    result = future.result(timeout=self.time_budget)
+                except FutureTimeout:
+                    future.cancel()
+                    self.breaker.record(False, time.perf_counter() - start)
+                    self._count('timeout')
+                    return self.fallback_fn(log_entry, 'timeout')
+        except Exception as e:
+            logger.debug(f"Detection error: {e}")
+            result = None
+        latency = time.perf_counter() - start
+        if result is None:
+            self.breaker.record(False, latency)
+            self._count('error')
+            return self.fallback_fn(log_entry, 'error')
+        self.breaker.record(True, latency)
+        self._count('model')
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['fallback'] = stats['timeout'] + stats['error'] + stats['circuit_open']
+        stats['time_budget'] = self.time_budget
+        stats['circuit'] = self.breaker.get_stats()
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Event Broadcaster – server-sent events (SSE) cho dashboard thay cho polling
+
+- Mỗi sự kiện được serialize một lần thành frame SSE rồi fan-out tới mọi subscriber
+- Mỗi client có queue giới hạn; client đọc chậm làm đầy queue sẽ bị ngắt (không chặn publisher,
+  không âm thầm mất sự kiện) – EventSource tự kết nối lại và nhận snapshot mới
+- Heartbeat định kỳ giữ kết nối qua proxy và phát hiện client đã đóng
+- close() kết thúc mọi stream (shutdown)
+"""
+
+import logging
+import queue
+import threading
+
+from json_codec import dumps as json_dumps
+
+logger = logging.getLogger(__name__)
+
+# Reconnect delay hint sent to EventSource clients (ms)
+RETRY_MS = 3000
+
+
+def format_sse(event, data):
+    """Frame SSE (bytes) cho một sự kiện; data được serialize JSON một lần (bytes = JSON có sẵn)"""
+    payload = data if isinstance(data, bytes) else json_dumps(data)
+    return b"event: " + event.encode('utf-8') + b"\ndata: " + payload + b"\n\n"
+
+
+class Subscription:
+    __slots__ = ('queue', 'dropped', 'closed')
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = False
+        self.closed = False
+
+
+class EventBroadcaster:
+    """Fan-out SSE tới nhiều client.
+
+    Tham số:
+    - client_queue_size: số frame tối đa chờ gửi cho một client trước khi client bị ngắt
+    - max_clients: số stream đồng thời tối đa (mỗi stream giữ một thread của server)
+    - heartbeat: giây giữa hai comment keepalive khi không có sự kiện
+    """
+
+    def __init__(self, client_queue_size=256, max_clients=100, heartbeat=15.0):
+        self.client_queue_size = client_queue_size
+        self.max_clients = max_clients
+        self.heartbeat = heartbeat
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {'published': 0, 'dropped_clients': 0, 'rejected_clients': 0}
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self):
+        """Subscription mới, hoặc None khi đã đủ max_clients / đang đóng"""
+        with self._lock:
+            if self._closed or len(self._subscribers) >= self.max_clients:
+                self.stats['rejected_clients'] += 1
+                return None
+            subscription = Subscription(self.client_queue_size)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event, data):
+        """Gửi một sự kiện tới mọi client; không bao giờ chặn. data: object JSON hoặc bytes JSON"""
+        if not self._subscribers:
+            return
+        frame = format_sse(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.stats['published'] += 1
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(frame)
+            except queue.Full:
+                self._drop(subscription)
+
+    def _drop(self, subscription):
+        with self._lock:
+            if subscription not in self._subscribers:
+                return
+            self._subscribers.discard(subscription)
+            self.stats['dropped_clients'] += 1
+        subscription.dropped = True
+        logger.info("🐢 Dropped slow SSE client (queue full)")
+
+    def stream(self, subscription, initial=()):
+        """Generator frame SSE cho một client: initial, rồi sự kiện tới khi bị ngắt/close()"""
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode('utf-8')
+            for frame in initial:
+                yield frame
+            while True:
+                if subscription.dropped:
+                    yield format_sse('dropped', {'reason': 'client too slow'})
+                    return
+                if subscription.closed:
+                    return
+                try:
+                    frame = subscription.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield b": keepalive\n\n"
+                    continue
+                if frame is not None:
+                    yield frame
+        finally:
+            self.unsubscribe(subscription)
+
+    def close(self):
+        """Kết thúc mọi stream và từ chối subscriber mới"""
+        with self._lock:
+            self._closed = True
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+        for subscription in subscribers:
+            subscription.closed = True
+            try:
+                subscription.queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['clients'] = len(self._subscribers)
+        stats['max_clients'] = self.max_clients
+        return stats
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Recent Event Store – ring buffer cho các detection gần nhất của web app
+
+- Một deque dung lượng cố định thay cho list + pop(0): thêm sự kiện O(1)
+- Aggregate được cập nhật khi sự kiện vào/ra cửa sổ: số threat trong toàn buffer,
+  số lần xuất hiện từng pattern trong pattern_window sự kiện gần nhất
+- Mỗi sự kiện có seq tăng dần (≈ micro giây epoch, nên cursor vẫn hợp lệ sau restart và
+  xấp xỉ thứ tự thời gian giữa các worker) và được serialize JSON một lần khi ghi;
+  reader (/api/logs, SSE) chỉ nối các bytes đã cache
+- Đọc (dashboard poll) không quét lại buffer; lock riêng, không dùng global thread_lock
+"""
+
+import threading
+import time
+from collections import Counter, deque
+
+from json_codec import dumps as json_dumps
+
+
+def _summary(event):
+    detection = event.get('detection') or {}
+    if not detection.get('is_sqli', False):
+        return False, ()
+    patterns = detection.get('patterns') or ()
+    if isinstance(patterns, str):
+        patterns = (patterns,)
+    return True, tuple(str(p) for p in patterns)
+
+
+def _encode(event):
+    """JSON của sự kiện (chưa có seq), tính ngoài lock"""
+    return json_dumps(event)
+
+
+def _with_seq(seq, body):
+    # body is a JSON object: splice "seq" in front instead of re-encoding
+    prefix = b'{"seq":%d' % seq
+    return prefix + b'}' if body == b'{}' else prefix + b',' + body[1:]
+
+
+class _Entry:
+    __slots__ = ('seq', 'event', 'data', 'is_sqli', 'patterns')
+
+    def __init__(self, seq, event, data, is_sqli, patterns):
+        self.seq = seq
+        self.event = event
+        self.data = data
+        self.is_sqli = is_sqli
+        self.patterns = patterns
+
+
+class RecentEventStore:
+    """Tham số:
+    - capacity: số sự kiện giữ lại (cửa sổ của total_threats và của since())
+    - recent_capacity: số sự kiện tối đa trả về cho một lần đọc /api/logs
+    - pattern_window: số sự kiện gần nhất dùng để đếm pattern
+    """
+
+    def __init__(self, capacity=1000, recent_capacity=100, pattern_window=100):
+        self.capacity = capacity
+        self.recent_capacity = min(recent_capacity, capacity)
+        self.pattern_window = min(pattern_window, capacity)
+        # Entries keep their summary so leaving events undo exactly what they added
+        self._events = deque(maxlen=capacity)
+        self._pattern_counts = Counter()
+        self._threats = 0
+        self._seq = 0
+        # Highest seq no longer in the buffer (evicted or cleared)
+        self._evicted_seq = 0
+        self._lock = threading.Lock()
+
+    def _add_locked(self, event, body):
+        is_sqli, patterns = _summary(event)
+        events = self._events
+        if len(events) >= self.pattern_window:
+            # Event sliding out of the pattern window (still in the buffer)
+            for pattern in events[-self.pattern_window].patterns:
+                count = self._pattern_counts[pattern] - 1
+                if count:
+                    self._pattern_counts[pattern] = count
+                else:
+                    del self._pattern_counts[pattern]
+        if len(events) == self.capacity:
+            self._evicted_seq = events[0].seq
+            if events[0].is_sqli:
+                self._threats -= 1
+        self._seq = max(self._seq + 1, time.time_ns() // 1000)
+        entry = _Entry(self._seq, event, _with_seq(self._seq, body), is_sqli, patterns)
+        events.append(entry)
+        self._threats += is_sqli
+        self._pattern_counts.update(patterns)
+        return entry
+
+    def add(self, event):
+        """Ghi một sự kiện; trả về bytes JSON đã cache (có seq)"""
+        body = _encode(event)
+        with self._lock:
+            return self._add_locked(event, body).data
+
+    def extend(self, events):
+        """Ghi nhiều sự kiện (một lần lấy lock); trả về list bytes JSON đã cache"""
+        bodies = [_encode(event) for event in events]
+        with self._lock:
+            return [self._add_locked(event, body).data for event, body in zip(events, bodies)]
+
+    def _clamp(self, limit):
+        return self.recent_capacity if limit is None else max(0, min(limit, self.recent_capacity))
+
+    def latest(self, limit=None):
+        """Tối đa limit (≤ recent_capacity) sự kiện mới nhất, cũ trước"""
+        return [event for _, event in self.latest_entries(limit, raw=False)]
+
+    def latest_entries(self, limit=None, raw=True):
+        """[(seq, bytes JSON)] (raw=False: [(seq, dict)]) của tối đa limit sự kiện mới nhất, cũ trước"""
+        limit = self._clamp(limit)
+        with self._lock:
+            count = min(limit, len(self._events))
+            entries = [self._events[-i] for i in range(count, 0, -1)]
+        return [(entry.seq, entry.data if raw else entry.event) for entry in entries]
+
+    def since(self, cursor, limit=None):
+        """([(seq, bytes JSON)] có seq > cursor, cũ trước, tối đa limit; truncated).
+
+        truncated=True: có sự kiện sau cursor đã rời buffer (client nên đọc lại từ đầu).
+        Chỉ duyệt các sự kiện mới hơn cursor (từ cuối buffer).
+        """
+        limit = self._clamp(limit)
+        with self._lock:
+            truncated = cursor < self._evicted_seq
+            newer = []
+            for entry in reversed(self._events):
+                if entry.seq <= cursor:
+                    break
+                newer.append(entry)
+        newer.reverse()
+        return [(entry.seq, entry.data) for entry in newer[:limit]], truncated
+
+    def bounds(self):
+        """(seq cũ nhất, seq mới nhất) trong buffer, (0, 0) khi rỗng – xác định nội dung buffer"""
+        with self._lock:
+            if not self._events:
+                return 0, 0
+            return self._events[0].seq, self._events[-1].seq
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def pattern_summary(self, top_k=None):
+        """(top-K [(pattern, count)] trong pattern_window, tổng threat trong buffer)"""
+        with self._lock:
+            return self._pattern_counts.most_common(top_k), self._threats
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._pattern_counts.clear()
+            self._threats = 0
+            # Sequence numbers keep increasing: old cursors stay valid, and report truncation
+            self._evicted_seq = self._seq
+
+    def __len__(self):
+        return len(self._events)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Detection History Store – lịch sử detection lâu dài trên SQLite (WAL), có index
+
+- record() chỉ đẩy vào queue; một writer thread ghi theo lô (một transaction / lô),
+  không có I/O trên request thread; queue đầy → bản ghi bị bỏ và được đếm
+- Index theo thời gian, remote_ip, URI template và nhóm pattern (union, boolean, time, ...)
+- query(): lọc + phân trang keyset (cursor), mới nhất trước – vài ms kể cả với hàng tuần dữ liệu
+- Retention: writer thread xoá dữ liệu cũ hơn retention_days theo từng lô nhỏ
+- Nhiều process (prefork workers) ghi chung một file: WAL + busy_timeout
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from alert_suppressor import uri_template
+from json_codec import dumps as json_dumps
+
+logger = logging.getLogger(__name__)
+
+# Pattern (keyword của rule) → nhóm; thứ tự quan trọng: khớp nhóm đầu tiên có substring
+PATTERN_CLASSES = (
+    ('union', ('union', 'uni0n')),
+    ('time', ('sleep', 'sl33p', 'waitfor', 'benchmark')),
+    ('boolean', ('or 1=1', 'and 1=1', "' or '", '" or "', 'xor')),
+    ('stacked', ('drop', 'dr0p', 'tabl3', 'delete from', 'insert into', 'update set')),
+    ('command', ('exec', 'xp_cmdshell', 'sp_executesql', 'load_file', 'into outfile', 'into dumpfile')),
+    ('enumeration', ('information_schema', 'mysql.user', 'version(', 'user(', '@@', 'database(')),
+    ('comment', ('--', '#', '/*', '*/')),
+    ('encoding', ('0x', 'char(', 'ascii(', 'concat', 's3lect')),
+    ('clause', ('order by', 'group by', 'having', 'offset', 'limit', 'regexp', 'like')),
+    ('tool', ('sqlmap', 'injection')),
+)
+CLASS_NAMES = tuple(name for name, _ in PATTERN_CLASSES) + ('other',)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    remote_ip TEXT,
+    uri_template TEXT,
+    method TEXT,
+    is_sqli INTEGER NOT NULL,
+    score REAL,
+    confidence TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections(ts);
+CREATE INDEX IF NOT EXISTS idx_detections_ip_ts ON detections(remote_ip, ts);
+CREATE INDEX IF NOT EXISTS idx_detections_template_ts ON detections(uri_template, ts);
+CREATE TABLE IF NOT EXISTS detection_classes (
+    pattern_class TEXT NOT NULL,
+    ts REAL NOT NULL,
+    detection_id INTEGER NOT NULL,
+    remote_ip TEXT,
+    uri_template TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_classes_class_ts ON detection_classes(pattern_class, ts, detection_id);
+CREATE INDEX IF NOT EXISTS idx_classes_ts ON detection_classes(ts);
+"""
+
+# remote_ip/uri_template được chép vào detection_classes: lọc nhóm pattern + IP/template đi thẳng
+# trên một index thay vì duyệt mọi dòng của nhóm rồi join sang detections
+CLASS_FILTER_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_classes_class_ip_ts ON detection_classes(pattern_class, remote_ip, ts, detection_id);
+CREATE INDEX IF NOT EXISTS idx_classes_class_template_ts
+    ON detection_classes(pattern_class, uri_template, ts, detection_id);
+"""
+
+# SQLI_HISTORY_ALL=1: clean requests far outnumber detections; query() filters "d.is_sqli = 1"
+# by default, so partial indexes over only the SQLi rows keep that scan from walking the clean ones
+SQLI_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_detections_sqli_ts ON detections(ts) WHERE is_sqli = 1;
+CREATE INDEX IF NOT EXISTS idx_detections_sqli_ip_ts ON detections(remote_ip, ts) WHERE is_sqli = 1;
+CREATE INDEX IF NOT EXISTS idx_detections_sqli_template_ts ON detections(uri_template, ts) WHERE is_sqli = 1;
+"""
+
+
+def pattern_classes(patterns):
+    """Tập nhóm pattern của một detection (pattern không khớp nhóm nào → 'other')"""
+    classes = set()
+    for pattern in patterns or ():
+        text = str(pattern).lower()
+        for name, needles in PATTERN_CLASSES:
+            if any(needle in text for needle in needles):
+                classes.add(name)
+                break
+        else:
+            classes.add('other')
+    return classes
+
+
+def parse_time(value):
+    """Epoch seconds từ số hoặc chuỗi ISO 8601; None nếu rỗng"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value)).timestamp()
+
+
+def _row(event, data, now):
+    log_entry = event.get('log') or {}
+    if not isinstance(log_entry, dict):
+        log_entry = {}
+    detection = event.get('detection') or {}
+    try:
+        ts = parse_time(event.get('timestamp')) or now
+    except ValueError:
+        ts = now
+    patterns = detection.get('patterns') or ()
+    if isinstance(patterns, str):
+        patterns = (patterns,)
+    record = (data if isinstance(data, bytes) else json_dumps(event)).decode('utf-8')
+    row = (ts, log_entry.get('remote_ip'), uri_template(log_entry.get('uri', '')), log_entry.get('method'),
+           1 if detection.get('is_sqli') else 0, float(detection.get('score') or 0.0),
+           detection.get('confidence'), record)
+    return row, pattern_classes(patterns)
+
+
+class DetectionHistoryStore:
+    """Lịch sử detection trên SQLite.
+
+    Tham số:
+    - path: file database (tạo nếu chưa có)
+    - record_clean: ghi cả detection sạch (mặc định chỉ SQLi)
+    - batch_size / flush_interval: kích thước lô tối đa / số giây tối đa một bản ghi chờ ghi
+    - queue_size: số bản ghi tối đa chờ ghi (đầy → bỏ và đếm 'dropped')
+    - retention_days: xoá dữ liệu cũ hơn (None/0 = giữ mãi), kiểm tra mỗi prune_interval giây
+    """
+
+    def __init__(self, path='detection_history.db', record_clean=False, batch_size=500,
+                 flush_interval=1.0, queue_size=100000, retention_days=30, prune_interval=3600.0):
+        self.path = path
+        self.record_clean = record_clean
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self.pid = os.getpid()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._local = threading.local()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {'queued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'pruned': 0, 'errors': 0}
+
+        dirn = os.path.dirname(path)
+        if dirn:
+            os.makedirs(dirn, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        conn.executescript(CLASS_FILTER_INDEXES)
+        if self.record_clean:
+            conn.executescript(SQLI_INDEXES)
+
+        self._writer = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        """Một connection cho mỗi thread (sqlite3 connection không chia sẻ giữa thread)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode: transactions are explicit (BEGIN IMMEDIATE in the writer)
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self, conn):
+        """Database tạo trước khi có cột remote_ip/uri_template trong detection_classes: thêm và điền"""
+        def missing():
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(detection_classes)')}
+            return 'remote_ip' not in columns
+        if not missing():
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Re-checked under the write lock: another worker may have migrated meanwhile
+            if missing():
+                logger.info(f"🛠️ Migrating {self.path}: adding remote_ip/uri_template to detection_classes")
+                conn.execute('ALTER TABLE detection_classes ADD COLUMN remote_ip TEXT')
+                conn.execute('ALTER TABLE detection_classes ADD COLUMN uri_template TEXT')
+                conn.execute(
+                    'UPDATE detection_classes SET '
+                    'remote_ip = (SELECT remote_ip FROM detections WHERE id = detection_id), '
+                    'uri_template = (SELECT uri_template FROM detections WHERE id = detection_id)'
+                )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    # Write path
+    def record(self, events, encoded=None):
+        """Đưa detection vào hàng đợi ghi; encoded: JSON (bytes) đã có của từng event"""
+        now = time.time()
+        encoded = encoded or [None] * len(events)
+        queued = dropped = 0
+        for event, data in zip(events, encoded):
+            if not self.record_clean and not (event.get('detection') or {}).get('is_sqli'):
+                continue
+            try:
+                self._queue.put_nowait((event, data, now))
+                queued += 1
+            except queue.Full:
+                dropped += 1
+        if queued:
+            self._count('queued', queued)
+        if dropped:
+            self._count('dropped', dropped)
+
+    def _write_loop(self):
+        last_prune = 0.0
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self._write_batch(batch)
+            elif self._stop_event.is_set():
+                return
+            if self.retention_days and time.time() - last_prune >= self.prune_interval:
+                last_prune = time.time()
+                self.prune()
+
+    def _write_batch(self, batch):
+        rows, class_rows = [], []
+        for event, data, now in batch:
+            row, classes = _row(event, data, now)
+            rows.append(row)
+            class_rows.append(classes)
+        conn = self._connect()
+        try:
+            # Write lock taken up front: ids are assigned here so both tables go in with executemany
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                first_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM detections').fetchone()[0]
+                conn.executemany(
+                    'INSERT INTO detections (id, ts, remote_ip, uri_template, method, is_sqli, score, '
+                    'confidence, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(first_id + i,) + row for i, row in enumerate(rows)]
+                )
+                conn.executemany(
+                    'INSERT INTO detection_classes (pattern_class, ts, detection_id, remote_ip, uri_template) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(name, row[0], first_id + i, row[1], row[2])
+                     for i, (row, classes) in enumerate(zip(rows, class_rows)) for name in classes]
+                )
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self._count('written', len(batch))
+            self._count('batches')
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Error writing detection history ({len(batch)} records lost): {e}")
+
+    def prune(self, older_than_days=None, chunk=5000):
+        """Xoá detection cũ hơn retention (theo lô nhỏ để không giữ lock ghi lâu)"""
+        days = older_than_days if older_than_days is not None else self.retention_days
+        if not days:
+            return 0
+        cutoff = time.time() - days * 86400
+        conn = self._connect()
+        removed = 0
+        try:
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    deleted = conn.execute(
+                        'DELETE FROM detections WHERE id IN '
+                        '(SELECT id FROM detections WHERE ts < ? ORDER BY ts LIMIT ?)', (cutoff, chunk)
+                    ).rowcount
+                    deleted_classes = conn.execute(
+                        'DELETE FROM detection_classes WHERE rowid IN '
+                        '(SELECT rowid FROM detection_classes WHERE ts < ? ORDER BY ts LIMIT ?)', (cutoff, chunk)
+                    ).rowcount
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                removed += deleted
+                if deleted < chunk and deleted_classes < chunk:
+                    break
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Error pruning detection history: {e}")
+        if removed:
+            self._count('pruned', removed)
+            logger.info(f"🧹 Pruned {removed} history records older than {days} days")
+        return removed
+
+    # Read path
+    def query(self, start=None, end=None, remote_ip=None, uri_template=None, pattern_class=None,
+              sqli_only=True, limit=50, cursor=None):
+        """(list JSON text của detection, mới nhất trước; next_cursor hoặc None).
+
+        start/end: epoch seconds; cursor: chuỗi next_cursor của trang trước ("ts:id").
+        """
+        limit = max(1, min(int(limit), 1000))
+        params = []
+        if pattern_class:
+            # IP/template are filtered on the class rows (denormalised) so one index drives the scan
+            source = 'detection_classes c JOIN detections d ON d.id = c.detection_id'
+            table, ts_col, id_col = 'c', 'c.ts', 'c.detection_id'
+            conditions = ['c.pattern_class = ?']
+            params.append(pattern_class)
+        else:
+            source = 'detections d'
+            table, ts_col, id_col = 'd', 'd.ts', 'd.id'
+            conditions = []
+        if start is not None:
+            conditions.append(f'{ts_col} >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append(f'{ts_col} < ?')
+            params.append(end)
+        if remote_ip:
+            conditions.append(f'{table}.remote_ip = ?')
+            params.append(remote_ip)
+        if uri_template:
+            conditions.append(f'{table}.uri_template = ?')
+            params.append(uri_template)
+        if sqli_only:
+            conditions.append('d.is_sqli = 1')
+        if cursor:
+            cursor_ts, cursor_id = cursor.split(':', 1)
+            conditions.append(f'({ts_col}, {id_col}) < (?, ?)')
+            params.extend((float(cursor_ts), int(cursor_id)))
+        sql = f'SELECT d.id, d.ts, d.record FROM {source}'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += f' ORDER BY {ts_col} DESC, {id_col} DESC LIMIT ?'
+        params.append(limit + 1)
+        rows = self._connect().execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1][1]!r}:{rows[-1][0]}"
+        return [record for _, _, record in rows], next_cursor
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['pending'] = self._queue.qsize()
+        stats['path'] = self.path
+        stats['retention_days'] = self.retention_days
+        return stats
+
+    def close(self, timeout=10.0):
+        """Ghi nốt hàng đợi (tối đa timeout giây) rồi dừng writer"""
+        self._stop_event.set()
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            logger.warning(f"⚠️ {self._queue.qsize()} history records not written before shutdown")
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+JSON Codec – encode JSON thẳng ra bytes cho response, event store và SSE
+
+- orjson nếu có (nhanh hơn json chuẩn nhiều lần, trả bytes trực tiếp), nếu không dùng json chuẩn
+- Không có bước duyệt/chuyển kiểu đệ quy trước khi encode: dữ liệu đã là kiểu JSON gốc từ nguồn
+  (detector trả Verdict gồm bool/float/list/str); kiểu lạ còn sót (numpy, set, datetime...)
+  được xử lý trong default khi encoder gặp chúng
+- Số nguyên ngoài 64-bit trong log do client gửi: orjson từ chối → fallback json chuẩn
+"""
+
+import json
+
+# Optional fast JSON encoder
+try:
+    import orjson as _orjson
+except Exception:  # pragma: no cover
+    _orjson = None
+
+
+def _default(obj):
+    """Kiểu không phải JSON gốc: object tự serialize, numpy (tolist), set → list, còn lại str"""
+    to_dict = getattr(obj, 'to_dict', None)
+    if callable(to_dict):
+        return to_dict()
+    tolist = getattr(obj, 'tolist', None)
+    if callable(tolist):
+        return tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, default=_default).encode('utf-8')
+
+
+if _orjson is not None:
+    _ORJSON_OPTIONS = _orjson.OPT_NON_STR_KEYS | _orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj):
+        """JSON (bytes UTF-8) của obj"""
+        try:
+            return _orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # orjson.JSONEncodeError: integer over 64 bits, recursion limit...
+            return _stdlib_dumps(obj)
+else:
+    dumps = _stdlib_dumps
+
+BACKEND = 'orjson' if _orjson is not None else 'json'
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Latency Histogram – histogram độ trễ kiểu HDR (bucket cố định, log-linear) cho web app
+
+- Giá trị tính bằng micro giây; mỗi lũy thừa của 2 chia thành 2^(sub_bucket_bits-1) bucket
+  → sai số tương đối ≤ 1/2^(sub_bucket_bits-1) (mặc định ~1.6%) từ 1 µs đến hàng giờ
+- Mỗi thread ghi vào shard riêng (không lock khi record); shard của thread đã kết thúc
+  được gộp vào phần "retired" nên số shard không tăng theo số request
+- Thread mới lấy self._lock một lần để đăng ký shard: với werkzeug (mỗi request một thread)
+  đó là một lần lock ngắn cho mỗi request; việc gộp shard chết chỉ chạy khi danh sách shard
+  tăng gấp đôi (hoặc khi đọc snapshot), không phải ở mỗi thread mới
+- p50/p90/p99/p99.9 toàn thời gian và theo từng phút; bucket thô (sparse) để gộp giữa các worker
+"""
+
+import threading
+import time
+import weakref
+from datetime import datetime
+
+DEFAULT_SUB_BUCKET_BITS = 7
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+# Values above ~19 h are clamped into the last bucket
+MAX_VALUE_BITS = 36
+
+
+def bucket_index(value_us, sub_bucket_bits=DEFAULT_SUB_BUCKET_BITS):
+    """Index của bucket chứa value_us (số nguyên ≥ 0)"""
+    sub_count = 1 << sub_bucket_bits
+    if value_us < sub_count:
+        return value_us
+    shift = min(value_us.bit_length(), MAX_VALUE_BITS) - sub_bucket_bits
+    top = min(value_us >> shift, sub_count - 1)
+    half = sub_count >> 1
+    return sub_count + (shift - 1) * half + (top - half)
+
+
+def bucket_bounds(index, sub_bucket_bits=DEFAULT_SUB_BUCKET_BITS):
+    """(giá trị nhỏ nhất, lớn nhất) tính bằng µs của một bucket"""
+    sub_count = 1 << sub_bucket_bits
+    if index < sub_count:
+        return index, index
+    half = sub_count >> 1
+    shift, offset = divmod(index - sub_count, half)
+    shift += 1
+    low = (half + offset) << shift
+    return low, low + (1 << shift) - 1
+
+
+def _percentiles(counts, total, percentiles, sub_bucket_bits):
+    """Percentile (ms) từ dict {bucket: count}; dùng giá trị lớn nhất của bucket (bảo thủ)"""
+    if not total:
+        return {}
+    ordered = sorted(counts.items())
+    result = {}
+    for p in percentiles:
+        rank = max(1, -(-total * p // 100))
+        running = 0
+        for index, count in ordered:
+            running += count
+            if running >= rank:
+                result[p] = bucket_bounds(index, sub_bucket_bits)[1] / 1000.0
+                break
+    return result
+
+
+def _percentile_key(p):
+    return 'p' + f"{p:g}".replace('.', '')
+
+
+class _Shard:
+    __slots__ = ('counts', 'count', 'sum_us', 'max_us', 'minutes', 'thread')
+
+    def __init__(self, thread):
+        self.counts = {}
+        self.count = 0
+        self.sum_us = 0
+        self.max_us = 0
+        # minute (epoch // 60) → {bucket: count}
+        self.minutes = {}
+        self.thread = weakref.ref(thread)
+
+
+class LatencyHistogram:
+    """Histogram độ trễ với shard theo thread.
+
+    Tham số:
+    - sub_bucket_bits: độ phân giải (7 → 64 bucket cho mỗi lũy thừa của 2)
+    - window_minutes: số phút gần nhất giữ percentile theo phút
+    """
+
+    def __init__(self, sub_bucket_bits=DEFAULT_SUB_BUCKET_BITS, window_minutes=5):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.window_minutes = window_minutes
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard(threading.current_thread())
+        self._lock = threading.Lock()
+        # Shard count that triggers retiring dead shards from _shard() (amortized O(1) per thread)
+        self._retire_at = 64
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+                if len(self._shards) >= self._retire_at:
+                    self._retire_dead_locked()
+            self._local.shard = shard
+        return shard
+
+    def _retire_dead_locked(self):
+        """Gộp shard của các thread đã kết thúc (không còn ai ghi vào) vào _retired"""
+        alive = []
+        for shard in self._shards:
+            thread = shard.thread()
+            if thread is not None and thread.is_alive():
+                alive.append(shard)
+            else:
+                self._merge_into(self._retired, shard)
+        self._shards = alive
+        self._retire_at = max(64, 2 * len(alive))
+        self._prune_minutes(self._retired)
+
+    def _merge_into(self, target, shard):
+        counts = target.counts
+        for index, count in list(shard.counts.items()):
+            counts[index] = counts.get(index, 0) + count
+        target.count += shard.count
+        target.sum_us += shard.sum_us
+        target.max_us = max(target.max_us, shard.max_us)
+        for minute, minute_counts in list(shard.minutes.items()):
+            merged = target.minutes.setdefault(minute, {})
+            for index, count in list(minute_counts.items()):
+                merged[index] = merged.get(index, 0) + count
+
+    def _prune_minutes(self, shard, now_minute=None):
+        oldest = (now_minute if now_minute is not None else int(time.time() // 60)) - self.window_minutes
+        for minute in [m for m in shard.minutes if m <= oldest]:
+            del shard.minutes[minute]
+
+    def record(self, seconds):
+        """Ghi một độ trễ (giây); chỉ đụng tới shard của thread hiện tại"""
+        value_us = max(0, int(seconds * 1_000_000))
+        index = bucket_index(value_us, self.sub_bucket_bits)
+        shard = self._shard()
+        counts = shard.counts
+        counts[index] = counts.get(index, 0) + 1
+        shard.count += 1
+        shard.sum_us += value_us
+        if value_us > shard.max_us:
+            shard.max_us = value_us
+        minute = int(time.time() // 60)
+        minute_counts = shard.minutes.get(minute)
+        if minute_counts is None:
+            self._prune_minutes(shard, minute)
+            minute_counts = shard.minutes[minute] = {}
+        minute_counts[index] = minute_counts.get(index, 0) + 1
+
+    def _merged(self, extra_states=()):
+        merged = _Shard(threading.current_thread())
+        with self._lock:
+            self._retire_dead_locked()
+            shards = [self._retired] + list(self._shards)
+        for shard in shards:
+            self._merge_into(merged, shard)
+        for state in extra_states:
+            self._merge_into(merged, _shard_from_state(state))
+        self._prune_minutes(merged)
+        return merged
+
+    def export_state(self):
+        """Trạng thái thô (JSON-native) để process khác gộp vào snapshot của nó"""
+        merged = self._merged()
+        return {
+            'sub_bucket_bits': self.sub_bucket_bits,
+            'counts': [[index, count] for index, count in sorted(merged.counts.items())],
+            'count': merged.count,
+            'sum_us': merged.sum_us,
+            'max_us': merged.max_us,
+            'minutes': {str(minute): [[index, count] for index, count in sorted(counts.items())]
+                        for minute, counts in merged.minutes.items()}
+        }
+
+    def _summary(self, counts, total, percentiles):
+        summary = {'count': total}
+        for p, value in _percentiles(counts, total, percentiles, self.sub_bucket_bits).items():
+            summary[f"{_percentile_key(p)}_ms"] = value
+        return summary
+
+    def snapshot(self, percentiles=DEFAULT_PERCENTILES, include_buckets=True, extra_states=()):
+        """Percentile toàn thời gian + theo phút (+ bucket thô sparse [[index, count], ...]).
+
+        extra_states: kết quả export_state() của các worker khác, gộp vào trước khi tính.
+        """
+        merged = self._merged(extra_states)
+        result = self._summary(merged.counts, merged.count, percentiles)
+        result['mean_ms'] = merged.sum_us / merged.count / 1000.0 if merged.count else 0.0
+        result['max_ms'] = merged.max_us / 1000.0
+        current_minute = int(time.time() // 60)
+        per_minute = []
+        for minute in sorted(merged.minutes):
+            minute_counts = merged.minutes[minute]
+            entry = {'minute': datetime.fromtimestamp(minute * 60).isoformat(timespec='minutes')}
+            entry.update(self._summary(minute_counts, sum(minute_counts.values()), percentiles))
+            per_minute.append(entry)
+        result['per_minute'] = per_minute
+        last_minute = merged.minutes.get(current_minute - 1)
+        result['last_minute'] = self._summary(last_minute or {}, sum((last_minute or {}).values()), percentiles)
+        if include_buckets:
+            result['buckets'] = {
+                'unit': 'us',
+                'sub_bucket_bits': self.sub_bucket_bits,
+                'sum_us': merged.sum_us,
+                'max_us': merged.max_us,
+                'counts': [[index, count] for index, count in sorted(merged.counts.items())]
+            }
+        return result
+
+
+def _shard_from_state(state):
+    shard = _Shard(threading.current_thread())
+    shard.counts = {int(index): count for index, count in state.get('counts', [])}
+    shard.count = state.get('count', 0)
+    shard.sum_us = state.get('sum_us', 0)
+    shard.max_us = state.get('max_us', 0)
+    shard.minutes = {int(minute): {int(index): count for index, count in counts}
+                     for minute, counts in (state.get('minutes') or {}).items()}
+    return shard
+
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Load Shedder – hàng đợi ưu tiên + chế độ quá tải cho realtime collector
+
+- Mỗi dòng được phân loại bằng một regex rẻ: dòng "đáng ngờ" luôn vào lane ưu tiên
+- Khi quá tải (queue sâu hoặc lag cao, có hysteresis) các dòng còn lại chỉ được lấy mẫu,
+  phần bị bỏ qua được đẩy vào backlog và xử lý lại khi tải giảm
+- Thống kê: số dòng bị shed/defer/drop, lag hiện tại và lag của lane ưu tiên
+"""
+
+import itertools
+import logging
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes (số nhỏ được xử lý trước)
+LANE_PRIORITY = 0
+LANE_NORMAL = 1
+LANE_BACKLOG = 2
+_LANE_STOP = 3
+LANE_NAMES = {LANE_PRIORITY: 'priority', LANE_NORMAL: 'normal', LANE_BACKLOG: 'backlog'}
+
+# Triage rẻ: ký tự/từ khóa thường gặp trong SQLi (raw hoặc url-encoded). Sai dương chỉ tốn
+# thêm một lần chạy model, nên regex cố ý rộng.
+SUSPICION_REGEX = re.compile(
+    r"['\"`;\\()]|--|/\*|#|%(?:2[237d]|3[bcde]|5c|00)|0x[0-9a-f]{2}|"
+    r"\b(?:union|select|sleep|benchmark|waitfor|information_schema|or|and|xor|having|"
+    r"order\s+by|concat|char|exec|drop|insert|update|delete|null)\b",
+    re.IGNORECASE
+)
+SUSPICION_FIELDS = ('uri', 'query_string', 'payload', 'body')
+
+
+def is_suspicious(log_entry) -> bool:
+    """Kiểm tra nhanh (một regex search) xem dòng có cần full pipeline ngay không"""
+    get = log_entry.get
+    text = ' '.join([get(field, '') or '' for field in SUSPICION_FIELDS])
+    if SUSPICION_REGEX.search(text):
+        return True
+    cookie = get('cookie', '') or ''
+    # '; ' là dấu phân cách cookie bình thường, không phải dấu hiệu tấn công
+    return bool(cookie) and SUSPICION_REGEX.search(cookie.replace('; ', ' ')) is not None
+
+
+class LoadShedder:
+    """Priority queue giữa follower và detection workers.
+
+    Tham số:
+    - maxsize: độ sâu queue "bình thường" của lane live
+    - high_watermark / low_watermark: tỉ lệ độ sâu để vào / thoát chế độ quá tải
+    - max_lag: lag (giây chờ trong queue, EWMA) để vào chế độ quá tải
+    - sample_rate: tỉ lệ dòng không đáng ngờ vẫn được xử lý ngay khi quá tải
+    - backlog_max: số dòng tối đa giữ lại để xử lý sau (cũ nhất bị drop khi đầy)
+    - priority_max: giới hạn cứng của queue; dòng đáng ngờ chỉ chờ khi vượt mức này
+      (submit(block=False) không chờ mà vẫn đưa vào, đếm ở priority_overflow)
+    """
+
+    def __init__(self, maxsize=1000, high_watermark=0.8, low_watermark=0.3, max_lag=2.0,
+                 sample_rate=0.1, backlog_max=100000, priority_max=None, drain_interval=0.2):
+        self.maxsize = maxsize
+        self.high_depth = max(1, int(maxsize * high_watermark))
+        self.low_depth = int(maxsize * low_watermark)
+        self.max_lag = max_lag
+        self.sample_every = max(1, round(1 / sample_rate)) if sample_rate > 0 else 0
+        self.backlog_max = backlog_max
+        self.priority_max = priority_max or maxsize * 2
+        self.drain_interval = drain_interval
+
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._backlog = deque()
+        self._lock = threading.Lock()
+        self._sample_counter = 0
+        self._lag = 0.0
+        self._priority_lag = 0.0
+        # Live-lane (priority/normal) lines currently queued; 0 means nothing is waiting
+        self._live_pending = 0
+        self.overloaded = False
+        self._overload_started = None
+
+        self._stop_event = threading.Event()
+        self._drainer = None
+
+        self.stats = {
+            'submitted': 0,
+            'suspicious': 0,
+            'sampled': 0,
+            'deferred': 0,
+            'backlog_drained': 0,
+            'backlog_dropped': 0,
+            'priority_overflow': 0,
+            'overload_events': 0,
+            'overload_seconds': 0.0,
+            'max_lag_seconds': 0.0,
+            'max_priority_lag_seconds': 0.0
+        }
+
+    def start(self):
+        self._drainer = threading.Thread(target=self._drain_loop, name='backlog-drainer', daemon=True)
+        self._drainer.start()
+
+    def _put(self, lane, log_entry, enqueued_at=None):
+        if lane < LANE_BACKLOG:
+            with self._lock:
+                self._live_pending += 1
+        self._queue.put((lane, next(self._seq), enqueued_at or time.monotonic(), log_entry))
+
+    def _decay_idle_lag_locked(self):
+        """Không còn dòng live nào chờ: lag thực tế là 0, cho EWMA giảm dần về 0.
+
+        Lag chỉ được cập nhật trong get(); không có bước này, lag của đợt flood cuối cùng
+        bị "đóng băng" và chế độ quá tải không bao giờ kết thúc khi hệ thống rảnh.
+        """
+        if self._live_pending == 0:
+            self._lag *= 0.8
+            self._priority_lag *= 0.8
+
+    def _update_overload_locked(self):
+        depth = self._queue.qsize()
+        if not self.overloaded:
+            if depth >= self.high_depth or self._lag >= self.max_lag:
+                self.overloaded = True
+                self._overload_started = time.monotonic()
+                self.stats['overload_events'] += 1
+                logger.warning(f"⚠️ Overload: queue depth {depth}, lag {self._lag:.2f}s – "
+                               f"sampling 1/{self.sample_every or '∞'} non-suspicious lines")
+        elif depth <= self.low_depth and self._lag < self.max_lag / 2:
+            self.overloaded = False
+            self.stats['overload_seconds'] += time.monotonic() - self._overload_started
+            logger.info(f"✅ Load back to normal (backlog: {len(self._backlog)} lines)")
+
+    def priority_full(self):
+        """True khi queue đã vượt giới hạn cứng (submit đáng ngờ sẽ chờ)"""
+        return self._queue.qsize() >= self.priority_max
+
+    def submit(self, log_entry, suspicious, should_continue=lambda: True, block=True):
+        """Đưa một dòng vào lane phù hợp; trả về tên lane hoặc 'deferred'
+
+        block=False cho caller không được phép ngủ (event loop asyncio): dòng đáng ngờ vẫn vào
+        lane ưu tiên dù queue vượt priority_max; caller tự tạo backpressure (xem priority_full).
+        """
+        with self._lock:
+            self.stats['submitted'] += 1
+            self._update_overload_locked()
+            if suspicious:
+                self.stats['suspicious'] += 1
+            elif self.overloaded:
+                self._sample_counter += 1
+                if not self.sample_every or self._sample_counter % self.sample_every:
+                    self._defer_locked(log_entry)
+                    return 'deferred'
+                self.stats['sampled'] += 1
+            elif self._queue.qsize() >= self.maxsize:
+                self._defer_locked(log_entry)
+                return 'deferred'
+
+        if suspicious:
+            # Chỉ chặn follower khi cả lane ưu tiên cũng vượt giới hạn cứng
+            if not block:
+                if self.priority_full():
+                    with self._lock:
+                        self.stats['priority_overflow'] += 1
+            else:
+                while self.priority_full() and should_continue():
+                    time.sleep(0.05)
+            self._put(LANE_PRIORITY, log_entry)
+            return 'priority'
+        self._put(LANE_NORMAL, log_entry)
+        return 'normal'
+
+    def _defer_locked(self, log_entry):
+        self.stats['deferred'] += 1
+        self._backlog.append((time.monotonic(), log_entry))
+        if len(self._backlog) > self.backlog_max:
+            self._backlog.popleft()
+            self.stats['backlog_dropped'] += 1
+
+    def get(self, timeout=None):
+        """Lấy dòng kế tiếp (ưu tiên trước); trả về (log_entry, lane), log_entry None = dừng"""
+        lane, _, enqueued_at, log_entry = self._queue.get(timeout=timeout)
+        if lane == _LANE_STOP:
+            return None, None
+        wait = time.monotonic() - enqueued_at
+        with self._lock:
+            # Backlog lines are old by design; only live lanes drive the overload signal
+            if lane != LANE_BACKLOG:
+                self._live_pending -= 1
+                self._lag = 0.8 * self._lag + 0.2 * wait
+                self.stats['max_lag_seconds'] = max(self.stats['max_lag_seconds'], wait)
+            if lane == LANE_PRIORITY:
+                self._priority_lag = 0.8 * self._priority_lag + 0.2 * wait
+                self.stats['max_priority_lag_seconds'] = max(self.stats['max_priority_lag_seconds'], wait)
+        return log_entry, LANE_NAMES[lane]
+
+    def task_done(self):
+        self._queue.task_done()
+
+    def _drain_loop(self):
+        while not self._stop_event.wait(self.drain_interval):
+            with self._lock:
+                self._decay_idle_lag_locked()
+                self._update_overload_locked()
+                if self.overloaded or not self._backlog:
+                    continue
+                room = self.low_depth - self._queue.qsize()
+                batch = [self._backlog.popleft() for _ in range(min(room, len(self._backlog)))]
+                self.stats['backlog_drained'] += len(batch)
+            for enqueued_at, log_entry in batch:
+                self._put(LANE_BACKLOG, log_entry, enqueued_at)
+
+    def stop(self, workers=0, flush_backlog=False):
+        """Dừng drainer và gửi sentinel (sau mọi dòng đã xếp hàng) cho từng worker.
+
+        flush_backlog=True đưa toàn bộ backlog vào queue trước sentinel để workers xử lý nốt.
+        """
+        self._stop_event.set()
+        if self._drainer is not None:
+            self._drainer.join(timeout=2)
+        if flush_backlog:
+            with self._lock:
+                backlog, self._backlog = list(self._backlog), deque()
+                self.stats['backlog_drained'] += len(backlog)
+            for enqueued_at, log_entry in backlog:
+                self._put(LANE_BACKLOG, log_entry, enqueued_at)
+        for _ in range(workers):
+            self._queue.put((_LANE_STOP, next(self._seq), 0.0, None))
+        if self._backlog:
+            logger.warning(f"⚠️ {len(self._backlog)} deferred lines were not processed before shutdown")
+
+    def drain_remaining(self):
+        """Lấy ra mọi dòng chưa xử lý (queue + backlog), ví dụ để spill khi hết hạn shutdown"""
+        entries = []
+        while True:
+            try:
+                lane, _, _, log_entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            if lane != _LANE_STOP:
+                entries.append(log_entry)
+            if lane < LANE_BACKLOG:
+                with self._lock:
+                    self._live_pending -= 1
+        with self._lock:
+            entries.extend(log_entry for _, log_entry in self._backlog)
+            self._backlog.clear()
+        return entries
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['overloaded'] = self.overloaded
+            if self.overloaded:
+                stats['overload_seconds'] += time.monotonic() - self._overload_started
+            stats['queue_depth'] = self._queue.qsize()
+            stats['backlog_size'] = len(self._backlog)
+            stats['lag_seconds'] = self._lag
+            stats['priority_lag_seconds'] = self._priority_lag
+        stats['shed'] = stats['deferred']
+        return stats
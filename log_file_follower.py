@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Log File Follower – theo dõi nhiều access log (mỗi vhost một file) song song
+
+- Nhận đường dẫn file, glob pattern hoặc thư mục; tự phát hiện file mới xuất hiện
+- Mỗi file một thread follower độc lập (xử lý rotate/truncate, dòng ghi dở)
+- Mỗi dòng được gửi kèm file nguồn và vhost cho callback (thường là queue chung của collector)
+- Checkpoint offset (inode + byte offset) để khởi động lại tiếp tục đúng chỗ, không mất/lặp dòng
+"""
+
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIR_PATTERN = '*access*.log'
+
+# example.com-access.log, example.com_access_log, access.example.com.log, example.com.log
+_VHOST_STRIP_RE = re.compile(r'([._-]?(ssl[._-])?access([._-]log)?|[._-]log)$', re.IGNORECASE)
+_VHOST_PREFIX_RE = re.compile(r'^(ssl[._-])?access[._-]', re.IGNORECASE)
+_DEFAULT_LOG_NAMES = ('', 'access', 'access_full_json', 'other_vhosts', 'ssl')
+
+
+def vhost_from_path(path):
+    """Suy ra vhost từ tên file log ('' nếu là access log mặc định)"""
+    name = os.path.basename(path)
+    name = _VHOST_STRIP_RE.sub('', name)
+    if name.lower() in _DEFAULT_LOG_NAMES:
+        return ''
+    name = _VHOST_PREFIX_RE.sub('', name)
+    return '' if name.lower() in _DEFAULT_LOG_NAMES else name
+
+
+def discover_log_files(sources, dir_pattern=DEFAULT_DIR_PATTERN):
+    """Mở rộng danh sách nguồn (file, glob, thư mục) thành tập file đang tồn tại"""
+    if isinstance(sources, str):
+        sources = [sources]
+    found = set()
+    for source in sources:
+        if os.path.isdir(source):
+            candidates = glob.glob(os.path.join(source, dir_pattern))
+        elif glob.has_magic(source):
+            candidates = glob.glob(source)
+        else:
+            candidates = [source] if os.path.exists(source) else []
+        for path in candidates:
+            # Rotated/compressed segments are handled by the backfill scanner, not followed
+            if os.path.isfile(path) and not path.endswith(('.gz', '.bz2', '.xz', '.zip')):
+                found.add(os.path.abspath(path))
+    return found
+
+
+class LogFileFollower(threading.Thread):
+    """Follow (tail -F) một file log, gọi on_line(line, source_file, vhost) cho mỗi dòng đầy đủ"""
+
+    def __init__(self, path, on_line, from_start=False, poll_interval=0.2, vhost=None, start_offset=None):
+        super().__init__(name=f"follow:{os.path.basename(path)}", daemon=True)
+        self.path = path
+        self.on_line = on_line
+        self.from_start = from_start
+        # Resume position from a checkpoint (takes precedence over from_start)
+        self.start_offset = start_offset
+        self.poll_interval = poll_interval
+        self.vhost = vhost_from_path(path) if vhost is None else vhost
+        self.running = True
+        self.offset = 0
+        self.inode = None
+        self._partial_len = 0
+        self.lines_read = 0
+        self.bytes_read = 0
+        # Last time the follower reached EOF (for lag-in-seconds metrics)
+        self.caught_up_at = time.time()
+        self.error = None
+
+    def stop(self):
+        self.running = False
+    
+    @property
+    def checkpoint_offset(self):
+        """Offset của byte đầu tiên chưa được giao cho on_line (không tính dòng đang ghi dở)"""
+        return self.offset - self._partial_len
+
+    def run(self):
+        try:
+            self._follow()
+        except FileNotFoundError:
+            self.error = 'not_found'
+            logger.error(f"❌ Log file not found: {self.path}")
+        except PermissionError:
+            self.error = 'permission_denied'
+            logger.error(f"❌ Permission denied accessing log file: {self.path}")
+            logger.error("Please run with sudo or check file permissions")
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"❌ Error following {self.path}: {e}")
+
+    def _follow(self):
+        # Binary mode: tell() is a plain byte offset and undecodable bytes cannot stop the tail
+        f = open(self.path, 'rb')
+        inode = self.inode = os.fstat(f.fileno()).st_ino
+        if self.start_offset is not None:
+            f.seek(min(self.start_offset, os.fstat(f.fileno()).st_size))
+        elif not self.from_start:
+            f.seek(0, 2)
+        self.offset = f.tell()
+        partial = b''
+        try:
+            while self.running:
+                line = f.readline()
+                if line:
+                    self.offset = f.tell()
+                    if not line.endswith(b'\n'):
+                        # Writer is mid-line; keep the fragment until the rest arrives
+                        partial += line
+                        self._partial_len = len(partial)
+                        continue
+                    if partial:
+                        line = partial + line
+                        partial = b''
+                        self._partial_len = 0
+                    self.lines_read += 1
+                    self.bytes_read += len(line)
+                    self.on_line(line.decode('utf-8', errors='replace'), self.path, self.vhost)
+                    continue
+
+                # EOF: detect rotation (new inode) or truncation, otherwise wait
+                self.caught_up_at = time.time()
+                try:
+                    st = os.stat(self.path)
+                except FileNotFoundError:
+                    time.sleep(self.poll_interval)
+                    continue
+                if st.st_ino != inode or st.st_size < self.offset:
+                    logger.info(f"🔄 Log file rotated/truncated, reopening: {self.path}")
+                    if st.st_ino != inode:
+                        # Drain whatever was appended to the old file before the rename
+                        for line in (partial + f.read()).splitlines():
+                            if line:
+                                self.lines_read += 1
+                                self.bytes_read += len(line) + 1
+                                self.on_line(line.decode('utf-8', errors='replace'), self.path, self.vhost)
+                    f.close()
+                    f = open(self.path, 'rb')
+                    inode = self.inode = os.fstat(f.fileno()).st_ino
+                    self.offset = 0
+                    partial = b''
+                    self._partial_len = 0
+                    continue
+                time.sleep(self.poll_interval)
+        finally:
+            f.close()
+
+
+class OffsetCheckpoint:
+    """Lưu {path: {inode, offset}} ra file JSON (ghi atomically: tmp + fsync + rename)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.offsets = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Ignoring unreadable offset checkpoint {path}: {e}")
+
+    def resume_offset(self, path):
+        """Offset để tiếp tục nếu file vẫn là file cũ (cùng inode, không bị truncate), ngược lại None"""
+        saved = self.offsets.get(path)
+        if not saved:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_ino != saved.get('inode') or st.st_size < saved.get('offset', 0):
+            return None
+        return saved['offset']
+
+    def save(self, followers):
+        for follower in followers:
+            if follower.inode is not None:
+                self.offsets[follower.path] = {'inode': follower.inode, 'offset': follower.checkpoint_offset}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.offsets, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class MultiFileFollower:
+    """Quản lý tập follower: phát hiện file mới định kỳ, mỗi file một thread"""
+
+    def __init__(self, sources, on_line, dir_pattern=DEFAULT_DIR_PATTERN,
+                 discovery_interval=5.0, poll_interval=0.2, checkpoint_path=None):
+        self.sources = [sources] if isinstance(sources, str) else list(sources)
+        self.on_line = on_line
+        self.dir_pattern = dir_pattern
+        self.discovery_interval = discovery_interval
+        self.poll_interval = poll_interval
+        self.followers = {}
+        # Offsets are saved every discovery_interval and on stop(); files present at startup
+        # resume from their checkpoint instead of the end
+        self.checkpoint = OffsetCheckpoint(checkpoint_path) if checkpoint_path else None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._discovery_thread = None
+
+    def start(self):
+        # Files present at startup are tailed from the end, like the single-file collector;
+        # files discovered later are new and read from the beginning
+        self._discover(from_start=False)
+        if not self.followers:
+            logger.warning(f"⚠️ No log files match {self.sources} yet, waiting for them to appear")
+        self._discovery_thread = threading.Thread(target=self._discovery_loop, name='log-discovery', daemon=True)
+        self._discovery_thread.start()
+
+    def _discover(self, from_start):
+        paths = discover_log_files(self.sources, self.dir_pattern)
+        with self._lock:
+            # Drop followers that died (e.g. permission denied) so they are retried
+            for path, follower in list(self.followers.items()):
+                if not follower.is_alive() and follower.running:
+                    del self.followers[path]
+            for path in sorted(paths - set(self.followers)):
+                start_offset = self.checkpoint.resume_offset(path) if self.checkpoint else None
+                follower = LogFileFollower(path, self.on_line, from_start=from_start,
+                                           poll_interval=self.poll_interval, start_offset=start_offset)
+                self.followers[path] = follower
+                follower.start()
+                resumed = f", resuming at byte {start_offset}" if start_offset is not None else ''
+                logger.info(f"📁 Monitoring log file: {path} (vhost: {follower.vhost or '-'}{resumed})")
+
+    def _discovery_loop(self):
+        while not self._stop_event.wait(self.discovery_interval):
+            try:
+                self._discover(from_start=True)
+                self.save_checkpoint()
+            except Exception as e:
+                logger.error(f"Error discovering log files: {e}")
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        with self._lock:
+            followers = list(self.followers.values())
+        for follower in followers:
+            follower.stop()
+        for follower in followers:
+            follower.join(timeout=timeout)
+        if self._discovery_thread is not None:
+            self._discovery_thread.join(timeout=timeout)
+        self.save_checkpoint()
+
+    def save_checkpoint(self):
+        if self.checkpoint is None:
+            return
+        with self._lock:
+            followers = list(self.followers.values())
+        try:
+            self.checkpoint.save(followers)
+        except OSError as e:
+            logger.error(f"Error saving offset checkpoint: {e}")
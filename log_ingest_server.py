@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Log Ingest Server – nhận log trực tiếp thay vì tail file (asyncio)
+
+- Unix socket / TCP: newline-delimited (JSON hoặc định dạng Apache), nhiều kết nối đồng thời
+- UDP syslog: mỗi datagram một (hoặc nhiều) dòng, header RFC 3164/5424 được bỏ
+- stdin (pipe mode): Apache `CustomLog "|python realtime_log_collector.py" ...`
+- Mỗi dòng được đưa vào cùng callback on_line(line, source, vhost) như file follower
+- on_line chạy trên event loop nên không được chặn; khi consumer đầy (backpressure) các
+  kết nối stream tạm ngừng đọc bằng await, loop vẫn phục vụ kết nối/datagram khác
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_LINE_BYTES = 64 * 1024
+
+# <PRI>Mmm dd hh:mm:ss host tag[pid]: msg   |   <PRI>1 TIMESTAMP HOST APP PROCID MSGID SD msg
+_SYSLOG_HEADER_RE = re.compile(
+    r"^<\d{1,3}>(?:"
+    r"1 \S+ \S+ \S+ \S+ \S+ (?:-|(?:\[(?:[^\]\\]|\\.)*\])+) ?"
+    r"|[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d (?:\S+ )?[^:\s\[]+(?:\[\d+\])?: ?"
+    r")?"
+)
+
+
+def strip_syslog_header(line: str) -> str:
+    """Bỏ header syslog (nếu có), trả về phần message"""
+    if line.startswith('<'):
+        return _SYSLOG_HEADER_RE.sub('', line, count=1)
+    return line
+
+
+def parse_address(value, default_host='127.0.0.1'):
+    """'host:port' hoặc 'port' → (host, port)"""
+    if value is None or isinstance(value, tuple):
+        return value
+    host, _, port = str(value).rpartition(':')
+    return (host.strip('[]') or default_host, int(port))
+
+
+class _SyslogDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.stats['datagrams'] += 1
+        source = f"udp:{addr[0]}:{addr[1]}" if isinstance(addr, tuple) else 'udp'
+        for raw in data.splitlines():
+            self.server._dispatch(raw, source, syslog=True)
+
+    def error_received(self, exc):
+        self.server.stats['errors'] += 1
+        logger.warning(f"⚠️ UDP syslog error: {exc}")
+
+
+class LogIngestServer:
+    """Front end asyncio chạy trong một background thread.
+
+    Tham số:
+    - on_line: callback(line, source, vhost) không chặn – thường là RealtimeLogCollector._ingest_line
+    - backpressure: callable() → True khi consumer đầy; unix/tcp/stdin ngừng đọc tới khi hết đầy
+    - unix_path: đường dẫn Unix socket (stream)
+    - tcp_address: (host, port) hoặc 'host:port' – newline-delimited, chấp nhận header syslog
+    - udp_address: (host, port) hoặc 'host:port' – syslog UDP
+    - stdin: đọc stdin (pipe mode); on_eof được gọi khi pipe đóng
+    - max_line_bytes: dòng dài hơn bị bỏ (tránh một client giữ buffer vô hạn)
+    """
+
+    def __init__(self, on_line, unix_path=None, tcp_address=None, udp_address=None, stdin=False,
+                 on_eof=None, max_line_bytes=DEFAULT_MAX_LINE_BYTES, vhost='', backpressure=None):
+        self.on_line = on_line
+        self.backpressure = backpressure
+        self.unix_path = unix_path
+        self.tcp_address = parse_address(tcp_address)
+        self.udp_address = parse_address(udp_address)
+        self.stdin = stdin
+        self.on_eof = on_eof
+        self.max_line_bytes = max_line_bytes
+        self.vhost = vhost
+
+        self.loop = None
+        self._thread = None
+        self._servers = []
+        self._transports = []
+        self._connections = set()
+        self._ready = threading.Event()
+        self._stopped = None
+        self.addresses = {}
+        self.error = None
+
+        self.stats = {
+            'connections': 0,
+            'active_connections': 0,
+            'lines': 0,
+            'bytes': 0,
+            'datagrams': 0,
+            'oversized': 0,
+            'backpressure_waits': 0,
+            'errors': 0
+        }
+
+    def _dispatch(self, raw, source, syslog=False):
+        if len(raw) > self.max_line_bytes:
+            self.stats['oversized'] += 1
+            return
+        line = raw.decode('utf-8', errors='replace').strip()
+        if not line:
+            return
+        if syslog:
+            line = strip_syslog_header(line)
+        self.stats['lines'] += 1
+        self.stats['bytes'] += len(raw)
+        try:
+            self.on_line(line, source, self.vhost)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning(f"Error handling ingested line from {source}: {e}")
+
+    async def _wait_for_room(self):
+        """Ngừng đọc (không chặn loop) khi consumer báo đầy; TCP/unix đẩy áp lực ngược về client"""
+        if self.backpressure is None or not self.backpressure():
+            return
+        self.stats['backpressure_waits'] += 1
+        while self.backpressure():
+            await asyncio.sleep(0.05)
+
+    async def _read_stream(self, reader, source, syslog):
+        while True:
+            await self._wait_for_room()
+            try:
+                raw = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                # Connection closed: flush a final unterminated line
+                if e.partial:
+                    self._dispatch(e.partial, source, syslog)
+                return
+            except asyncio.LimitOverrunError as e:
+                # Over-long line: discard up to and including the next newline
+                self.stats['oversized'] += 1
+                await reader.readexactly(e.consumed)
+                while True:
+                    try:
+                        await reader.readuntil(b'\n')
+                        break
+                    except asyncio.LimitOverrunError as again:
+                        await reader.readexactly(again.consumed)
+                continue
+            self._dispatch(raw, source, syslog)
+
+    def _stream_handler(self, kind, syslog):
+        async def handle(reader, writer):
+            peer = writer.get_extra_info('peername')
+            source = f"{kind}:{peer[0]}:{peer[1]}" if isinstance(peer, tuple) else f"{kind}:{self.unix_path}"
+            task = asyncio.current_task()
+            self._connections.add(task)
+            self.stats['connections'] += 1
+            self.stats['active_connections'] += 1
+            try:
+                await self._read_stream(reader, source, syslog)
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.warning(f"⚠️ Error reading from {source}: {e}")
+            finally:
+                self.stats['active_connections'] -= 1
+                self._connections.discard(task)
+                writer.close()
+        return handle
+
+    async def _read_stdin(self):
+        reader = asyncio.StreamReader(limit=self.max_line_bytes)
+        try:
+            await self.loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+        except (ValueError, OSError):
+            # Not a pipe/socket (e.g. a regular file redirected to stdin): read it in a thread
+            while True:
+                await self._wait_for_room()
+                raw = await self.loop.run_in_executor(None, sys.stdin.buffer.readline)
+                if not raw:
+                    break
+                self._dispatch(raw, 'stdin')
+        else:
+            await self._read_stream(reader, 'stdin', syslog=False)
+        logger.info("📥 stdin closed")
+        if self.on_eof:
+            self.on_eof()
+
+    async def _serve(self):
+        self._stopped = asyncio.Event()
+        limit = self.max_line_bytes
+        if self.unix_path:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            server = await asyncio.start_unix_server(self._stream_handler('unix', False), self.unix_path, limit=limit)
+            self._servers.append(server)
+            self.addresses['unix'] = self.unix_path
+            logger.info(f"🔌 Listening on unix socket {self.unix_path}")
+        if self.tcp_address:
+            server = await asyncio.start_server(self._stream_handler('tcp', True), *self.tcp_address, limit=limit)
+            self._servers.append(server)
+            self.addresses['tcp'] = server.sockets[0].getsockname()[:2]
+            logger.info(f"🔌 Listening on tcp {self.addresses['tcp'][0]}:{self.addresses['tcp'][1]}")
+        if self.udp_address:
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: _SyslogDatagramProtocol(self), local_addr=self.udp_address)
+            self._transports.append(transport)
+            self.addresses['udp'] = transport.get_extra_info('sockname')[:2]
+            logger.info(f"🔌 Listening for syslog on udp {self.addresses['udp'][0]}:{self.addresses['udp'][1]}")
+        stdin_task = self.loop.create_task(self._read_stdin()) if self.stdin else None
+        self._ready.set()
+
+        await self._stopped.wait()
+
+        if stdin_task is not None:
+            stdin_task.cancel()
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for transport in self._transports:
+            transport.close()
+        for task in list(self._connections):
+            task.cancel()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"❌ Ingest server error: {e}")
+        finally:
+            self._ready.set()
+            self.loop.close()
+
+    def start(self, timeout=5.0):
+        """Chạy event loop trong background thread; chờ đến khi mọi listener sẵn sàng"""
+        self._thread = threading.Thread(target=self._run, name='log-ingest', daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout)
+        if self.error:
+            raise RuntimeError(f"Ingest server failed to start: {self.error}")
+        return self
+
+    def stop(self, timeout=5.0):
+        if self.loop is not None and self._stopped is not None and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
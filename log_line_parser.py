@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Log Line Parser – parse dòng access_full_json.log nhanh, có fallback một lượt
+
+Chiến lược (theo thứ tự, có bộ đếm cho từng chiến lược):
+1. 'json'     – decode trực tiếp (orjson nếu có, nếu không dùng json chuẩn)
+2. 'repaired' – sửa lỗi JSON thường gặp (escape \\xHH của mod_log_config, dấu phẩy thừa...) rồi decode
+3. 'manual'   – trích xuất các trường chính bằng MỘT regex kết hợp, quét một lượt
+4. 'failed'   – không parse được
+
+ApacheLogFormatParser đọc trực tiếp access log chuẩn (common/combined hoặc LogFormat
+tùy ý), không cần cấu hình Apache ghi JSON. Benchmark: bench_log_parsers.py
+"""
+
+import functools
+import json
+import re
+import threading
+
+# Optional fast JSON decoder
+try:
+    import orjson as _orjson
+except Exception:  # pragma: no cover
+    _orjson = None
+
+if _orjson is not None:
+    _fast_loads = _orjson.loads
+else:
+    _fast_loads = json.loads
+
+# Both orjson.JSONDecodeError and json.JSONDecodeError subclass ValueError
+JSON_DECODE_ERRORS = (ValueError, TypeError)
+
+# Apache mod_log_config escapes non-printable bytes as \xhh, which is not valid JSON
+_APACHE_HEX_ESCAPE_RE = re.compile(r'(?<!\\)((?:\\\\)*)\\x([0-9a-fA-F]{2})')
+_BRACE_RE = re.compile(r'[{}]')
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+_UNTERMINATED_STRING_RE = re.compile(r'"([^"]*?)(?=\s*[,}\]])')
+_MISSING_COMMA_RE = re.compile(r'([^,}\]])\s*([}\]])')
+_MISSING_VALUE_RE = re.compile(r':\s*([,}\]])')
+_DUPLICATE_COMMA_RE = re.compile(r',+')
+
+INT_FIELDS = ('status', 'bytes_sent', 'response_time_ms', 'request_length', 'response_length')
+STR_FIELDS = ('time', 'remote_ip', 'method', 'uri', 'query_string', 'referer',
+              'user_agent', 'cookie', 'payload', 'session_token')
+MANUAL_FIELDS = ('time', 'remote_ip', 'method', 'uri', 'query_string', 'status', 'bytes_sent',
+                 'response_time_ms', 'referer', 'user_agent', 'request_length',
+                 'response_length', 'cookie', 'payload', 'session_token')
+
+# One alternation over every known field: string fields capture up to the next quote,
+# numeric fields capture digits (same semantics as the old per-field patterns).
+# Values are captured in a lookahead so an unterminated value cannot swallow the next key.
+_FIELD_SCAN_RE = re.compile(
+    r'"(?:(?P<s>' + '|'.join(STR_FIELDS) + r')":\s*(?="(?P<sv>[^"]*)")'
+    r'|(?P<i>' + '|'.join(INT_FIELDS) + r')":\s*(?P<iv>\d+))'
+)
+
+PARSE_STRATEGIES = ('json', 'repaired', 'manual', 'failed')
+
+
+def fast_json_loads(text):
+    """Decode JSON bằng decoder nhanh nhất có sẵn"""
+    return _fast_loads(text)
+
+
+def _try_loads(text):
+    try:
+        return _fast_loads(text)
+    except JSON_DECODE_ERRORS:
+        return None
+
+
+def fix_json_line(line):
+    """Try to fix common JSON parsing issues including line breaks"""
+    return _repair_json_line(line)[0]
+
+
+def _repair_json_line(line):
+    """Apply repairs cheapest-first; returns (fixed_line, decoded object or None)"""
+    try:
+        line = line.strip()
+
+        # If line doesn't start with {, it might be a continuation
+        if not line.startswith('{'):
+            start_pos = line.find('{')
+            if start_pos > 0:
+                line = line[start_pos:]
+            else:
+                return line, None  # Can't fix this line
+
+        # If line doesn't end with }, count braces to find the end of the object
+        if not line.endswith('}'):
+            brace_count = 0
+            end_pos = -1
+            for m in _BRACE_RE.finditer(line):
+                if m.group() == '{':
+                    brace_count += 1
+                else:
+                    brace_count -= 1
+                    if brace_count == 0:
+                        end_pos = m.end()
+                        break
+            if end_pos > 0:
+                line = line[:end_pos]
+
+        # Convert Apache \xhh escapes to JSON \u00hh
+        if '\\x' in line:
+            line = _APACHE_HEX_ESCAPE_RE.sub(r'\1\\u00\2', line)
+            obj = _try_loads(line)
+            if obj is not None:
+                return line, obj
+
+        line = _TRAILING_COMMA_RE.sub(r'\1', line)
+        obj = _try_loads(line)
+        if obj is not None:
+            return line, obj
+
+        # Heavier rewrites only when the cheap fixes were not enough
+        line = _UNTERMINATED_STRING_RE.sub(r'"\1"', line)
+        line = _MISSING_COMMA_RE.sub(r'\1,\2', line)
+        line = _MISSING_VALUE_RE.sub(r': null\1', line)
+        line = _DUPLICATE_COMMA_RE.sub(',', line)
+
+        return line, _try_loads(line)
+    except Exception:
+        return line, None
+
+
+def extract_fields_manually(line):
+    """Extract key fields in a single scan when JSON parsing fails"""
+    try:
+        found = {}
+        for m in _FIELD_SCAN_RE.finditer(line):
+            name = m.group('s')
+            if name is not None:
+                if name not in found:
+                    found[name] = m.group('sv')
+            else:
+                name = m.group('i')
+                if name not in found:
+                    found[name] = int(m.group('iv'))
+
+        log_entry = {}
+        for field in MANUAL_FIELDS:
+            if field in found:
+                log_entry[field] = found[field]
+            else:
+                log_entry[field] = 0 if field in INT_FIELDS else ""
+        return log_entry
+    except Exception:
+        return None
+
+
+class JsonLogParser:
+    """Parser cho access_full_json.log với bộ đếm theo chiến lược parse"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {strategy: 0 for strategy in PARSE_STRATEGIES}
+
+    def _count(self, strategy):
+        with self._lock:
+            self.stats[strategy] += 1
+
+    def parse(self, line):
+        """Parse một dòng log, trả về dict hoặc None"""
+        line = line.strip()
+        try:
+            entry = _fast_loads(line)
+            if isinstance(entry, dict):
+                self._count('json')
+                return entry
+        except JSON_DECODE_ERRORS:
+            pass
+
+        entry = _repair_json_line(line)[1]
+        if isinstance(entry, dict):
+            self._count('repaired')
+            return entry
+
+        entry = extract_fields_manually(line)
+        # A line with none of the known fields is not a log entry
+        if entry is None or not any(entry.values()):
+            self._count('failed')
+            return None
+        self._count('manual')
+        return entry
+
+    def get_stats(self):
+        """Snapshot bộ đếm (kèm tổng số dòng)"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['total'] = sum(stats.values())
+        return stats
+
+
+# ---------------------------------------------------------------------------
+# Apache LogFormat (combined/common/custom) parser
+# ---------------------------------------------------------------------------
+
+APACHE_LOG_FORMATS = {
+    'common': '%h %l %u %t "%r" %>s %b',
+    'combined': '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-Agent}i"',
+    'vhost_combined': '%v:%p %h %l %u %t "%r" %>s %O "%{Referer}i" "%{User-Agent}i"',
+}
+
+_DIRECTIVE_RE = re.compile(r'%[<>]?(?:!?\d{3}(?:,\d{3})*)?(?:\{([^}]*)\})?([a-zA-Z%])')
+_APACHE_ESCAPE_RE = re.compile(r'\\(x[0-9a-fA-F]{2}|.)')
+_APACHE_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '"': '"', '\\': '\\'}
+_MONTHS = {'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04', 'May': '05', 'Jun': '06',
+           'Jul': '07', 'Aug': '08', 'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'}
+
+# Unrolled "(?:[^"\\]|\\.)*" – one character class run per segment instead of per character
+_QUOTED_VALUE = r'[^"\\]*(?:\\.[^"\\]*)*'
+_UNQUOTED_VALUE = r'\S*'
+# %r split into method / uri / query_string / protocol; malformed request lines
+# (e.g. "-" or binary junk) fall through to request_line
+_REQUEST_PATTERN = (
+    r'(?:(?P<method>[A-Za-z]+) (?P<uri>[^ ?"\\]*(?:\\.[^ ?"\\]*)*)(?:\?(?P<query_string>[^ "\\]*(?:\\.[^ "\\]*)*))?'
+    r'(?: (?P<protocol>[^ "]*))?|(?P<request_line>' + _QUOTED_VALUE + r'))'
+)
+# Lines without a backslash cannot contain escaped quotes: plain character classes, several times
+# cheaper for the regex engine than the unrolled escape-aware patterns above
+_PLAIN_QUOTED_VALUE = r'[^"]*'
+_PLAIN_REQUEST_PATTERN = (
+    r'(?:(?P<method>[A-Za-z]+) (?P<uri>[^ ?"]*)(?:\?(?P<query_string>[^ "]*))?'
+    r'(?: (?P<protocol>[^ "]*))?|(?P<request_line>[^"]*))'
+)
+_REQUEST_FIELDS = {'method', 'uri', 'query_string', 'protocol', 'request_line'}
+_HEADER_FIELDS = {'referer': 'referer', 'user-agent': 'user_agent', 'cookie': 'cookie'}
+# Directives mapped to log_entry fields (field, pattern or None for the default value pattern)
+_SIMPLE_DIRECTIVES = {
+    'h': ('remote_ip', None), 'a': ('remote_ip', None),
+    'u': ('remote_user', None),
+    's': ('status', r'\d{3}|-'),
+    'b': ('bytes_sent', r'\d+|-'), 'B': ('bytes_sent', r'\d+'),
+    'I': ('request_length', r'\d+|-'), 'O': ('response_length', r'\d+|-'),
+    'D': ('response_time_us', r'\d+'),
+    'v': ('vhost', None), 'V': ('vhost', None),
+    'm': ('method', None), 'U': ('uri', None), 'q': ('query_string', None),
+    'H': ('protocol', None),
+}
+_INT_OUTPUT_FIELDS = ('status', 'bytes_sent', 'request_length', 'response_length')
+
+
+def _int_or_zero(value):
+    return int(value) if value != '-' else 0
+
+
+_ELAPSED_TO_MS = {
+    's': lambda v: int(v) * 1000,
+    'ms': int,
+    'us': lambda v: int(v) // 1000,
+}
+
+
+def _apache_unescape(value):
+    """Undo mod_log_config escaping (\\" \\\\ \\xhh \\n \\t)"""
+    def repl(m):
+        esc = m.group(1)
+        if len(esc) == 3 and esc[0] == 'x':
+            return chr(int(esc[1:], 16))
+        return _APACHE_ESCAPES.get(esc, '\\' + esc)
+    return _APACHE_ESCAPE_RE.sub(repl, value)
+
+
+@functools.lru_cache(maxsize=4096)
+def apache_time_to_iso(value):
+    """'10/Oct/2000:13:55:36 -0700' -> '2000-10-10T13:55:36-07:00' (không dùng strptime)"""
+    try:
+        day, mon, rest = value[:2], value[3:6], value[7:]
+        year, clock = rest[:4], rest[5:13]
+        tz = rest[14:19]
+        iso = f"{year}-{_MONTHS[mon]}-{day}T{clock}"
+        if len(tz) == 5:
+            iso += f"{tz[:3]}:{tz[3:]}"
+        return iso
+    except Exception:
+        return value
+
+
+class ApacheLogFormatParser:
+    """Biên dịch một LogFormat của Apache thành một regex duy nhất.
+
+    Kết quả parse có cùng dạng log_entry mà detector dùng (method, uri, query_string,
+    status, bytes_sent, referer, user_agent, cookie, time ISO, response_time_ms...).
+    log_format có thể là 'common', 'combined', 'vhost_combined' hoặc chuỗi LogFormat tùy ý.
+    """
+
+    def __init__(self, log_format='combined'):
+        self.log_format = APACHE_LOG_FORMATS.get(log_format, log_format)
+        self._lock = threading.Lock()
+        self.stats = {'format': 0, 'failed': 0}
+        self._regex = self._compile(self.log_format)
+        self._match = self._regex.match
+        self._plain_match = self._compile(self.log_format, plain=True).match
+        self._str_fields = tuple(self._str_fields)
+        self._converters = tuple(self._converters)
+
+    def _capture(self, field, pattern, converter=None):
+        """Named group = tên trường log_entry; trường lặp lại thì không capture"""
+        if field in self._taken:
+            return f'(?:{pattern})'
+        self._taken.add(field)
+        if converter is None:
+            self._str_fields.append(field)
+        else:
+            self._converters.append((field, converter))
+        return f'(?P<{field}>{pattern})'
+
+    def _compile(self, log_format, plain=False):
+        """Regex cho log_format; plain=True: chỉ dùng cho dòng không có dấu backslash"""
+        self._has_request = False
+        self._taken = set()
+        self._str_fields = []
+        self._converters = []
+        quoted_value = _PLAIN_QUOTED_VALUE if plain else _QUOTED_VALUE
+        parts = []
+        pos = 0
+        for m in _DIRECTIVE_RE.finditer(log_format):
+            literal = log_format[pos:m.start()]
+            parts.append(re.escape(literal))
+            pos = m.end()
+            quoted = literal.endswith('"')
+            value = quoted_value if quoted else _UNQUOTED_VALUE
+            arg, code = m.group(1), m.group(2)
+
+            if code == '%':
+                parts.append('%')
+            elif code == 'r':
+                if self._has_request or self._taken & _REQUEST_FIELDS:
+                    parts.append(value)
+                else:
+                    self._has_request = True
+                    self._taken |= _REQUEST_FIELDS
+                    parts.append(_PLAIN_REQUEST_PATTERN if plain else _REQUEST_PATTERN)
+            elif code == 't':
+                if arg:
+                    # strftime-style %{format}t: keep the raw value
+                    parts.append(self._capture('time', value))
+                else:
+                    parts.append(r'\[' + self._capture('time', r'[^\]]+', apache_time_to_iso) + r'\]')
+            elif code == 'i' and arg:
+                field = _HEADER_FIELDS.get(arg.lower(), 'header_' + re.sub(r'\W', '_', arg.lower()))
+                parts.append(self._capture(field, value))
+            elif code == 'T':
+                unit = (arg or 's').lower()
+                converter = _ELAPSED_TO_MS.get(unit, _ELAPSED_TO_MS['s'])
+                parts.append(self._capture('response_time_ms', r'\d+', converter))
+            elif code in _SIMPLE_DIRECTIVES:
+                field, pattern = _SIMPLE_DIRECTIVES[code]
+                if code in ('h', 'a', 'v', 'V', 'u') and not quoted:
+                    pattern = r'[^\s:]+' if log_format[pos:pos + 1] == ':' else r'\S+'
+                if field == 'response_time_us':
+                    parts.append(self._capture('response_time_ms', pattern, _ELAPSED_TO_MS['us']))
+                elif field in _INT_OUTPUT_FIELDS:
+                    parts.append(self._capture(field, pattern, _int_or_zero))
+                else:
+                    parts.append(self._capture(field, pattern or value))
+            else:
+                # Directive we do not map (%l, %p, %P, %X, %k, %{..}e, %{..}n ...)
+                parts.append(value)
+        parts.append(re.escape(log_format[pos:]))
+        return re.compile(''.join(parts))
+
+    def _count(self, strategy):
+        with self._lock:
+            self.stats[strategy] += 1
+
+    def parse(self, line):
+        """Parse một dòng log theo LogFormat, trả về log_entry dict hoặc None"""
+        has_escape = '\\' in line
+        m = self._match(line) if has_escape else self._plain_match(line)
+        if m is None:
+            self._count('failed')
+            return None
+
+        entry = m.groupdict()
+        if has_escape:
+            for field in self._str_fields:
+                value = entry[field]
+                if value == '-':
+                    entry[field] = ''
+                elif '\\' in value:
+                    entry[field] = _apache_unescape(value)
+        else:
+            for field in self._str_fields:
+                if entry[field] == '-':
+                    entry[field] = ''
+        for field, converter in self._converters:
+            entry[field] = converter(entry[field])
+
+        if self._has_request:
+            request_line = entry.pop('request_line')
+            if request_line is not None:
+                # Malformed request line (e.g. "-" or TLS junk): keep it visible to the detector
+                del entry['method'], entry['protocol']
+                entry['uri'] = _apache_unescape(request_line) if '\\' in request_line else request_line
+                entry['query_string'] = ''
+            else:
+                if entry['protocol'] is None:
+                    del entry['protocol']
+                if entry['query_string'] is None:
+                    entry['query_string'] = ''
+                if has_escape:
+                    # SQLi payloads may sit in the path as well as in the query string
+                    if '\\' in entry['uri']:
+                        entry['uri'] = _apache_unescape(entry['uri'])
+                    if '\\' in entry['query_string']:
+                        entry['query_string'] = _apache_unescape(entry['query_string'])
+        elif 'query_string' in entry and entry['query_string'].startswith('?'):
+            entry['query_string'] = entry['query_string'][1:]
+        else:
+            entry.setdefault('query_string', '')
+
+        self._count('format')
+        return entry
+
+    def get_stats(self):
+        """Snapshot bộ đếm (kèm tổng số dòng)"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['total'] = sum(stats.values())
+        return stats
+
+
+def create_log_parser(log_format='json'):
+    """Tạo parser theo log_format: 'json' (access_full_json.log) hoặc một Apache LogFormat"""
+    if log_format in (None, 'json'):
+        return JsonLogParser()
+    return ApacheLogFormatParser(log_format)
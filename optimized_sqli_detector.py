@@ -18,11 +18,13 @@ from sklearn.preprocessing import StandardScaler, LabelEncoder
 import re
 import logging
 import math
+import threading
 import urllib.parse
 import ipaddress as _ip
 import urllib.parse as _up
 import numpy as np
 import base64
+from typing import List, NamedTuple
 
 # Setup logging
 logging.basicConfig(
@@ -31,8 +33,103 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class Verdict(NamedTuple):
+    """Kết quả dự đoán cho một log – chỉ chứa kiểu Python gốc (không numpy), JSON được ngay.
+
+    Vẫn unpack được như tuple cũ: is_sqli, score, patterns, confidence = verdict
+    """
+    is_sqli: bool
+    score: float
+    patterns: List[str]
+    confidence: str
+
+    def to_dict(self):
+        return {'is_sqli': self.is_sqli, 'score': self.score,
+                'patterns': self.patterns, 'confidence': self.confidence}
+
+
 SAFE_TEXT_REGEX = re.compile(r"^[a-z0-9_\-\./\?=&:%\s]*$")
 
+# Pattern dùng cho feature sqli_patterns (extract_optimized_features)
+FEATURE_SQLI_PATTERNS = [
+    'union', 'select', 'drop', 'insert', 'update', 'delete',
+    'or 1=1', "or '1'='1", 'and 1=1', "and '1'='1",
+    'sleep(', 'waitfor', 'benchmark', 'information_schema',
+    'mysql.', 'pg_sleep', 'dbms_pipe', 'sys.',
+    'cast(', 'concat(', 'char(', 'ascii(',
+    'substring(', 'mid(', 'substr(',
+    '--', '/*', '*/', '; drop', '; delete',
+    'xor ', 'exec', 'execute', 'version()', 'user()', 'database()',
+    # Additional patterns for better detection
+    'or 1=1--', "or '1'='1--", 'and 1=1--', "and '1'='1--",
+    'or 1=1#', "or '1'='1#", 'and 1=1#', "and '1'='1#",
+    'or 1=1/*', "or '1'='1/*", 'and 1=1/*', "and '1'='1/*"
+]
+
+# Rule-based keywords (predict_single): khớp bất kỳ → SQLi
+RULE_SQLI_KEYWORDS = [
+    'union select', 'or 1=1', 'and 1=1', "' or '", '" or "',
+    'sleep(', 'waitfor delay', 'benchmark(', 'drop table',
+    'delete from', 'insert into', 'update set', 'information_schema',
+    'mysql.user', 'version(', 'user(', 'exec(', 'execute(',
+    'xp_cmdshell', 'sp_executesql', 'load_file(', 'into outfile',
+    '--', '#', '/*', '*/', '0x', 'char(', 'ascii(',
+    'order by', 'group by', 'having', 'offset', 'regexp', 'like',
+    # Additional SQLi patterns (only high-confidence ones)
+    'or 1=1--', 'and 1=1--', 'or 1=1#', 'and 1=1#',
+    'union all select', 'union select *', 'union select 1',
+    'or 1=1 union', 'and 1=1 union', 'or 1=1 select',
+    'and 1=1 select', 'or 1=1 from', 'and 1=1 from',
+    'or 1=1 where', 'and 1=1 where', 'or 1=1 order',
+    'and 1=1 order', 'or 1=1 group', 'and 1=1 group',
+    'or 1=1 having', 'and 1=1 having', 'or 1=1 limit',
+    'and 1=1 limit', 'or 1=1 offset', 'and 1=1 offset',
+    'or 1=1 union select', 'and 1=1 union select',
+    'or 1=1 union all select', 'and 1=1 union all select',
+    'or 1=1 union select *', 'and 1=1 union select *',
+    'or 1=1 union select 1', 'and 1=1 union select 1',
+    'or 1=1 union select 1,2', 'and 1=1 union select 1,2',
+    'or 1=1 union select 1,2,3', 'and 1=1 union select 1,2,3',
+    'or 1=1 union select 1,2,3,4', 'and 1=1 union select 1,2,3,4',
+    'or 1=1 union select 1,2,3,4,5', 'and 1=1 union select 1,2,3,4,5',
+    'or 1=1 union select 1,2,3,4,5,6', 'and 1=1 union select 1,2,3,4,5,6',
+    'or 1=1 union select 1,2,3,4,5,6,7', 'and 1=1 union select 1,2,3,4,5,6,7',
+    'or 1=1 union select 1,2,3,4,5,6,7,8', 'and 1=1 union select 1,2,3,4,5,6,7,8',
+    'or 1=1 union select 1,2,3,4,5,6,7,8,9', 'and 1=1 union select 1,2,3,4,5,6,7,8,9',
+    'or 1=1 union select 1,2,3,4,5,6,7,8,9,10', 'and 1=1 union select 1,2,3,4,5,6,7,8,9,10',
+    # Extended patterns for better detection (only SQLi-specific)
+    'sqlmap', 'injection',
+    # Obfuscated variants commonly seen
+    'uni0n', 's3lect', 'sl33p', 'dr0p', 'tabl3'
+]
+
+# Regex SQLi (không phân biệt hoa thường) – dùng cho cookie_sqli_patterns
+SQLI_REGEX_PATTERNS = [
+    r"union\s+select", r"uni0n\s+s3lect", r"un1on\s+sel3ct",
+    r"or\s+1\s*=\s*1", r"and\s+1\s*=\s*1", r"'\s*or\s*'", r'"\s*or\s*"',
+    r"sleep\s*\(", r"sl33p\s*\(", r"waitfor\s+delay", r"benchmark\s*\(",
+    r"drop\s+table", r"delete\s+from", r"insert\s+into", r"update\s+set",
+    r"dr0p\s+tabl3", r"d3l3t3\s+fr0m", r"1ns3rt\s+1nt0", r"upd4t3\s+s3t",
+    r"information_schema", r"mysql\.user", r"version\s*\(", r"user\s*\(",
+    r"exec\s*\(", r"execute\s*\(", r"xp_cmdshell", r"sp_executesql",
+    r"load_file\s*\(", r"into\s+outfile", r"into\s+dumpfile",
+    r"'\s*--", r'"\s*--', r"'\s*#", r'"\s*#', r"'\s*/\*", r'"\s*/\*',
+    r"un10n", r"sel3ct", r"fr0m", r"wh3r3", r"0r\s+", r"4nd\s+",
+    r"concat\s*\(", r"substring\s*\(", r"ascii\s*\(", r"char\s*\(",
+    r"extractvalue\s*\(", r"updatexml\s*\(", r"exp\s*\(", r"floor\s*\(",
+    r"@@version", r"@@hostname", r"current_user", r"current_database",
+    r"group_concat\s*\(", r"limit\s+\d+", r"order\s+by", r"having\s+",
+    r"and\s+length\s*\(", r"and\s+ascii\s*\(", r"and\s+substring\s*\(",
+    r"or\s+length\s*\(", r"or\s+ascii\s*\(", r"or\s+substring\s*\(",
+    r"mysql_fetch_array", r"mysql_num_rows", r"pg_exec\s*\(",
+    r"mssql_query\s*\(", r"oci_execute\s*\("
+]
+
+# Từ khóa SQL dùng cho feature sql_keywords / cookie_sql_keywords
+SQL_KEYWORDS = ['select', 'from', 'where', 'union', 'insert', 'update', 'delete', 'drop', 'create', 'alter']
+COOKIE_SQL_KEYWORDS = ['select', 'insert', 'update', 'delete', 'drop', 'create', 'alter', 'exec', 'execute']
+
 
 def is_safe_text(text: str) -> bool:
     try:
@@ -47,6 +144,58 @@ def url_decode_safe(s: str) -> str:
     except Exception:
         return s
 
+# Trường text được url-decode rồi ghép lại để khớp RULE_SQLI_KEYWORDS
+RULE_TEXT_FIELDS = ('uri', 'query_string', 'payload', 'user_agent', 'cookie', 'body', 'referer')
+
+
+def rule_text(log_entry) -> str:
+    """Text (đã url-decode, lowercase) của mọi trường request dùng cho rule-based detection"""
+    return " ".join([url_decode_safe(log_entry.get(field, '')) for field in RULE_TEXT_FIELDS]).lower()
+
+
+# Fallback rule-only không có model/risk score đi kèm: chỉ keyword độ tin cậy cao trên các trường
+# của request. Keyword ngắn/chung ('like', '#', '--', 'offset'...) khớp cả traffic bình thường
+# (UA "KHTML, like Gecko", anchor, ngày tháng) và UA/referer không do request này điều khiển.
+RULE_FALLBACK_FIELDS = ('uri', 'query_string', 'payload', 'cookie', 'body')
+_RULE_LOW_CONFIDENCE = frozenset((
+    '--', '#', '/*', '*/', '0x', 'char(', 'ascii(', 'version(', 'user(',
+    'order by', 'group by', 'having', 'offset', 'regexp', 'like', 'injection',
+))
+RULE_FALLBACK_KEYWORDS = tuple(k for k in RULE_SQLI_KEYWORDS if k not in _RULE_LOW_CONFIDENCE)
+
+
+def rule_based_predict(log_entry):
+    """Verdict chỉ dùng rule (không feature extraction/model), cùng dạng với predict_single.
+
+    Dùng làm fallback khi model lỗi/chậm: chi phí tuyến tính theo độ dài dòng. Chỉ khớp
+    RULE_FALLBACK_KEYWORDS trên RULE_FALLBACK_FIELDS.
+    """
+    text_content = " ".join([url_decode_safe(log_entry.get(field, '') or '')
+                             for field in RULE_FALLBACK_FIELDS]).lower()
+    patterns = [keyword for keyword in RULE_FALLBACK_KEYWORDS if keyword in text_content]
+    if patterns:
+        return Verdict(True, 1.0, patterns, "High")
+    return Verdict(False, 0.0, [], "Low")
+
+_feature_extractor = None
+
+
+def extract_features_chunk(logs):
+    """Trích xuất features cho một chunk (chạy trong process pool; không cần model đã train).
+
+    Dòng lỗi trả về None để predict_batch đánh dấu "Error".
+    """
+    global _feature_extractor
+    if _feature_extractor is None:
+        _feature_extractor = OptimizedSQLIDetector()
+    results = []
+    for log in logs:
+        try:
+            results.append(_feature_extractor.extract_optimized_features(log))
+        except Exception:
+            results.append(None)
+    return results
+
 def base64_decode_safe(s: str) -> str:
     """
     Safely decode base64 string with comprehensive error handling
@@ -185,6 +334,121 @@ def compute_shannon_entropy(s: str) -> float:
     return entropy
 
 
+# Prefilter: ký tự "vô hại" trên field thô. Không có ' " ; # * ( ) $ % < > \ nên
+# không thể tạo nosql/json/overlong-utf8, url-decode không đổi nội dung (chỉ '+' → ' ')
+# và text sau khi decode luôn khớp SAFE_TEXT_REGEX.
+PREFILTER_SAFE_BYTES_REGEX = re.compile(r"[A-Za-z0-9_\-\./\?&:+= ]*")
+PREFILTER_MODES = ('strict', 'request', 'off')
+DEFAULT_PREFILTER_MODE = 'request'
+# request (mặc định): allowlist + keyword trên các trường của request; UA/referer (UA trình duyệt
+#   luôn có '(' và ';') chỉ được quét keyword độ tin cậy cao → có thể đổi verdict khi AI chỉ bắt
+#   UA/referer
+# strict: allowlist trên mọi field mà predict_single đọc → verdict giống hệt model, nhưng gần như
+#   không dòng nào từ trình duyệt thật được bypass
+PREFILTER_FIELDS = {
+    'strict': ('uri', 'query_string', 'payload', 'user_agent', 'cookie', 'body', 'referer'),
+    'request': ('uri', 'query_string', 'cookie', 'payload', 'body'),
+}
+PREFILTER_HEADER_FIELDS = {'request': ('user_agent', 'referer')}
+# '=' là ký tự duy nhất còn lại đóng góp vào sqli_risk_score (special_chars đếm uri/query/payload
+# 3 lần do double/triple decode, cookie_special_chars x2). Entropy tối đa 14.4 điểm, nên giữ
+# phần '=' ≤ 30 đảm bảo risk_score < 50.
+PREFILTER_EQ_WEIGHTS = {'uri': 3, 'query_string': 3, 'payload': 3, 'body': 1, 'referer': 1, 'cookie': 2}
+PREFILTER_EQ_BUDGET = 30
+# Pattern cần một ký tự bắt buộc nằm ngoài allowlist thì không bao giờ khớp → bỏ khỏi prefilter
+_PREFILTER_UNREACHABLE_RE = re.compile(r"\\[()*]|['\";#@<>%]")
+_PREFILTER_SAFE_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789_-./?&:= ")
+
+
+def _base64_candidate(value: str) -> str:
+    """Phần mà extract_optimized_features thử decode base64 (sau '=' đầu tiên, trước '&')"""
+    if '=' not in value:
+        return value
+    part = value.split('=', 1)[1].split('&')[0]
+    return part.rstrip('%23').rstrip('%2B').rstrip('%2F').rstrip('%3D')
+
+
+class BenignPrefilter:
+    """Fast-track các dòng chắc chắn sạch mà không chạy feature extraction + Isolation Forest.
+
+    Một dòng được bypass khi (1) mọi field chỉ gồm ký tự an toàn – một lần fullmatch ở C,
+    (2) không chứa bất kỳ từ khóa/regex SQLi nào mà detector dùng – một lần search ở C,
+    (3) số '=' nằm trong ngân sách và query/payload không giải mã base64 được. Với mode
+    'strict' (mặc định) các điều kiện này kéo theo safe_text=True, has_sqli_pattern=False và
+    risk_score < 50 trong predict_single, nên verdict không đổi. Mode 'request' (mặc định) áp dụng
+    (1)-(3) cho các trường của request và chỉ yêu cầu UA/referer không chứa RULE_FALLBACK_KEYWORDS.
+
+    Kết quả được bypass không có điểm model: caller trả score None kèm prefiltered=True.
+    """
+
+    def __init__(self, mode=DEFAULT_PREFILTER_MODE):
+        if mode not in PREFILTER_MODES:
+            raise ValueError(f"prefilter mode must be one of {PREFILTER_MODES}, got {mode!r}")
+        self.mode = mode
+        self.fields = PREFILTER_FIELDS.get(mode, ())
+        self.header_fields = PREFILTER_HEADER_FIELDS.get(mode, ())
+        keywords = set(RULE_SQLI_KEYWORDS) | set(FEATURE_SQLI_PATTERNS) | set(SQL_KEYWORDS) | set(COOKIE_SQL_KEYWORDS)
+        # Substring test (C) cho keyword thuần, một regex cho phần còn lại; chỉ giữ những gì
+        # có thể xuất hiện trong text đã qua allowlist (nhanh hơn ~10x so với một regex chung)
+        self._keywords = tuple(sorted(k for k in keywords if set(k) <= _PREFILTER_SAFE_CHARS))
+        reachable = [r for r in SQLI_REGEX_PATTERNS if not _PREFILTER_UNREACHABLE_RE.search(r)]
+        self._keyword_re = re.compile('|'.join(reachable))
+        self._safe_match = PREFILTER_SAFE_BYTES_REGEX.fullmatch
+        # Gọi từ nhiều request thread / detection worker
+        self._lock = threading.Lock()
+        self.stats = {'checked': 0, 'bypassed': 0}
+
+    def is_benign(self, log_entry) -> bool:
+        """True nếu dòng chắc chắn sạch và có thể bỏ qua model"""
+        if self.mode == 'off':
+            return False
+        benign = self._check(log_entry)
+        with self._lock:
+            self.stats['checked'] += 1
+            self.stats['bypassed'] += benign
+        return benign
+
+    def _check(self, log_entry) -> bool:
+        try:
+            get = log_entry.get
+            values = [get(field, '') or '' for field in self.fields]
+            text = ' '.join(values)
+            if self._safe_match(text) is None:
+                return False
+            # predict_single url-decode trước khi so khớp: với bộ ký tự này chỉ '+' → ' '
+            lowered = text.replace('+', ' ').lower()
+            if any(keyword in lowered for keyword in self._keywords):
+                return False
+            if self._keyword_re.search(lowered) is not None:
+                return False
+            if '=' in text:
+                eq_score = sum(PREFILTER_EQ_WEIGHTS.get(field, 0) * value.count('=')
+                               for field, value in zip(self.fields, values))
+                if eq_score > PREFILTER_EQ_BUDGET:
+                    return False
+            # Query/payload giải mã base64 được sẽ đưa nội dung decode vào feature → để model xử lý
+            for field in ('query_string', 'payload'):
+                value = get(field, '') or ''
+                if len(value) > 4:
+                    candidate = _base64_candidate(value)
+                    if len(candidate) > 4 and base64_decode_safe(candidate) != candidate:
+                        return False
+            if self.header_fields:
+                headers = ' '.join([url_decode_safe(get(field, '') or '') for field in self.header_fields]).lower()
+                if any(keyword in headers for keyword in RULE_FALLBACK_KEYWORDS):
+                    return False
+        except Exception:
+            return False
+        return True
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['mode'] = self.mode
+        stats['bypass_rate'] = stats['bypassed'] / stats['checked'] if stats['checked'] else 0.0
+        return stats
+
+
 class OptimizedSQLIDetector:
     """Bao gói toàn bộ pipeline: features → scale → IsolationForest.
 
@@ -215,26 +479,7 @@ class OptimizedSQLIDetector:
         
         # Pre-compiled patterns for faster detection
         self.sqli_patterns = [
-            re.compile(pattern, re.IGNORECASE) for pattern in [
-                r"union\s+select", r"uni0n\s+s3lect", r"un1on\s+sel3ct",
-                r"or\s+1\s*=\s*1", r"and\s+1\s*=\s*1", r"'\s*or\s*'", r'"\s*or\s*"',
-                r"sleep\s*\(", r"sl33p\s*\(", r"waitfor\s+delay", r"benchmark\s*\(",
-                r"drop\s+table", r"delete\s+from", r"insert\s+into", r"update\s+set",
-                r"dr0p\s+tabl3", r"d3l3t3\s+fr0m", r"1ns3rt\s+1nt0", r"upd4t3\s+s3t",
-                r"information_schema", r"mysql\.user", r"version\s*\(", r"user\s*\(",
-                r"exec\s*\(", r"execute\s*\(", r"xp_cmdshell", r"sp_executesql",
-                r"load_file\s*\(", r"into\s+outfile", r"into\s+dumpfile",
-                r"'\s*--", r'"\s*--', r"'\s*#", r'"\s*#', r"'\s*/\*", r'"\s*/\*',
-                r"un10n", r"sel3ct", r"fr0m", r"wh3r3", r"0r\s+", r"4nd\s+",
-                r"concat\s*\(", r"substring\s*\(", r"ascii\s*\(", r"char\s*\(",
-                r"extractvalue\s*\(", r"updatexml\s*\(", r"exp\s*\(", r"floor\s*\(",
-                r"@@version", r"@@hostname", r"current_user", r"current_database",
-                r"group_concat\s*\(", r"limit\s+\d+", r"order\s+by", r"having\s+",
-                r"and\s+length\s*\(", r"and\s+ascii\s*\(", r"and\s+substring\s*\(",
-                r"or\s+length\s*\(", r"or\s+ascii\s*\(", r"or\s+substring\s*\(",
-                r"mysql_fetch_array", r"mysql_num_rows", r"pg_exec\s*\(",
-                r"mssql_query\s*\(", r"oci_execute\s*\("
-            ]
+            re.compile(pattern, re.IGNORECASE) for pattern in SQLI_REGEX_PATTERNS
         ]
         
     def extract_optimized_features(self, log_entry):
@@ -338,20 +583,7 @@ class OptimizedSQLIDetector:
         text_content = f"{decoded_uri} {decoded_qs} {decoded_payload} {decoded_body} {decoded_referer} {base64_decoded_content} {double_decoded_uri} {double_decoded_qs} {double_decoded_payload} {triple_decoded_uri} {triple_decoded_qs} {triple_decoded_payload}".lower()
         
         # SQLi patterns với scoring nâng cao
-        sqli_patterns = [
-            'union', 'select', 'drop', 'insert', 'update', 'delete',
-            'or 1=1', "or '1'='1", 'and 1=1', "and '1'='1",
-            'sleep(', 'waitfor', 'benchmark', 'information_schema',
-            'mysql.', 'pg_sleep', 'dbms_pipe', 'sys.',
-            'cast(', 'concat(', 'char(', 'ascii(',
-            'substring(', 'mid(', 'substr(',
-            '--', '/*', '*/', '; drop', '; delete',
-            'xor ', 'exec', 'execute', 'version()', 'user()', 'database()',
-            # Additional patterns for better detection
-            'or 1=1--', "or '1'='1--", 'and 1=1--', "and '1'='1--",
-            'or 1=1#', "or '1'='1#", 'and 1=1#', "and '1'='1#",
-            'or 1=1/*', "or '1'='1/*", 'and 1=1/*', "and '1'='1/*"
-        ]
+        sqli_patterns = FEATURE_SQLI_PATTERNS
         
         # Tính điểm SQLi với trọng số
         sqli_score = 0
@@ -386,7 +618,7 @@ class OptimizedSQLIDetector:
         features['body_entropy'] = compute_shannon_entropy(decoded_body)
         
         # SQL keywords analysis
-        sql_keywords = ['select', 'from', 'where', 'union', 'insert', 'update', 'delete', 'drop', 'create', 'alter']
+        sql_keywords = SQL_KEYWORDS
         features['sql_keywords'] = sum(1 for keyword in sql_keywords if keyword in text_content)
         
         # User agent analysis
@@ -469,7 +701,7 @@ class OptimizedSQLIDetector:
                 features['cookie_special_chars'] += cookie.count(char)
             
             # Count SQL keywords in cookie
-            sql_keywords = ['select', 'insert', 'update', 'delete', 'drop', 'create', 'alter', 'exec', 'execute']
+            sql_keywords = COOKIE_SQL_KEYWORDS
             for keyword in sql_keywords:
                 if keyword in cookie.lower():
                     features['cookie_sql_keywords'] += 1
@@ -721,133 +953,36 @@ class OptimizedSQLIDetector:
                     continue
         self.train(clean_logs)
     
-    def predict_single(self, log_entry, threshold=None):
-        """Predict single log entry với threshold tối ưu"""
-        if not self.is_trained:
-            raise ValueError("Model chưa được train!")
-        
-        # Use model threshold if not specified
-        if threshold is None:
-            threshold = self.sqli_score_threshold
-        
-        # Extract features
-        features = self.extract_optimized_features(log_entry)
-        
-        # Use AI Isolation Forest for detection (primary method)
-        # Rule-based is only used as fallback
-        
-        # Create DataFrame
-        df = pd.DataFrame([features])
-        
-        # Encode categorical features (pre-normalize to avoid unseen-label exceptions)
-        categorical_features = ['method']
-        for feature in categorical_features:
-            if feature in df.columns:
-                raw_val = str(df[feature].iloc[0])
-                # Normalize common placeholders
-                if feature == 'method':
-                    norm_val = 'POST' if raw_val.upper() == 'POST' else 'GET'
-                    df.loc[:, feature] = norm_val
-                else:
-                    norm_val = raw_val
-
-                if feature in self.label_encoders:
-                    le = self.label_encoders[feature]
-                    classes = set(getattr(le, 'classes_', []))
-                    if norm_val in classes:
-                        df[f'{feature}_encoded'] = le.transform(df[feature].astype(str))
-                    else:
-                        # Fallback without logging noise
-                        if feature == 'method':
-                            df[f'{feature}_encoded'] = 1 if norm_val == 'POST' else 0
-                        else:
-                            df[f'{feature}_encoded'] = 0
-                else:
-                    # Fallback encoding if no label encoder
-                    if feature == 'method':
-                        df[f'{feature}_encoded'] = 1 if norm_val == 'POST' else 0
-                    else:
-                        df[f'{feature}_encoded'] = 0
-        
-        # Select features
+    def _method_encoding(self, raw_val):
+        """Mã hoá cột method giống lúc train (giá trị lạ → 1 cho POST, 0 cho GET)"""
+        # Normalize common placeholders
+        norm_val = 'POST' if str(raw_val).upper() == 'POST' else 'GET'
+        le = self.label_encoders.get('method')
+        if le is not None and norm_val in set(getattr(le, 'classes_', [])):
+            return int(le.transform([norm_val])[0])
+        # Fallback without logging noise
+        return 1 if norm_val == 'POST' else 0
+
+    def _feature_matrix(self, features_list):
+        """DataFrame features → ma trận đã scale (một lần cho cả lô)"""
+        df = pd.DataFrame(features_list)
+        if 'method' in df.columns:
+            encoding = {value: self._method_encoding(value) for value in df['method'].astype(str).unique()}
+            df['method_encoded'] = df['method'].astype(str).map(encoding)
         X = df[self.feature_names].fillna(0)
-        
-        # Scale features
-        X_scaled = self.scaler.transform(X)
-        
-        # Get anomaly score using decision_function
-        # Isolation Forest: negative scores = anomalies, positive scores = normal
-        score = self.isolation_forest.decision_function(X_scaled)[0]
-        
-        # Use raw decision_function score for threshold comparison
-        # decision_function returns negative values for anomalies
-        anomaly_score = score
-        
+        return self.scaler.transform(X)
+
+    def _verdict(self, log_entry, features, anomaly_score):
+        """Kết hợp rule-based, risk score và điểm IsolationForest thành verdict cuối"""
         # For SQLi detection, ưu tiên rule-based và risk score trước, rồi đến AI-only
         # Check for SQLi patterns in all text fields (đã url-decode để lộ pattern)
-        raw_uri = log_entry.get('uri', '')
         raw_qs = log_entry.get('query_string', '')
-        raw_payload = log_entry.get('payload', '')
-        raw_user_agent = log_entry.get('user_agent', '')
-        raw_cookie = log_entry.get('cookie', '')
-        raw_body = log_entry.get('body', '')
-        raw_referer = log_entry.get('referer', '')
-
-        decoded_concat = " ".join([
-            url_decode_safe(raw_uri),
-            url_decode_safe(raw_qs),
-            url_decode_safe(raw_payload),
-            url_decode_safe(raw_user_agent),
-            url_decode_safe(raw_cookie),
-            url_decode_safe(raw_body),
-            url_decode_safe(raw_referer)
-        ])
-        text_content = decoded_concat.lower()
+        text_content = rule_text(log_entry)
         
         # Rule-based SQLi detection (100% detection for known patterns)
-        has_sqli_pattern = False
-        
         # Simple string matching for common SQLi patterns (optimized for accuracy)
-        sqli_keywords = [
-            'union select', 'or 1=1', 'and 1=1', "' or '", '" or "',
-            'sleep(', 'waitfor delay', 'benchmark(', 'drop table',
-            'delete from', 'insert into', 'update set', 'information_schema',
-            'mysql.user', 'version(', 'user(', 'exec(', 'execute(',
-            'xp_cmdshell', 'sp_executesql', 'load_file(', 'into outfile',
-            '--', '#', '/*', '*/', '0x', 'char(', 'ascii(',
-            'order by', 'group by', 'having', 'offset', 'regexp', 'like',
-            # Additional SQLi patterns (only high-confidence ones)
-            'or 1=1--', 'and 1=1--', 'or 1=1#', 'and 1=1#',
-            'union all select', 'union select *', 'union select 1',
-            'or 1=1 union', 'and 1=1 union', 'or 1=1 select',
-            'and 1=1 select', 'or 1=1 from', 'and 1=1 from',
-            'or 1=1 where', 'and 1=1 where', 'or 1=1 order',
-            'and 1=1 order', 'or 1=1 group', 'and 1=1 group',
-            'or 1=1 having', 'and 1=1 having', 'or 1=1 limit',
-            'and 1=1 limit', 'or 1=1 offset', 'and 1=1 offset',
-            'or 1=1 union select', 'and 1=1 union select',
-            'or 1=1 union all select', 'and 1=1 union all select',
-            'or 1=1 union select *', 'and 1=1 union select *',
-            'or 1=1 union select 1', 'and 1=1 union select 1',
-            'or 1=1 union select 1,2', 'and 1=1 union select 1,2',
-            'or 1=1 union select 1,2,3', 'and 1=1 union select 1,2,3',
-            'or 1=1 union select 1,2,3,4', 'and 1=1 union select 1,2,3,4',
-            'or 1=1 union select 1,2,3,4,5', 'and 1=1 union select 1,2,3,4,5',
-            'or 1=1 union select 1,2,3,4,5,6', 'and 1=1 union select 1,2,3,4,5,6',
-            'or 1=1 union select 1,2,3,4,5,6,7', 'and 1=1 union select 1,2,3,4,5,6,7',
-            'or 1=1 union select 1,2,3,4,5,6,7,8', 'and 1=1 union select 1,2,3,4,5,6,7,8',
-            'or 1=1 union select 1,2,3,4,5,6,7,8,9', 'and 1=1 union select 1,2,3,4,5,6,7,8,9',
-            'or 1=1 union select 1,2,3,4,5,6,7,8,9,10', 'and 1=1 union select 1,2,3,4,5,6,7,8,9,10',
-            # Extended patterns for better detection (only SQLi-specific)
-            'sqlmap', 'injection',
-            # Obfuscated variants commonly seen
-            'uni0n', 's3lect', 'sl33p', 'dr0p', 'tabl3'
-        ]
-        
-        for keyword in sqli_keywords:
-            if keyword in text_content:
-                has_sqli_pattern = True
-                break
+        patterns = [keyword for keyword in RULE_SQLI_KEYWORDS if keyword in text_content]
+        has_sqli_pattern = bool(patterns)
         
         # Ngưỡng risk score giúp nâng độ nhạy với payload không khớp pattern tường minh
         risk_score = features.get('sqli_risk_score', 0)
@@ -856,7 +991,6 @@ class OptimizedSQLIDetector:
 
         # Allowlist: nếu chuỗi chỉ có ký tự an toàn thông dụng và KHÔNG có pattern → coi là sạch
         # Cho phép: chữ/số, _, -, ., /, ?, =, &, :, %, khoảng trắng
-        safe_text = False
         safe_text = is_safe_text(text_content)
 
         # Nếu query đơn giản kiểu id=number (và không có pattern mạnh) → coi là sạch
@@ -871,18 +1005,9 @@ class OptimizedSQLIDetector:
                 is_anomaly = False
             else:
                 # Dùng AI-only với ngưỡng cân bằng để giảm FP nhưng vẫn detect được threats
-                # Use model threshold for decision_function (negative values = anomalies)
                 # For decision_function: negative scores = anomalies, positive scores = normal
                 is_anomaly = anomaly_score < 0  # Only detect if score is negative (anomaly)
         
-        # Determine patterns found
-        patterns = []
-        if has_sqli_pattern:
-            # Find which patterns were matched
-            for keyword in sqli_keywords:
-                if keyword in text_content:
-                    patterns.append(keyword)
-        
         # Determine confidence level
         if has_sqli_pattern:
             confidence = "High"
@@ -892,20 +1017,54 @@ class OptimizedSQLIDetector:
             confidence = "Low"
         
         # Return results with normalized score (0-1, higher = more anomalous)
-        normalized_score = 1 / (1 + np.exp(anomaly_score))  # Sigmoid transformation for display
-        return is_anomaly, normalized_score, patterns, confidence
+        # Sigmoid on a Python float: the verdict carries no numpy scalars (JSON-native)
+        anomaly_score = float(anomaly_score)
+        normalized_score = 1 / (1 + math.exp(anomaly_score)) if anomaly_score < 700 else 0.0
+        return Verdict(bool(is_anomaly), normalized_score, patterns, confidence)
 
-    def predict_batch(self, logs, threshold=0.49):
-        """Dự đoán theo lô để tăng tốc khi kiểm nhiều bản ghi trên API."""
-        results = []
-        for log in logs:
+    def predict_single(self, log_entry, threshold=None):
+        """Predict single log entry với threshold tối ưu"""
+        if not self.is_trained:
+            raise ValueError("Model chưa được train!")
+        
+        # Extract features
+        features = self.extract_optimized_features(log_entry)
+        
+        # Use AI Isolation Forest for detection (primary method)
+        # Isolation Forest: negative scores = anomalies, positive scores = normal
+        anomaly_score = self.isolation_forest.decision_function(self._feature_matrix([features]))[0]
+        return self._verdict(log_entry, features, anomaly_score)
+
+    def predict_batch(self, logs, threshold=0.49, features_list=None):
+        """Dự đoán theo lô: một lần scale + decision_function cho cả lô (vectorized).
+
+        features_list: features đã trích xuất sẵn (ví dụ từ process pool), None = tự trích xuất.
+        Dòng lỗi trả về Verdict(False, 0.0, [], "Error") thay vì làm hỏng cả lô.
+        """
+        if not self.is_trained:
+            raise ValueError("Model chưa được train!")
+        results = [None] * len(logs)
+        valid = []
+        for i, log in enumerate(logs):
+            try:
+                features = features_list[i] if features_list is not None else self.extract_optimized_features(log)
+            except Exception as e:
+                logger.warning(f"predict_batch error: {e}")
+                features = None
+            if features is None:
+                results[i] = Verdict(False, 0.0, [], "Error")
+            else:
+                valid.append((i, features))
+        if not valid:
+            return results
+        
+        scores = self.isolation_forest.decision_function(self._feature_matrix([f for _, f in valid]))
+        for (i, features), anomaly_score in zip(valid, scores):
             try:
-                res = self.predict_single(log, threshold=threshold)
+                results[i] = self._verdict(logs[i], features, anomaly_score)
             except Exception as e:
                 logger.warning(f"predict_batch error: {e}")
-                # maintain tuple structure: (is_anomaly, score, patterns, confidence)
-                res = (False, 0.0, [], "Error")
-            results.append(res)
+                results[i] = Verdict(False, 0.0, [], "Error")
         return results
     
     def save_model(self, model_path):
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Prefork Server – chạy web app ở chế độ production nhiều process (không cần gunicorn)
+
+- Master load model một lần rồi fork N worker: model được chia sẻ copy-on-write
+- Các worker cùng accept trên một listening socket do master bind (werkzeug threaded server)
+- Worker chết bất thường được fork lại; SIGHUP: master nạp lại model rồi thay worker cuốn chiếu
+  (worker mới sẵn sàng trước, worker cũ ngừng accept và xử lý nốt request đang chạy)
+- SIGTERM/SIGINT: dừng mọi worker có deadline (SQLI_SHUTDOWN_TIMEOUT), quá hạn thì SIGKILL
+- Thống kê / recent events được gộp giữa các worker qua WorkerCluster (file trên /dev/shm)
+"""
+
+import logging
+import os
+import shutil
+import signal
+import socket
+import threading
+import time
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+import app as web
+from async_logging import stop_async_logging
+from worker_cluster import WorkerCluster, default_state_dir
+
+logger = logging.getLogger(__name__)
+
+
+class InFlightCounter:
+    """WSGI middleware đếm request đang xử lý (kể cả response đang stream)"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def _done(self):
+        with self._lock:
+            self.active -= 1
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.active += 1
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return ClosingIterator(iterable, [self._done])
+
+
+class PreforkServer:
+    """Master process.
+
+    Tham số:
+    - workers: số worker process
+    - state_dir: thư mục trạng thái dùng chung (mặc định /dev/shm/sqli-web-<pid master>)
+    - graceful_timeout: giây cho một worker xử lý nốt request khi dừng / reload
+    - ready_timeout: giây chờ worker mới sẵn sàng trước khi dừng worker cũ khi reload
+    """
+
+    def __init__(self, host='0.0.0.0', port=5000, workers=None, state_dir=None,
+                 graceful_timeout=None, ready_timeout=30.0):
+        self.host = host
+        self.port = port
+        self.num_workers = max(1, workers or os.cpu_count() or 1)
+        self.state_dir = state_dir or default_state_dir()
+        self.graceful_timeout = web.shutdown_timeout if graceful_timeout is None else graceful_timeout
+        self.ready_timeout = ready_timeout
+
+        self.sock = None
+        self.generation = 0
+        # pid → (generation, spawn time)
+        self.workers = {}
+        self._stopping = False
+        self._reload_requested = False
+        self._respawn_after = 0.0
+        self.stats = {'spawned': 0, 'crashed': 0, 'reloads': 0}
+
+    # Master
+    def run(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        # Loaded before fork so every worker shares the same pages
+        web.load_model_cached()
+        self.sock = socket.create_server((self.host, self.port), backlog=1024)
+        self.sock.set_inheritable(True)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        logger.info(f"🚀 Prefork server on http://{self.host}:{self.port} "
+                    f"({self.num_workers} workers, master pid {os.getpid()})")
+        try:
+            while not self._stopping:
+                self._reap()
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self._rolling_reload()
+                self._spawn_missing()
+                time.sleep(0.2)
+        finally:
+            self._stop_workers()
+            self.sock.close()
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+            logger.info(f"👋 Prefork server stopped: {self.stats['spawned']} workers spawned, "
+                        f"{self.stats['crashed']} crashed, {self.stats['reloads']} reloads")
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _spawn_missing(self):
+        current = sum(1 for generation, _ in self.workers.values() if generation == self.generation)
+        if current < self.num_workers and time.monotonic() < self._respawn_after:
+            return
+        for _ in range(self.num_workers - current):
+            self._spawn()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker()
+        self.workers[pid] = (self.generation, time.monotonic())
+        self.stats['spawned'] += 1
+        return pid
+
+    def _reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation, spawned_at = self.workers.pop(pid, (None, 0.0))
+            WorkerCluster.retire(self.state_dir, pid)
+            if generation == self.generation and not self._stopping:
+                self.stats['crashed'] += 1
+                logger.warning(f"⚠️ Worker {pid} exited unexpectedly (status {status}), respawning")
+                if time.monotonic() - spawned_at < 1.0:
+                    # Crashing at startup: do not fork in a tight loop
+                    self._respawn_after = time.monotonic() + 1.0
+
+    def _rolling_reload(self):
+        """Nạp lại model trong master, fork thế hệ worker mới rồi dừng thế hệ cũ"""
+        try:
+            model = web.reload_model()
+        except Exception as e:
+            logger.error(f"❌ Model reload failed, keeping current workers: {e}")
+            return
+        self.generation += 1
+        self.stats['reloads'] += 1
+        old = [pid for pid, (generation, _) in self.workers.items() if generation < self.generation]
+        new = [self._spawn() for _ in range(self.num_workers)]
+        logger.info(f"🔄 Reloaded model {getattr(model, 'version', '')}, "
+                    f"replacing {len(old)} workers with {len(new)}")
+        # A worker is ready once it published its first snapshot
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline and not self._stopping:
+            if all(os.path.exists(os.path.join(self.state_dir, f"worker-{pid}.json")) for pid in new):
+                break
+            time.sleep(0.05)
+        for pid in old:
+            self._signal(pid, signal.SIGTERM)
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _stop_workers(self):
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self.workers):
+            logger.warning(f"⏱️ Worker {pid} did not stop in time, killing")
+            self._signal(pid, signal.SIGKILL)
+        while self.workers:
+            self._reap()
+            time.sleep(0.05)
+
+    # Worker
+    def _run_worker(self):
+        """Chạy trong process con; không bao giờ return"""
+        code = 0
+        try:
+            # Ctrl+C reaches the whole process group: only the master reacts to it
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            stopping = threading.Event()
+            signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+            counter = InFlightCounter(web.app)
+            server = make_server(self.host, self.port, counter, threaded=True, fd=self.sock.fileno())
+            # Workers race for each connection: a lost accept() must time out, not block
+            server.socket.settimeout(0.5)
+            server.timeout = 0.5
+            web.enable_cluster_mode(self.state_dir, workers=self.num_workers)
+            logger.info(f"👷 Worker {os.getpid()} serving (generation {self.generation})")
+
+            while not stopping.is_set():
+                server.handle_request()
+
+            # Stop accepting, end dashboard streams (clients reconnect to another worker),
+            # let in-flight requests finish, then drain the app
+            web.event_broadcaster.close()
+            deadline = time.monotonic() + self.graceful_timeout
+            while counter.active > 0 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if counter.active:
+                logger.warning(f"⏱️ Worker {os.getpid()}: {counter.active} requests still running at deadline")
+            web.shutdown_handler(max(0.0, deadline - time.monotonic()))
+            server.server_close()
+        except Exception as e:
+            logger.error(f"❌ Worker {os.getpid()} failed: {e}")
+            stop_async_logging()
+            code = 1
+        finally:
+            os._exit(code)
+
+
+def main():
+    workers = os.environ.get('SQLI_WEB_WORKERS')
+    server = PreforkServer(
+        host=os.environ.get('SQLI_WEB_HOST', '0.0.0.0'),
+        port=int(os.environ.get('SQLI_WEB_PORT', '5000')),
+        workers=int(workers) if workers else None,
+        state_dir=os.environ.get('SQLI_STATE_DIR')
+    )
+    try:
+        server.run()
+    except Exception as e:
+        logger.error(f"❌ Failed to start prefork server: {e}")
+    finally:
+        stop_async_logging()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,28 +5,30 @@ Thu thập và phân tích log realtime từ Apache access logs
 """
 
 import json
+import os
 import subprocess
 import time
 import logging
 import requests
 import threading
 from datetime import datetime
-from optimized_sqli_detector import OptimizedSQLIDetector
-import queue
+from optimized_sqli_detector import OptimizedSQLIDetector, BenignPrefilter, DEFAULT_PREFILTER_MODE, rule_based_predict
+from threat_log_writer import ThreatLogWriter
+from log_line_parser import create_log_parser, fix_json_line, extract_fields_manually
+from log_file_follower import MultiFileFollower, DEFAULT_DIR_PATTERN
+from load_shedder import LoadShedder, is_suspicious
+from client_aggregator import ClientActivityAggregator
+from alert_suppressor import AlertSuppressor
+from async_logging import setup_async_logging, DroppingQueueHandler
+from log_ingest_server import LogIngestServer
+from collector_metrics import CollectorMetrics, Histogram, MetricsServer
+from detection_guard import CircuitBreaker, DetectionGuard
 import signal
 import sys
 import numpy as np
-import re
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('realtime_sqli_detection.log'),
-        logging.StreamHandler()
-    ]
-)
+# Setup logging: records are queued and written by a background listener thread
+setup_async_logging('realtime_sqli_detection.log', json_lines=os.environ.get('SQLI_LOG_JSON') == '1')
 logger = logging.getLogger(__name__)
 
 class RealtimeLogCollector:
@@ -34,15 +36,62 @@ class RealtimeLogCollector:
     
     def __init__(self, log_path="/var/log/apache2/access_full_json.log", 
                  webhook_url="http://localhost:5000/api/realtime-detect",
-                 detection_threshold=None):
+                 detection_threshold=None, ingest_token=None,
+                 threat_log_path='threat_logs.jsonl', threat_log_options=None,
+                 threat_log_raw_features=False, log_format='json',
+                 workers=2, dir_pattern=DEFAULT_DIR_PATTERN, discovery_interval=5.0,
+                 prefilter_mode=DEFAULT_PREFILTER_MODE, load_shedding_options=None, client_activity_options=None,
+                 alert_window=60.0, alert_max_keys=10000, verbose_alerts=False, ingest_options=None,
+                 metrics_address=None, checkpoint_path='collector_offsets.json',
+                 spill_path='collector_pending.jsonl', shutdown_timeout=30.0,
+                 detection_budget=0.25, circuit_breaker_options=None):
+        # log_path: file, glob pattern, directory, or a list of these (one access log per vhost);
+        # None/[] when lines only arrive through the ingest server
         self.log_path = log_path
+        self.log_paths = [log_path] if isinstance(log_path, str) else list(log_path or [])
+        self.dir_pattern = dir_pattern
+        self.discovery_interval = discovery_interval
+        self.worker_count = max(1, workers)
+        self.workers = []
+        self.follower = None
+        # Socket/syslog/stdin front end (see LogIngestServer): unix_path, tcp_address,
+        # udp_address, stdin
+        self.ingest_options = ingest_options
+        self.ingest_server = None
         self.webhook_url = webhook_url
+        # Shared secret so the app records our verdicts instead of re-scoring
+        self.ingest_token = ingest_token
         self.detection_threshold = detection_threshold
         self.detector = None
-        self.log_queue = queue.Queue(maxsize=1000)
+        # Priority queue + overload mode: suspicious lines first, the rest sampled/deferred
+        # when the queue is deep or lagging (options: see LoadShedder)
+        self.shedder = LoadShedder(**(load_shedding_options or {}))
+        
+        # Per-client sliding-window sketches (fixed memory) to flag scanning campaigns
+        self.client_activity = ClientActivityAggregator(**(client_activity_options or {}))
+        
+        # Dedup (ip, uri template, patterns): first event in full, then periodic rollups
+        # (alert_window=0 disables suppression)
+        self.alert_suppressor = AlertSuppressor(window_seconds=alert_window, max_keys=alert_max_keys)
+        
+        # Threats are logged as one structured record; True adds the old line-by-line breakdown
+        self.verbose_alerts = verbose_alerts
         self.running = False
         self.process = None
         
+        # Line parser: 'json' (access_full_json.log), 'combined', 'common'
+        # or any Apache LogFormat string; per-strategy counters in self.parser.stats
+        self.log_format = log_format
+        self.parser = create_log_parser(log_format)
+        
+        # Buffered threat log (batching, fsync policy, rotation + gzip)
+        self.threat_log_raw_features = threat_log_raw_features
+        self.threat_writer = ThreatLogWriter(threat_log_path, **(threat_log_options or {}))
+        
+        # Benign fast-track: 'request' checks the request fields (UA/referer only for high-confidence
+        # keywords), 'strict' never changes a verdict, 'off' sends every line to the model
+        self.prefilter = BenignPrefilter(prefilter_mode)
+        
         # Statistics
         self.stats = {
             'total_logs': 0,
@@ -50,9 +99,39 @@ class RealtimeLogCollector:
             'errors': 0,
             'start_time': datetime.now()
         }
+        self.detection_latency = Histogram()
+        self.webhook_stats = {'success': 0, 'http_error': 0, 'connection_error': 0, 'error': 0}
+        # Detection workers update stats/webhook_stats concurrently: increments go through _count
+        self.stats_lock = threading.Lock()
+        
+        # Prometheus text endpoint ('host:port' or (host, port)); None = disabled
+        self.metrics_address = metrics_address
+        self.metrics = CollectorMetrics(self)
+        self.metrics_server = None
+        
+        # Graceful shutdown: file offsets are checkpointed, entries not drained within
+        # shutdown_timeout are spilled to spill_path and replayed on the next start
+        self.checkpoint_path = checkpoint_path
+        self.spill_path = spill_path
+        self.shutdown_timeout = shutdown_timeout
+        self._stopped = False
         
         # Load AI model
         self._load_ai_model()
+        
+        # Per-line time budget (seconds, None = unbounded) + circuit breaker: slow/failing
+        # model calls fall back to the rule-only verdict (options: see CircuitBreaker)
+        self.detection_guard = DetectionGuard(
+            self.detect_sqli_realtime, self._rule_only_detection,
+            time_budget=detection_budget,
+            breaker=CircuitBreaker(**(circuit_breaker_options or {})),
+            max_threads=self.worker_count * 2
+        )
+    
+    def _count(self, key, counters=None):
+        """Tăng một bộ đếm (self.stats mặc định, hoặc counters) dưới stats_lock"""
+        with self.stats_lock:
+            (self.stats if counters is None else counters)[key] += 1
     
     def _load_ai_model(self):
         """Load AI model"""
@@ -61,7 +140,7 @@ class RealtimeLogCollector:
             self.detector.load_model('models/optimized_sqli_detector.pkl')
             logger.info("✅ AI Model loaded successfully for realtime detection!")
         except Exception as e:
-            logger.error(f"❌ Failed to load AI model: {e}")
+            logger.error(f"❌ Failed to load AI model: {e} – using rule-only detection")
             self.detector = None
     
     def detect_sqli_realtime(self, log_entry):
@@ -69,6 +148,7 @@ class RealtimeLogCollector:
         if not self.detector:
             return None
             
+        start_time = time.time()
         try:
             # Extract features for detailed analysis
             features = self.detector.extract_optimized_features(log_entry)
@@ -121,6 +201,9 @@ class RealtimeLogCollector:
                 'confidence': confidence,
                 'timestamp': datetime.now().isoformat(),
                 'threat_level': 'CRITICAL' if is_anomaly else 'NONE',
+                'processing_time': time.time() - start_time,
+                'model_version': self.detector.version,
+                'detection_mode': 'model',
                 'detailed_analysis': {
                     'detailed_scores': detailed_scores,
                     'risk_assessment': risk_assessment,
@@ -140,9 +223,27 @@ class RealtimeLogCollector:
             
         except Exception as e:
             logger.error(f"Error in SQLi detection: {e}")
-            self.stats['errors'] += 1
+            self._count('errors')
             return None
     
+    def _rule_only_detection(self, log_entry, reason):
+        """Verdict rule-only (không feature extraction/model) khi model quá hạn, lỗi hoặc circuit mở"""
+        start_time = time.time()
+        is_sqli, score, patterns, confidence = rule_based_predict(log_entry)
+        return {
+            'is_sqli': is_sqli,
+            'score': score,
+            'detected_patterns': patterns if patterns else 'N/A',
+            'confidence': confidence,
+            'timestamp': datetime.now().isoformat(),
+            'threat_level': 'CRITICAL' if is_sqli else 'NONE',
+            'processing_time': time.time() - start_time,
+            'model_version': self.detector.version if self.detector else None,
+            'detection_mode': 'rules',
+            'fallback_reason': reason,
+            'detailed_analysis': {}
+        }
+    
     def _calculate_detailed_scores(self, features):
         """Tính toán chi tiết các scores"""
         
@@ -612,82 +713,35 @@ class RealtimeLogCollector:
         """Xử lý một dòng log với detailed analysis"""
         if not log_entry:
             return
+        self._count('total_logs')
+        
+        # Dòng chắc chắn sạch → bỏ qua feature extraction + model
+        if self.prefilter.is_benign(log_entry):
+            logger.debug(f"Prefiltered clean traffic from {log_entry.get('remote_ip', 'Unknown')} - {log_entry.get('uri', 'Unknown')}")
+            return
             
         # Phát hiện SQLi
-        detection_result = self.detect_sqli_realtime(log_entry)
+        start = time.perf_counter()
+        detection_result = self.detection_guard.detect(log_entry)
+        self.detection_latency.observe(time.perf_counter() - start)
         
         # Filter false positives: only detect if score > threshold AND has suspicious content
         if detection_result and detection_result['is_sqli']:
+            self._count('sqli_detected')
             is_real_threat = self._is_real_threat(detection_result, log_entry)
             if is_real_threat:
-                # Get detailed analysis
-                detailed_analysis = detection_result.get('detailed_analysis', {})
-                
-                # Log threat with detailed analysis
-                logger.warning(f"🚨 SQLi DETECTED!")
-                logger.warning(f"   IP: {log_entry.get('remote_ip', 'Unknown')}")
-                logger.warning(f"   URI: {log_entry.get('uri', 'Unknown')}")
-                logger.warning(f"   Query: {log_entry.get('query_string', 'None')}")
-                logger.warning(f"   Payload: {log_entry.get('payload', 'None')}")
-                logger.warning(f"   Score: {detection_result['score']:.3f}")
-                logger.warning(f"   Patterns: {detection_result.get('detected_patterns', 'N/A')}")
-                logger.warning(f"   Confidence: {detection_result['confidence']}")
-                logger.warning(f"   Threat Level: {detection_result['threat_level']}")
-                
-                # Detailed analysis
-                if detailed_analysis:
-                    risk_assessment = detailed_analysis.get('risk_assessment', {})
-                    attack_vectors = detailed_analysis.get('attack_vectors', {})
-                    pattern_analysis = detailed_analysis.get('pattern_analysis', {})
-                    encoding_analysis = detailed_analysis.get('encoding_analysis', {})
-                    database_analysis = detailed_analysis.get('database_analysis', {})
-                    evasion_analysis = detailed_analysis.get('evasion_analysis', {})
-                    time_analysis = detailed_analysis.get('time_analysis', {})
-                    network_analysis = detailed_analysis.get('network_analysis', {})
-                    cookie_analysis = detailed_analysis.get('cookie_analysis', {})
-                    entropy_analysis = detailed_analysis.get('entropy_analysis', {})
-                    final_assessment = detailed_analysis.get('final_assessment', {})
-                    
-                    logger.warning("📊 DETAILED ANALYSIS:")
-                    logger.warning(f"   Risk Level: {risk_assessment.get('risk_level', 'UNKNOWN')}")
-                    logger.warning(f"   Risk Score: {risk_assessment.get('risk_score', 0):.2f}")
-                    logger.warning(f"   Attack Vectors: {attack_vectors.get('attack_vectors', [])}")
-                    logger.warning(f"   Detected Patterns: {pattern_analysis.get('detected_patterns', [])}")
-                    logger.warning(f"   Encoding Types: {encoding_analysis.get('encoding_types', [])}")
-                    logger.warning(f"   Database Types: {database_analysis.get('database_types', [])}")
-                    logger.warning(f"   Evasion Techniques: {evasion_analysis.get('evasion_techniques', [])}")
-                    logger.warning(f"   Time Risk: {time_analysis.get('time_risk', 'UNKNOWN')}")
-                    logger.warning(f"   Network Risk: {network_analysis.get('ip_risk', 'UNKNOWN')}")
-                    logger.warning(f"   Cookie Risk: {cookie_analysis.get('cookie_risk', 'UNKNOWN')}")
-                    logger.warning(f"   Entropy Risk: {entropy_analysis.get('entropy_risk', 'UNKNOWN')}")
-                    logger.warning(f"   Overall Risk: {final_assessment.get('overall_risk', 'UNKNOWN')}")
-                    logger.warning(f"   Recommendation: {final_assessment.get('recommendation', 'UNKNOWN')}")
-                    
-                    # Feature scores
-                    detailed_scores = detailed_analysis.get('detailed_scores', {})
-                    if detailed_scores:
-                        base_scores = detailed_scores.get('base_scores', {})
-                        advanced_scores = detailed_scores.get('advanced_scores', {})
-                        base64_scores = detailed_scores.get('base64_scores', {})
-                        nosql_scores = detailed_scores.get('nosql_scores', {})
-                        cookie_scores = detailed_scores.get('cookie_scores', {})
-                        
-                        logger.warning("🔍 FEATURE SCORES:")
-                        logger.warning(f"   SQLi Patterns: {base_scores.get('sqli_patterns', 0)}")
-                        logger.warning(f"   Special Chars: {base_scores.get('special_chars', 0)}")
-                        logger.warning(f"   SQL Keywords: {base_scores.get('sql_keywords', 0)}")
-                        logger.warning(f"   Union Select: {advanced_scores.get('has_union_select', 0)}")
-                        logger.warning(f"   Information Schema: {advanced_scores.get('has_information_schema', 0)}")
-                        logger.warning(f"   MySQL Functions: {advanced_scores.get('has_mysql_functions', 0)}")
-                        logger.warning(f"   Boolean Blind: {advanced_scores.get('has_boolean_blind', 0)}")
-                        logger.warning(f"   Time Based: {advanced_scores.get('has_time_based', 0)}")
-                        logger.warning(f"   Comment Injection: {advanced_scores.get('has_comment_injection', 0)}")
-                        logger.warning(f"   Base64 Patterns: {base64_scores.get('base64_sqli_patterns', 0)}")
-                        logger.warning(f"   NoSQL Patterns: {nosql_scores.get('has_nosql_patterns', 0)}")
-                        logger.warning(f"   Cookie SQLi: {cookie_scores.get('cookie_sqli_patterns', 0)}")
-                        logger.warning(f"   Total Weighted Score: {detailed_scores.get('total_weighted_score', 0):.2f}")
+                # Repeats of an alert already emitted in this window only count towards its rollup;
+                # false positives never reach the suppressor, so they cannot hide a real threat's key
+                if not self.alert_suppressor.should_emit(log_entry, detection_result):
+                    return
+                # Per-client window context so the app can tie this hit to a campaign
+                detection_result['client_activity'] = self.client_activity.query(
+                    log_entry.get('remote_ip', ''), log_entry.get('user_agent'))
                 
-                logger.warning("-" * 80)
+                # One structured record per threat; the line-by-line breakdown is opt-in
+                logger.warning("🚨 SQLi DETECTED!", extra={'event': self._threat_event(log_entry, detection_result)})
+                if self.verbose_alerts:
+                    self._log_threat_breakdown(log_entry, detection_result)
                 
                 # Gửi đến webhook
                 self.send_to_webhook(log_entry, detection_result)
@@ -698,6 +752,104 @@ class RealtimeLogCollector:
             # Log normal traffic (optional)
             logger.debug(f"Normal traffic from {log_entry.get('remote_ip', 'Unknown')} - {log_entry.get('uri', 'Unknown')}")
     
+    def _threat_event(self, log_entry, detection_result):
+        """Bản ghi JSON gọn cho một threat (thay cho khối nhiều dòng logger.warning)"""
+        detailed_analysis = detection_result.get('detailed_analysis', {})
+        risk_assessment = detailed_analysis.get('risk_assessment', {})
+        final_assessment = detailed_analysis.get('final_assessment', {})
+        client_activity = detection_result.get('client_activity') or {}
+        return {
+            'remote_ip': log_entry.get('remote_ip'),
+            'method': log_entry.get('method'),
+            'uri': log_entry.get('uri'),
+            'query_string': (log_entry.get('query_string') or '')[:500],
+            'payload': (log_entry.get('payload') or '')[:500],
+            'vhost': log_entry.get('vhost'),
+            'source_file': log_entry.get('source_file'),
+            'score': float(detection_result.get('score', 0.0)),
+            'confidence': detection_result.get('confidence'),
+            'threat_level': detection_result.get('threat_level'),
+            'patterns': detection_result.get('detected_patterns', []),
+            'risk_level': risk_assessment.get('risk_level'),
+            'risk_score': risk_assessment.get('risk_score'),
+            'attack_vectors': detailed_analysis.get('attack_vectors', {}).get('attack_vectors', []),
+            'overall_risk': final_assessment.get('overall_risk'),
+            'recommendation': final_assessment.get('recommendation'),
+            'client_scanning': client_activity.get('scanning'),
+            'model_version': detection_result.get('model_version'),
+            'processing_time': detection_result.get('processing_time')
+        }
+    
+    def _log_threat_breakdown(self, log_entry, detection_result):
+        """Chi tiết từng dòng của một threat (verbose_alerts / SQLI_VERBOSE_ALERTS=1)"""
+        # Get detailed analysis
+        detailed_analysis = detection_result.get('detailed_analysis', {})
+        
+        # Log threat with detailed analysis
+        logger.warning(f"   IP: {log_entry.get('remote_ip', 'Unknown')}")
+        logger.warning(f"   URI: {log_entry.get('uri', 'Unknown')}")
+        logger.warning(f"   Query: {log_entry.get('query_string', 'None')}")
+        logger.warning(f"   Payload: {log_entry.get('payload', 'None')}")
+        logger.warning(f"   Score: {detection_result['score']:.3f}")
+        logger.warning(f"   Patterns: {detection_result.get('detected_patterns', 'N/A')}")
+        logger.warning(f"   Confidence: {detection_result['confidence']}")
+        logger.warning(f"   Threat Level: {detection_result['threat_level']}")
+        
+        # Detailed analysis
+        if detailed_analysis:
+            risk_assessment = detailed_analysis.get('risk_assessment', {})
+            attack_vectors = detailed_analysis.get('attack_vectors', {})
+            pattern_analysis = detailed_analysis.get('pattern_analysis', {})
+            encoding_analysis = detailed_analysis.get('encoding_analysis', {})
+            database_analysis = detailed_analysis.get('database_analysis', {})
+            evasion_analysis = detailed_analysis.get('evasion_analysis', {})
+            time_analysis = detailed_analysis.get('time_analysis', {})
+            network_analysis = detailed_analysis.get('network_analysis', {})
+            cookie_analysis = detailed_analysis.get('cookie_analysis', {})
+            entropy_analysis = detailed_analysis.get('entropy_analysis', {})
+            final_assessment = detailed_analysis.get('final_assessment', {})
+            
+            logger.warning("📊 DETAILED ANALYSIS:")
+            logger.warning(f"   Risk Level: {risk_assessment.get('risk_level', 'UNKNOWN')}")
+            logger.warning(f"   Risk Score: {risk_assessment.get('risk_score', 0):.2f}")
+            logger.warning(f"   Attack Vectors: {attack_vectors.get('attack_vectors', [])}")
+            logger.warning(f"   Detected Patterns: {pattern_analysis.get('detected_patterns', [])}")
+            logger.warning(f"   Encoding Types: {encoding_analysis.get('encoding_types', [])}")
+            logger.warning(f"   Database Types: {database_analysis.get('database_types', [])}")
+            logger.warning(f"   Evasion Techniques: {evasion_analysis.get('evasion_techniques', [])}")
+            logger.warning(f"   Time Risk: {time_analysis.get('time_risk', 'UNKNOWN')}")
+            logger.warning(f"   Network Risk: {network_analysis.get('ip_risk', 'UNKNOWN')}")
+            logger.warning(f"   Cookie Risk: {cookie_analysis.get('cookie_risk', 'UNKNOWN')}")
+            logger.warning(f"   Entropy Risk: {entropy_analysis.get('entropy_risk', 'UNKNOWN')}")
+            logger.warning(f"   Overall Risk: {final_assessment.get('overall_risk', 'UNKNOWN')}")
+            logger.warning(f"   Recommendation: {final_assessment.get('recommendation', 'UNKNOWN')}")
+            
+            # Feature scores
+            detailed_scores = detailed_analysis.get('detailed_scores', {})
+            if detailed_scores:
+                base_scores = detailed_scores.get('base_scores', {})
+                advanced_scores = detailed_scores.get('advanced_scores', {})
+                base64_scores = detailed_scores.get('base64_scores', {})
+                nosql_scores = detailed_scores.get('nosql_scores', {})
+                cookie_scores = detailed_scores.get('cookie_scores', {})
+                
+                logger.warning("🔍 FEATURE SCORES:")
+                logger.warning(f"   SQLi Patterns: {base_scores.get('sqli_patterns', 0)}")
+                logger.warning(f"   Special Chars: {base_scores.get('special_chars', 0)}")
+                logger.warning(f"   SQL Keywords: {base_scores.get('sql_keywords', 0)}")
+                logger.warning(f"   Union Select: {advanced_scores.get('has_union_select', 0)}")
+                logger.warning(f"   Information Schema: {advanced_scores.get('has_information_schema', 0)}")
+                logger.warning(f"   MySQL Functions: {advanced_scores.get('has_mysql_functions', 0)}")
+                logger.warning(f"   Boolean Blind: {advanced_scores.get('has_boolean_blind', 0)}")
+                logger.warning(f"   Time Based: {advanced_scores.get('has_time_based', 0)}")
+                logger.warning(f"   Comment Injection: {advanced_scores.get('has_comment_injection', 0)}")
+                logger.warning(f"   Base64 Patterns: {base64_scores.get('base64_sqli_patterns', 0)}")
+                logger.warning(f"   NoSQL Patterns: {nosql_scores.get('has_nosql_patterns', 0)}")
+                logger.warning(f"   Cookie SQLi: {cookie_scores.get('cookie_sqli_patterns', 0)}")
+                logger.warning(f"   Total Weighted Score: {detailed_scores.get('total_weighted_score', 0):.2f}")
+        
+        logger.warning("-" * 80)
+    
     def _is_real_threat(self, detection_result, log_entry):
         """Filter false positives - only detect real threats"""
         try:
@@ -734,8 +886,13 @@ class RealtimeLogCollector:
                 if pattern in uri.lower():
                     return False
             
-            # Get features to check for advanced patterns
-            features = self.detector.extract_optimized_features(log_entry)
+            # Rule-only verdicts skip feature extraction (exactly the cost the fallback avoids);
+            # the keyword checks on query_string/payload below still apply
+            if detection_result.get('detection_mode') == 'rules':
+                features = {}
+            else:
+                # Get features to check for advanced patterns
+                features = self.detector.extract_optimized_features(log_entry)
             
             # Check for advanced SQLi patterns
             has_advanced_patterns = (
@@ -808,218 +965,365 @@ class RealtimeLogCollector:
                 'timestamp': datetime.now().isoformat()
             }
             
+            headers = {'Content-Type': 'application/json'}
+            if self.ingest_token:
+                headers['X-Ingest-Token'] = self.ingest_token
+            
             response = requests.post(
                 self.webhook_url, 
                 json=payload, 
                 timeout=5,
-                headers={'Content-Type': 'application/json'}
+                headers=headers
             )
             
             if response.status_code == 200:
+                self._count('success', self.webhook_stats)
                 logger.info(f"✅ Detection result sent to webhook")
             else:
+                self._count('http_error', self.webhook_stats)
                 logger.warning(f"⚠️ Webhook response: {response.status_code}")
                 
         except requests.exceptions.RequestException as e:
+            self._count('connection_error', self.webhook_stats)
             logger.warning(f"⚠️ Failed to send to webhook: {e}")
         except Exception as e:
+            self._count('error', self.webhook_stats)
             logger.error(f"❌ Error sending to webhook: {e}")
     
     def save_threat_log(self, log_entry, detection_result):
         """Lưu threat log vào file"""
         try:
+            # raw_features is the full feature vector; skip it unless requested
+            if not self.threat_log_raw_features and 'raw_features' in detection_result.get('detailed_analysis', {}):
+                detection_result = dict(detection_result)
+                detection_result['detailed_analysis'] = {
+                    k: v for k, v in detection_result['detailed_analysis'].items() if k != 'raw_features'
+                }
+            
+            # Rollups share the file (type 'rollup'): readers filter on type
             threat_data = {
+                'type': 'threat',
                 'timestamp': datetime.now().isoformat(),
                 'log_entry': log_entry,
                 'detection_result': detection_result
             }
             
-            with open('threat_logs.jsonl', 'a') as f:
-                f.write(json.dumps(threat_data, default=str) + '\n')
+            self.threat_writer.write(threat_data)
                 
         except Exception as e:
             logger.error(f"Error saving threat log: {e}")
     
+    def emit_alert_rollups(self, final=False):
+        """Phát các rollup đến hạn: một dòng log, threat log và một POST webhook cho cả lô"""
+        rollups = self.alert_suppressor.drain_rollups(final=final)
+        if not rollups:
+            return
+        for rollup in rollups:
+            logger.warning(f"🔁 Suppressed {rollup['suppressed']} repeated alerts from {rollup['remote_ip']} "
+                           f"on {rollup['uri_template']} {rollup['patterns']} "
+                           f"(max score {rollup['max_score']:.3f})")
+            try:
+                self.threat_writer.write(rollup)
+            except Exception as e:
+                logger.error(f"Error saving alert rollup: {e}")
+        if not self.webhook_url:
+            return
+        try:
+            headers = {'Content-Type': 'application/json'}
+            if self.ingest_token:
+                headers['X-Ingest-Token'] = self.ingest_token
+            response = requests.post(
+                self.webhook_url,
+                json={'type': 'rollup', 'rollups': rollups, 'timestamp': datetime.now().isoformat()},
+                timeout=5,
+                headers=headers
+            )
+            if response.status_code == 200:
+                self._count('success', self.webhook_stats)
+            else:
+                self._count('http_error', self.webhook_stats)
+                logger.warning(f"⚠️ Webhook response for rollups: {response.status_code}")
+        except requests.exceptions.RequestException as e:
+            self._count('connection_error', self.webhook_stats)
+            logger.warning(f"⚠️ Failed to send rollups to webhook: {e}")
+    
+    def _enqueue_line(self, line, source_file=None, vhost='', block=True):
+        """Parse một dòng từ follower, gắn nguồn/vhost rồi đưa vào queue chung"""
+        line = line.strip()
+        if not line:
+            return
+        try:
+            # Use robust parsing with multiple fallback strategies
+            log_entry = self._parse_log_line_robust(line)
+        except Exception as e:
+            logger.warning(f"Error processing log line: {str(e)[:100]}...")
+            logger.warning(f"Problematic line: {line[:200]}...")
+            return
+        if not log_entry:
+            logger.warning(f"Could not parse log line, skipping: {line[:100]}...")
+            return
+        
+        if source_file:
+            log_entry['source_file'] = source_file
+        if vhost and not log_entry.get('vhost'):
+            log_entry['vhost'] = vhost
+        
+        # Never block the follower on ordinary lines: under overload they are sampled or
+        # deferred to the backlog so the tail keeps up with the file
+        suspicious = is_suspicious(log_entry)
+        # Every line counts towards per-client windows, including lines shed under overload
+        self.client_activity.record(log_entry, suspicious)
+        campaign = self.client_activity.check_campaign(log_entry)
+        if campaign:
+            logger.warning(f"🎯 Scanning campaign from {campaign['remote_ip']}: "
+                           f"{campaign['requests']} requests, {campaign['suspicious']} suspicious, "
+                           f"~{campaign['distinct_uris']} distinct URIs in "
+                           f"{self.client_activity.window_seconds}s ({', '.join(campaign['reasons'])})")
+        self.shedder.submit(log_entry, suspicious, lambda: self.running, block=block)
+    
+    def _ingest_line(self, line, source, vhost=''):
+        """Callback của LogIngestServer: chạy trên event loop nên không được chờ queue"""
+        self._enqueue_line(line, source, vhost, block=False)
+    
+    def _detection_worker(self):
+        """Worker dùng chung model: lấy log từ queue và phát hiện SQLi"""
+        while True:
+            log_entry, lane = self.shedder.get()
+            try:
+                if log_entry is None:
+                    return
+                self.process_log_line(log_entry)
+            except Exception as e:
+                logger.warning(f"Error processing log line: {str(e)[:100]}...")
+                self._count('errors')
+            finally:
+                self.shedder.task_done()
+    
     def start_monitoring(self):
-        """Bắt đầu monitoring"""
+        """Bắt đầu monitoring (blocking cho đến khi stop_monitoring)"""
         logger.info("🚀 Starting realtime SQLi monitoring...")
-        logger.info(f"📁 Monitoring log file: {self.log_path}")
+        logger.info(f"📁 Log sources: {self.log_paths or '-'} (format: {self.log_format})")
         
         self.running = True
+        self.workers = [
+            threading.Thread(target=self._detection_worker, name=f'detector-{i}', daemon=True)
+            for i in range(self.worker_count)
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.shedder.start()
+        self._replay_spill()
         
         try:
-            with open(self.log_path, 'r') as f:
-                # Go to end of file
-                f.seek(0, 2)
-                
-                while self.running:
-                    line = f.readline()
-                    if line:
-                        try:
-                            # Parse log entry with robust parsing
-                            line = line.strip()
-                            if not line:
-                                continue
-                                
-                            # Use robust parsing with multiple fallback strategies
-                            log_entry = self._parse_log_line_robust(line)
-                            
-                            if log_entry:
-                                # Process log entry
-                                self.process_log_line(log_entry)
-                            else:
-                                logger.warning(f"Could not parse log line, skipping: {line[:100]}...")
-                                continue
-                                
-                        except Exception as e:
-                            logger.warning(f"Error processing log line: {str(e)[:100]}...")
-                            logger.warning(f"Problematic line: {line[:200]}...")
-                            continue
-                            
-        except FileNotFoundError:
-            logger.error(f"❌ Log file not found: {self.log_path}")
-            logger.error("Please check if Apache is running and log file exists")
-        except PermissionError:
-            logger.error(f"❌ Permission denied accessing log file: {self.log_path}")
-            logger.error("Please run with sudo or check file permissions")
+            if self.metrics_address:
+                host, _, port = str(self.metrics_address).rpartition(':') if isinstance(self.metrics_address, str) \
+                    else (self.metrics_address[0], None, self.metrics_address[1])
+                try:
+                    self.metrics_server = MetricsServer(self.metrics, host or '127.0.0.1', int(port)).start()
+                except OSError as e:
+                    # Metrics are optional: a taken/forbidden port must not stop detection
+                    self.metrics_server = None
+                    logger.warning(f"⚠️ Metrics server disabled – cannot bind {host or '127.0.0.1'}:{port}: {e}")
+            if self.log_paths:
+                self.follower = MultiFileFollower(
+                    self.log_paths, self._enqueue_line,
+                    dir_pattern=self.dir_pattern,
+                    discovery_interval=self.discovery_interval,
+                    checkpoint_path=self.checkpoint_path
+                )
+                self.follower.start()
+            if self.ingest_options:
+                # Pipe mode: Apache closing our stdin means shut down (after draining)
+                self.ingest_server = LogIngestServer(
+                    self._ingest_line, on_eof=self._on_ingest_eof,
+                    backpressure=self.shedder.priority_full, **self.ingest_options
+                ).start()
+            last_report = time.time()
+            while self.running:
+                time.sleep(0.5)
+                self.emit_alert_rollups()
+                # Report shedding progress periodically while overloaded
+                if self.shedder.overloaded and time.time() - last_report >= 30:
+                    last_report = time.time()
+                    self._log_shedding_stats()
         except Exception as e:
             logger.error(f"❌ Error in log monitoring: {e}")
         finally:
             self.stop_monitoring()
     
+    def _on_ingest_eof(self):
+        if self.ingest_options.get('stdin'):
+            self.running = False
+    
     def _fix_json_line(self, line):
         """Try to fix common JSON parsing issues including line breaks"""
-        try:
-            # First, try to handle line breaks in JSON
-            line = line.strip()
-            
-            # If line doesn't start with {, it might be a continuation
-            if not line.startswith('{'):
-                # Try to find the start of a JSON object
-                start_pos = line.find('{')
-                if start_pos > 0:
-                    line = line[start_pos:]
-                else:
-                    return line  # Can't fix this line
-            
-            # If line doesn't end with }, try to find the end
-            if not line.endswith('}'):
-                # Count braces to find the end of the JSON object
-                brace_count = 0
-                end_pos = -1
-                
-                for i, char in enumerate(line):
-                    if char == '{':
-                        brace_count += 1
-                    elif char == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            end_pos = i + 1
-                            break
-                
-                if end_pos > 0:
-                    line = line[:end_pos]
-            
-            # Remove trailing commas before closing braces/brackets
-            line = re.sub(r',(\s*[}\]])', r'\1', line)
-            
-            # Fix unterminated strings by adding quotes
-            line = re.sub(r'"([^"]*?)(?=\s*[,}\]])', r'"\1"', line)
-            
-            # Fix missing commas between key-value pairs
-            line = re.sub(r'([^,}\]])\s*([}\]])', r'\1,\2', line)
-            
-            # Fix missing values (add null)
-            line = re.sub(r':\s*([,}\]])', r': null\1', line)
-            
-            # Remove duplicate commas
-            line = re.sub(r',+', ',', line)
-            
-            return line
-        except Exception:
-            return line
+        return fix_json_line(line)
     
     def _parse_log_line_robust(self, line):
         """Robustly parse log line with multiple fallback strategies"""
-        try:
-            # Strategy 1: Try direct JSON parsing
-            return json.loads(line.strip())
-        except json.JSONDecodeError:
-            pass
-        
-        try:
-            # Strategy 2: Fix common JSON issues
-            fixed_line = self._fix_json_line(line)
-            return json.loads(fixed_line)
-        except json.JSONDecodeError:
-            pass
-        
-        try:
-            # Strategy 3: Extract key fields manually if JSON parsing fails
-            return self._extract_fields_manually(line)
-        except Exception:
-            return None
+        return self.parser.parse(line)
     
     def _extract_fields_manually(self, line):
         """Extract fields manually when JSON parsing fails"""
+        return extract_fields_manually(line)
+    
+    def _replay_spill(self):
+        """Đưa lại các entry chưa xử lý từ lần shutdown trước vào pipeline"""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        count = 0
         try:
-            # Extract common fields using regex patterns
-            patterns = {
-                'time': r'"time":\s*"([^"]*)"',
-                'remote_ip': r'"remote_ip":\s*"([^"]*)"',
-                'method': r'"method":\s*"([^"]*)"',
-                'uri': r'"uri":\s*"([^"]*)"',
-                'query_string': r'"query_string":\s*"([^"]*)"',
-                'status': r'"status":\s*(\d+)',
-                'bytes_sent': r'"bytes_sent":\s*(\d+)',
-                'response_time_ms': r'"response_time_ms":\s*(\d+)',
-                'referer': r'"referer":\s*"([^"]*)"',
-                'user_agent': r'"user_agent":\s*"([^"]*)"',
-                'request_length': r'"request_length":\s*(\d+)',
-                'response_length': r'"response_length":\s*(\d+)',
-                'cookie': r'"cookie":\s*"([^"]*)"',
-                'payload': r'"payload":\s*"([^"]*)"',
-                'session_token': r'"session_token":\s*"([^"]*)"'
-            }
-            
-            log_entry = {}
-            for field, pattern in patterns.items():
-                match = re.search(pattern, line)
-                if match:
-                    if field in ['status', 'bytes_sent', 'response_time_ms', 'request_length', 'response_length']:
-                        log_entry[field] = int(match.group(1))
-                    else:
-                        log_entry[field] = match.group(1)
-                else:
-                    # Set default values
-                    if field in ['status', 'bytes_sent', 'response_time_ms', 'request_length', 'response_length']:
-                        log_entry[field] = 0
-                    else:
-                        log_entry[field] = ""
-            
-            return log_entry
-        except Exception:
-            return None
+            with open(self.spill_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        log_entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.shedder.submit(log_entry, is_suspicious(log_entry), lambda: self.running)
+                    count += 1
+            os.remove(self.spill_path)
+            logger.info(f"♻️ Replayed {count} entries left over from the previous shutdown")
+        except OSError as e:
+            logger.error(f"Error replaying {self.spill_path}: {e}")
     
-    def stop_monitoring(self):
-        """Dừng monitoring"""
-        logger.info("🛑 Stopping log monitoring...")
+    def _spill(self, entries):
+        """Ghi các entry chưa kịp xử lý để lần chạy sau replay (không mất sự kiện)"""
+        try:
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for log_entry in entries:
+                    f.write(json.dumps(log_entry, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            return True
+        except OSError as e:
+            logger.error(f"❌ Could not spill {len(entries)} pending entries to {self.spill_path}: {e}")
+            return False
+    
+    def stop_monitoring(self, timeout=None):
+        """Dừng có phối hợp: ngừng đọc → drain queue trong deadline → flush rollup/threat log"""
+        if self._stopped:
+            return
+        self._stopped = True
+        timeout = self.shutdown_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        logger.info(f"🛑 Stopping log monitoring (drain deadline {timeout:.0f}s)...")
         self.running = False
+        
+        # 1. Stop reading; follower offsets are final and checkpointed here
+        if self.follower is not None:
+            self.follower.stop()
+        if self.ingest_server is not None:
+            self.ingest_server.stop()
+            logger.info(f"🔌 Ingest: {self.ingest_server.stats}")
+            self.ingest_server = None
+        
+        # 2. Drain queued + deferred entries, then let the workers exit
+        shed = self.shedder.get_stats()
+        pending = shed['queue_depth'] + shed['backlog_size']
+        processed_before = self.stats['total_logs']
+        self.shedder.stop(workers=len(self.workers), flush_backlog=True)
+        for worker in self.workers:
+            worker.join(timeout=max(0.0, deadline - time.monotonic()))
+        spilled = 0
+        if any(worker.is_alive() for worker in self.workers):
+            leftover = self.shedder.drain_remaining()
+            if leftover and self._spill(leftover):
+                spilled = len(leftover)
+                logger.warning(f"⏱️ Drain deadline reached, spilled {spilled} entries to {self.spill_path}")
+            # Wake workers still blocked on the queue; busy ones exit after their current entry
+            self.shedder.stop(workers=len(self.workers))
+            for worker in self.workers:
+                worker.join(timeout=2)
+        self.workers = []
+        self.detection_guard.shutdown()
+        
+        # 3. Flush pending rollups and the threat log
+        self.emit_alert_rollups(final=True)
+        self.threat_writer.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        
+        logger.info(f"📈 Parse strategies: {self.parser.get_stats()}")
+        logger.info(f"⚡ Prefilter: {self.prefilter.get_stats()}")
+        self._log_shedding_stats()
+        logger.info(f"🔁 Alert suppression: {self.alert_suppressor.get_stats()}")
+        logger.info(f"⏱️ Detection guard: {self.detection_guard.get_stats()}")
+        if DroppingQueueHandler.dropped:
+            logger.warning(f"⚠️ Log queue overflowed, {DroppingQueueHandler.dropped} log records dropped")
+        uptime = (datetime.now() - self.stats['start_time']).total_seconds()
+        logger.info(f"✅ Shutdown complete: {self.stats['total_logs']} processed "
+                    f"({self.stats['total_logs'] - processed_before} of {pending} pending drained, "
+                    f"{spilled} spilled), {self.stats['sqli_detected']} SQLi, "
+                    f"{self.stats['errors']} errors, uptime {uptime:.0f}s")
+    
+    def _log_shedding_stats(self):
+        stats = self.shedder.get_stats()
+        logger.info(f"📉 Load shedding: overloaded={stats['overloaded']} shed={stats['shed']} "
+                    f"backlog={stats['backlog_size']} dropped={stats['backlog_dropped']} "
+                    f"lag={stats['lag_seconds']:.2f}s priority_lag={stats['priority_lag_seconds']:.2f}s")
 
 def main():
     """Main function"""
+    collector = None
     try:
         # Create collector
-        collector = RealtimeLogCollector()
+        log_paths = os.environ.get('SQLI_LOG_PATHS')
+        ingest_options = {
+            'unix_path': os.environ.get('SQLI_INGEST_UNIX'),
+            'tcp_address': os.environ.get('SQLI_INGEST_TCP'),
+            'udp_address': os.environ.get('SQLI_INGEST_UDP'),
+            'stdin': os.environ.get('SQLI_INGEST_STDIN') == '1'
+        }
+        ingest_options = {k: v for k, v in ingest_options.items() if v} or None
+        if log_paths:
+            log_path = log_paths.split(',')
+        elif ingest_options:
+            # Socket/pipe ingestion only; set SQLI_LOG_PATHS to tail files as well
+            log_path = None
+        else:
+            log_path = "/var/log/apache2/access_full_json.log"
+        collector = RealtimeLogCollector(
+            log_path=log_path,
+            ingest_options=ingest_options,
+            workers=int(os.environ.get('SQLI_DETECTOR_WORKERS', '2')),
+            ingest_token=os.environ.get('SQLI_INGEST_TOKEN'),
+            log_format=os.environ.get('SQLI_LOG_FORMAT', 'json'),
+            prefilter_mode=os.environ.get('SQLI_PREFILTER_MODE', DEFAULT_PREFILTER_MODE),
+            alert_window=float(os.environ.get('SQLI_ALERT_WINDOW', '60')),
+            verbose_alerts=os.environ.get('SQLI_VERBOSE_ALERTS') == '1',
+            metrics_address=os.environ.get('SQLI_METRICS_ADDR', '127.0.0.1:9108') or None,
+            load_shedding_options={
+                'sample_rate': float(os.environ.get('SQLI_SHED_SAMPLE_RATE', '0.1')),
+                'max_lag': float(os.environ.get('SQLI_SHED_MAX_LAG', '2.0'))
+            },
+            checkpoint_path=os.environ.get('SQLI_CHECKPOINT_PATH', 'collector_offsets.json') or None,
+            spill_path=os.environ.get('SQLI_SPILL_PATH', 'collector_pending.jsonl'),
+            shutdown_timeout=float(os.environ.get('SQLI_SHUTDOWN_TIMEOUT', '30')),
+            detection_budget=float(os.environ.get('SQLI_DETECTION_BUDGET_MS', '250')) / 1000 or None
+        )
+        
+        # SIGTERM/SIGINT: leave the monitoring loop, which drains and flushes in
+        # stop_monitoring; a second signal exits immediately
+        def handle_signal(signum, frame):
+            if not collector.running:
+                logger.warning("⚠️ Second signal received, exiting without draining")
+                os._exit(1)
+            logger.info(f"Received {signal.Signals(signum).name}, shutting down gracefully...")
+            collector.running = False
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
         
         # Bắt đầu monitoring
         collector.start_monitoring()
     except KeyboardInterrupt:
         logger.info("Received keyboard interrupt, stopping...")
-        collector.stop_monitoring()
+        if collector is not None:
+            collector.stop_monitoring()
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        collector.stop_monitoring()
+        if collector is not None:
+            collector.stop_monitoring()
 
 if __name__ == "__main__":
     main()
@@ -12,7 +12,7 @@ fi
 
 # Start web interface in background
 echo "Starting web interface..."
-python3 app.py &
+python3 prefork_server.py &
 WEB_PID=$!
 
 # Wait a moment for web interface to start
@@ -30,18 +30,37 @@ echo "Realtime detection: Monitoring Apache logs"
 echo ""
 echo "Press Ctrl+C to stop the system"
 
+# Seconds each process gets to drain its queue before being killed
+SHUTDOWN_TIMEOUT=${SQLI_SHUTDOWN_TIMEOUT:-30}
+
+# Send SIGTERM and wait for a graceful exit, SIGKILL after the deadline
+stop_process() {
+    local pid=$1
+    local name=$2
+    kill -TERM "$pid" 2>/dev/null || return
+    for _ in $(seq $((SHUTDOWN_TIMEOUT + 5))); do
+        kill -0 "$pid" 2>/dev/null || return
+        sleep 1
+    done
+    echo "$name did not stop in time, killing..."
+    kill -KILL "$pid" 2>/dev/null
+}
+
 # Function to cleanup on exit
 cleanup() {
+    trap - SIGINT SIGTERM
     echo ""
     echo "Stopping system..."
-    kill $WEB_PID 2>/dev/null
-    kill $DETECTOR_PID 2>/dev/null
+    # Collector first (drains detections, flushes threat log/checkpoint and rollups
+    # to the web app), then the web interface
+    stop_process $DETECTOR_PID "Realtime detection"
+    stop_process $WEB_PID "Web interface"
     echo "System stopped."
     exit 0
 }
 
-# Trap Ctrl+C
-trap cleanup SIGINT
+# Trap Ctrl+C and service stop
+trap cleanup SIGINT SIGTERM
 
 # Wait for processes
 wait
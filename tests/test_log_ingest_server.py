@@ -0,0 +1,150 @@
+"""LogIngestServer over local sockets only (127.0.0.1 / AF_UNIX)"""
+
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+from load_shedder import LoadShedder
+from log_ingest_server import LogIngestServer
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+class Collected:
+    """on_line callback that records (line, source, vhost)"""
+
+    def __init__(self):
+        self.lines = []
+        self._lock = threading.Lock()
+
+    def __call__(self, line, source, vhost):
+        with self._lock:
+            self.lines.append((line, source, vhost))
+
+    def texts(self):
+        with self._lock:
+            return [line for line, _, _ in self.lines]
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(on_line, **options):
+        server = LogIngestServer(on_line, **options).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def test_tcp_framing_and_partial_lines(start_server):
+    collected = Collected()
+    server = start_server(collected, tcp_address='127.0.0.1:0', vhost='shop')
+    with socket.create_connection(server.addresses['tcp']) as conn:
+        conn.sendall(b'line1\nli')
+        time.sleep(0.05)
+        conn.sendall(b'ne2\r\n\n   \nline3\n')
+        conn.sendall(b'<13>Oct 18 10:00:00 web apache[42]: line4\nunterminated')
+        assert wait_for(lambda: len(collected.texts()) == 4)
+    # Closing the connection flushes the final unterminated line
+    assert wait_for(lambda: len(collected.texts()) == 5)
+    assert collected.texts() == ['line1', 'line2', 'line3', 'line4', 'unterminated']
+    line, source, vhost = collected.lines[0]
+    assert source.startswith('tcp:127.0.0.1:') and vhost == 'shop'
+    assert server.stats['lines'] == 5 and server.stats['connections'] == 1
+
+
+def test_tcp_oversized_line_is_skipped(start_server):
+    collected = Collected()
+    server = start_server(collected, tcp_address='127.0.0.1:0', max_line_bytes=64)
+    with socket.create_connection(server.addresses['tcp']) as conn:
+        conn.sendall(b'x' * 500 + b'\nafter\n')
+        assert wait_for(lambda: collected.texts() == ['after'])
+    assert server.stats['oversized'] == 1
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='AF_UNIX not available')
+def test_unix_socket(start_server):
+    collected = Collected()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ingest.sock')
+        start_server(collected, unix_path=path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(path)
+            conn.sendall(b'{"uri": "/a"}\n{"uri": "/b"}\n')
+            assert wait_for(lambda: len(collected.texts()) == 2)
+        assert collected.texts() == ['{"uri": "/a"}', '{"uri": "/b"}']
+        assert collected.lines[0][1] == f'unix:{path}'
+
+
+def test_udp_syslog(start_server):
+    collected = Collected()
+    server = start_server(collected, udp_address='127.0.0.1:0')
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(b'<13>Oct 18 10:00:00 web apache: GET /a\n', server.addresses['udp'])
+        sock.sendto(b'<14>1 2026-10-18T10:00:00Z web apache 42 - - GET /b\nGET /c\n', server.addresses['udp'])
+        assert wait_for(lambda: len(collected.texts()) == 3)
+    assert sorted(collected.texts()) == ['GET /a', 'GET /b', 'GET /c']
+    assert server.stats['datagrams'] == 2
+    assert all(source.startswith('udp:127.0.0.1:') for _, source, _ in collected.lines)
+
+
+def test_submit_without_blocking_overflows_a_full_lane():
+    shedder = LoadShedder(maxsize=2, priority_max=2)
+    for i in range(2):
+        assert shedder.submit({'uri': f'/{i}'}, True, block=False) == 'priority'
+    assert shedder.priority_full()
+    start = time.monotonic()
+    assert shedder.submit({'uri': '/over'}, True, block=False) == 'priority'
+    assert time.monotonic() - start < 0.05
+    assert shedder.stats['priority_overflow'] == 1
+    assert shedder._queue.qsize() == 3
+
+
+def test_backpressure_pauses_streams_without_blocking_the_loop(start_server):
+    shedder = LoadShedder(maxsize=5, priority_max=5)
+
+    def on_line(line, source, vhost):
+        # Same call the collector's _ingest_line makes: never sleeps on the event loop
+        shedder.submit({'uri': line, 'source': source}, True, block=False)
+
+    server = start_server(on_line, tcp_address='127.0.0.1:0', udp_address='127.0.0.1:0',
+                          backpressure=shedder.priority_full)
+    with socket.create_connection(server.addresses['tcp']) as conn, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+        conn.sendall(b''.join(b"/tcp?id=1'%d\n" % i for i in range(20)))
+        # The stream reader stops at the limit instead of queueing all 20 lines
+        assert wait_for(lambda: server.stats['backpressure_waits'] >= 1)
+        time.sleep(0.2)
+        assert server.stats['lines'] == 5
+
+        # The loop is still serving: a datagram is dispatched while TCP is paused
+        udp.sendto(b"<13>Oct 18 10:00:00 web app: /udp?id=1'\n", server.addresses['udp'])
+        assert wait_for(lambda: server.stats['lines'] == 6)
+        assert shedder.stats['priority_overflow'] == 1
+
+        # Draining the lane resumes reading until every TCP line is in
+        drained = []
+        while len(drained) < 21:
+            log_entry, _ = shedder.get(timeout=5)
+            drained.append(log_entry['uri'])
+        assert [uri for uri in drained if uri.startswith('/tcp')] == [f"/tcp?id=1'{i}" for i in range(20)]
+        assert '/udp?id=1\'' in drained
+
+    start = time.monotonic()
+    server.stop()
+    assert time.monotonic() - start < 1.0
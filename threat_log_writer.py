@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Threat Log Writer – ghi threat_logs.jsonl theo lô, có rotation và nén gzip
+
+- Giữ file mở, gom nhiều bản ghi rồi ghi một lần (flush theo interval hoặc kích thước)
+- fsync theo chính sách: 'always', 'interval' hoặc 'never'
+- Rotation theo kích thước hoặc theo thời gian, segment cũ được nén .gz ở background
+- Ghi lỗi (ENOSPC/EIO): phần đã xuống file không bị ghi lại, phần còn lại chờ lần flush sau
+  trong giới hạn max_buffer_bytes (bản ghi cũ nhất bị bỏ và đếm 'dropped')
+"""
+
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class ThreatLogWriter:
+    """Buffered JSONL writer cho threat logs.
+
+    Tham số:
+    - path: file đích (segment hiện tại)
+    - flush_interval: số giây tối đa một bản ghi nằm trong buffer
+    - flush_bytes: flush ngay khi buffer vượt quá số byte này
+    - fsync_policy: 'always' (mỗi lần flush), 'interval' (tối đa mỗi fsync_interval giây), 'never'
+    - max_bytes: rotate khi segment vượt kích thước này (None = tắt)
+    - rotate_interval: rotate sau số giây này (None = tắt)
+    - compress: nén gzip các segment đã đóng
+    - backup_count: số segment nén giữ lại (None = giữ tất cả)
+    - max_buffer_bytes: số byte tối đa giữ lại chờ ghi khi file ghi lỗi liên tục
+    """
+
+    def __init__(self, path='threat_logs.jsonl', flush_interval=1.0, flush_bytes=64 * 1024,
+                 fsync_policy='interval', fsync_interval=5.0, max_bytes=100 * 1024 * 1024,
+                 rotate_interval=None, compress=True, backup_count=None, max_buffer_bytes=16 * 1024 * 1024):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {FSYNC_POLICIES}, got {fsync_policy!r}")
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.compress = compress
+        self.backup_count = backup_count
+        self.max_buffer_bytes = max(max_buffer_bytes, flush_bytes)
+
+        self._lock = threading.Lock()
+        self._buffer = deque()
+        self._buffer_size = 0
+        # True khi phần tử đầu buffer là phần còn lại của một dòng đã ghi dở
+        self._partial_head = False
+        # After a failed write, size-triggered flushes wait for the flusher's next round
+        self._retry_at = 0.0
+        self._file = None
+        self._segment_size = 0
+        self._segment_started = time.time()
+        self._last_fsync = time.time()
+        self._closed = False
+        self._compress_threads = []
+
+        self.stats = {
+            'records_written': 0,
+            'bytes_written': 0,
+            'flushes': 0,
+            'fsyncs': 0,
+            'rotations': 0,
+            'dropped': 0,
+            'errors': 0
+        }
+
+        self._open_segment()
+
+        self._stop_event = threading.Event()
+        self._flusher = None
+        if self.flush_interval:
+            self._flusher = threading.Thread(target=self._flush_loop, name='threat-log-flusher', daemon=True)
+            self._flusher.start()
+
+    def _open_segment(self):
+        """Mở (append) segment hiện tại"""
+        dirn = os.path.dirname(self.path)
+        if dirn:
+            os.makedirs(dirn, exist_ok=True)
+        # Binary: buffer and segment sizes are counted in bytes, not characters. Unbuffered so a
+        # short/failed write reports exactly how many bytes reached the file
+        self._file = open(self.path, 'ab', buffering=0)
+        self._segment_size = self._file.tell()
+        self._segment_started = time.time()
+
+    def write(self, record):
+        """Thêm một bản ghi vào buffer; flush nếu buffer đầy"""
+        line = (json.dumps(record, default=str) + '\n').encode('utf-8')
+        with self._lock:
+            if self._closed:
+                raise ValueError("ThreatLogWriter is closed")
+            self._buffer.append(line)
+            self._buffer_size += len(line)
+            if self._buffer_size > self.max_buffer_bytes:
+                self._drop_oldest_locked()
+            if self._buffer_size >= self.flush_bytes and time.monotonic() >= self._retry_at:
+                self._flush_locked()
+
+    def _drop_oldest_locked(self):
+        """Buffer vượt max_buffer_bytes (file ghi lỗi liên tục): bỏ bản ghi cũ nhất"""
+        # A partially written line is kept so the file never gets half a record
+        keep = self._buffer.popleft() if self._partial_head else None
+        dropped = 0
+        while self._buffer and self._buffer_size > self.max_buffer_bytes:
+            self._buffer_size -= len(self._buffer.popleft())
+            dropped += 1
+        if keep is not None:
+            self._buffer.appendleft(keep)
+        if dropped:
+            if not self.stats['dropped']:
+                logger.warning(f"⚠️ Threat log buffer over {self.max_buffer_bytes} bytes – dropping oldest records")
+            self.stats['dropped'] += dropped
+
+    def _consume_locked(self, written):
+        """Bỏ khỏi buffer phần đã xuống file sau một lần ghi dở"""
+        self._buffer_size -= written
+        while written:
+            head = self._buffer[0]
+            if len(head) > written:
+                self._buffer[0] = head[written:]
+                self._partial_head = True
+                return
+            self._buffer.popleft()
+            written -= len(head)
+            self._partial_head = False
+            self.stats['records_written'] += 1
+
+    def flush(self, fsync=False):
+        """Ghi buffer xuống file; fsync=True để ép fsync bất kể chính sách"""
+        with self._lock:
+            self._flush_locked(force_fsync=fsync)
+
+    def _flush_locked(self, force_fsync=False):
+        if self._file is None:
+            return
+        if self._buffer:
+            data = b''.join(self._buffer)
+            count = len(self._buffer)
+            view = memoryview(data)
+            written = 0
+            try:
+                while written < len(data):
+                    n = self._file.write(view[written:])
+                    if not n:
+                        raise OSError("short write: 0 bytes written")
+                    written += n
+            except Exception as e:
+                # Only the unwritten tail stays buffered, so the retry never duplicates a record
+                self._segment_size += written
+                self.stats['bytes_written'] += written
+                self._consume_locked(written)
+                self.stats['errors'] += 1
+                self._retry_at = time.monotonic() + (self.flush_interval or 1.0)
+                logger.error(f"Error writing threat log ({len(self._buffer)} records kept for retry): {e}")
+                return
+            self._buffer.clear()
+            self._buffer_size = 0
+            self._partial_head = False
+            self._segment_size += len(data)
+            self.stats['records_written'] += count
+            self.stats['bytes_written'] += len(data)
+            self.stats['flushes'] += 1
+
+            now = time.time()
+            if (force_fsync or self.fsync_policy == 'always' or
+                    (self.fsync_policy == 'interval' and now - self._last_fsync >= self.fsync_interval)):
+                self._fsync_locked(now)
+        elif force_fsync:
+            self._fsync_locked(time.time())
+
+        if self._should_rotate():
+            self._rotate_locked()
+
+    def _fsync_locked(self, now):
+        try:
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+            self.stats['fsyncs'] += 1
+        except OSError as e:
+            self.stats['errors'] += 1
+            logger.error(f"Error syncing threat log: {e}")
+
+    def _should_rotate(self):
+        if self.max_bytes and self._segment_size >= self.max_bytes:
+            return True
+        if self.rotate_interval and self._segment_size > 0 and \
+                time.time() - self._segment_started >= self.rotate_interval:
+            return True
+        return False
+
+    def _rotate_locked(self):
+        """Đóng segment hiện tại, đổi tên theo timestamp và nén ở background"""
+        try:
+            if self.fsync_policy != 'never':
+                os.fsync(self._file.fileno())
+            self._file.close()
+            rotated = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+            os.replace(self.path, rotated)
+            self.stats['rotations'] += 1
+            if self.compress:
+                t = threading.Thread(target=self._compress_segment, args=(rotated,),
+                                     name='threat-log-compress', daemon=True)
+                t.start()
+                self._compress_threads = [th for th in self._compress_threads if th.is_alive()]
+                self._compress_threads.append(t)
+            else:
+                self._prune_backups()
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Error rotating threat log: {e}")
+        finally:
+            self._open_segment()
+
+    def _compress_segment(self, segment_path):
+        """Nén segment đã đóng thành .gz rồi xoá bản gốc"""
+        try:
+            with open(segment_path, 'rb') as src, gzip.open(segment_path + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(segment_path)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Error compressing threat log segment {segment_path}: {e}")
+            return
+        self._prune_backups()
+
+    def _prune_backups(self):
+        if self.backup_count is None:
+            return
+        dirn = os.path.dirname(self.path) or '.'
+        prefix = os.path.basename(self.path) + '.'
+        try:
+            segments = sorted(
+                name for name in os.listdir(dirn)
+                if name.startswith(prefix) and name.endswith('.gz') == bool(self.compress)
+            )
+            for name in segments[:max(0, len(segments) - self.backup_count)]:
+                os.remove(os.path.join(dirn, name))
+        except OSError as e:
+            logger.warning(f"Error pruning threat log segments: {e}")
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in threat log flusher: {e}")
+
+    def close(self):
+        """Flush + fsync phần còn lại, dừng flusher và chờ nén xong"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stop_event.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        with self._lock:
+            self._flush_locked(force_fsync=self.fsync_policy != 'never')
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+        for t in self._compress_threads:
+            t.join(timeout=30)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Worker Cluster – chia sẻ thống kê / recent events giữa các worker process của web app
+
+- Mỗi worker định kỳ ghi snapshot trạng thái của nó (JSON, ghi atomically) vào một thư mục
+  dùng chung – mặc định trên tmpfs (/dev/shm) nên chỉ là bộ nhớ dùng chung, không I/O đĩa
+- Endpoint đọc (performance, logs, patterns, rollups) gộp trạng thái sống của worker hiện tại
+  với snapshot của các worker khác (trễ tối đa publish_interval)
+- Worker thoát (restart/reload) được master gộp vào retired.json để bộ đếm không bị mất
+- Reset (/api/clear-cache) được phát cho mọi worker qua một bộ đếm generation
+- Sketch theo client (CMS/HLL của ClientActivityAggregator) quá lớn cho JSON: mỗi worker ghi
+  clients-<pid>.npz khi có dữ liệu mới; worker thoát được gộp vào clients-retired.npz
+"""
+
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import Counter
+
+from client_aggregator import ClientActivityAggregator
+from latency_histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+RETIRED_NAME = 'retired.json'
+RESET_NAME = 'reset.generation'
+SKETCH_RETIRED_NAME = 'clients-retired.npz'
+# Counters that are summed across workers; rates/averages are recomputed from them
+PERFORMANCE_COUNTERS = ('total_logs', 'sqli_detected', 'clean_logs', 'false_positives', 'suppressed_alerts')
+MAX_EVENTS = 100
+
+
+def default_state_dir():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, f"sqli-web-{os.getpid()}")
+
+
+def _write_json_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, default=str)
+    os.replace(tmp, path)
+
+
+def merge_performance(stats_list):
+    """Cộng các bộ đếm, tính lại tỉ lệ và thời gian xử lý trung bình (trọng số theo total_logs)"""
+    merged = dict(stats_list[0]) if stats_list else {}
+    for key in PERFORMANCE_COUNTERS:
+        merged[key] = sum(stats.get(key, 0) or 0 for stats in stats_list)
+    total = merged.get('total_logs', 0)
+    if total:
+        merged['detection_rate'] = merged['sqli_detected'] / total
+        merged['false_positive_rate'] = merged['false_positives'] / total
+        merged['avg_processing_time'] = sum(
+            (stats.get('avg_processing_time', 0.0) or 0.0) * (stats.get('total_logs', 0) or 0)
+            for stats in stats_list
+        ) / total
+    return merged
+
+
+def merge_prefilter(stats_list):
+    merged = dict(stats_list[0]) if stats_list else {}
+    merged['checked'] = sum(stats.get('checked', 0) for stats in stats_list)
+    merged['bypassed'] = sum(stats.get('bypassed', 0) for stats in stats_list)
+    merged['bypass_rate'] = merged['bypassed'] / merged['checked'] if merged['checked'] else 0.0
+    return merged
+
+
+def merge_latency_states(states):
+    """Gộp nhiều LatencyHistogram.export_state() thành một"""
+    histogram = LatencyHistogram(sub_bucket_bits=states[0].get('sub_bucket_bits', 7)) if states else LatencyHistogram()
+    merged = histogram._merged(states)
+    return {
+        'sub_bucket_bits': histogram.sub_bucket_bits,
+        'counts': [[index, count] for index, count in sorted(merged.counts.items())],
+        'count': merged.count,
+        'sum_us': merged.sum_us,
+        'max_us': merged.max_us,
+        'minutes': {str(minute): [[index, count] for index, count in sorted(counts.items())]
+                    for minute, counts in merged.minutes.items()}
+    }
+
+
+def merge_by_timestamp(lists, limit=None):
+    """Gộp các danh sách (cũ trước) theo 'timestamp', giữ limit phần tử mới nhất"""
+    merged = sorted((item for items in lists for item in items), key=lambda item: item.get('timestamp', ''))
+    return merged[-limit:] if limit else merged
+
+
+def merge_by_seq(lists):
+    """Gộp các danh sách sự kiện (cũ trước) theo 'seq' của RecentEventStore"""
+    return sorted((item for items in lists for item in items), key=lambda item: item.get('seq', 0))
+
+
+def merge_snapshots(snapshots):
+    """Gộp snapshot của nhiều worker (dùng cho retired.json)"""
+    snapshots = [s for s in snapshots if s]
+    if not snapshots:
+        return {}
+    kinds = {kind for s in snapshots for kind in (s.get('latency') or {})}
+    patterns = Counter()
+    for s in snapshots:
+        patterns.update(s.get('patterns') or {})
+    return {
+        'time': max(s.get('time', 0) for s in snapshots),
+        'performance': merge_performance([s['performance'] for s in snapshots if s.get('performance')]),
+        'prefilter': merge_prefilter([s['prefilter'] for s in snapshots if s.get('prefilter')]),
+        'latency': {kind: merge_latency_states([s['latency'][kind] for s in snapshots if kind in (s.get('latency') or {})])
+                    for kind in kinds},
+        'events': merge_by_seq([s.get('events') or [] for s in snapshots])[-MAX_EVENTS:],
+        'patterns': dict(patterns),
+        'threats': sum(s.get('threats', 0) for s in snapshots),
+        'rollups': merge_by_timestamp([s.get('rollups') or [] for s in snapshots], MAX_EVENTS)
+    }
+
+
+class WorkerCluster:
+    """Thư mục trạng thái dùng chung của một nhóm worker.
+
+    Tham số:
+    - directory: thư mục dùng chung (master tạo, mỗi worker một file worker-<pid>.json)
+    - publish_interval: chu kỳ ghi snapshot của worker (giây)
+    """
+
+    def __init__(self, directory, publish_interval=1.0):
+        self.directory = directory
+        self.publish_interval = publish_interval
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"worker-{os.getpid()}.json")
+        self.sketch_path = os.path.join(directory, f"clients-{os.getpid()}.npz")
+        self._cache = {}
+        self._sketch_cache = {}
+        self._sketch_records = None
+        self._reset_generation = self.reset_generation()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # Worker side
+    def publish(self, snapshot):
+        try:
+            _write_json_atomic(self.path, snapshot)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not publish worker state: {e}")
+
+    def peer_snapshots(self):
+        """Snapshot của các worker khác (và retired.json); chỉ parse lại file đã thay đổi"""
+        snapshots = []
+        seen = set()
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if path == self.path:
+                continue
+            seen.add(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                cached = self._cache.get(path)
+                if cached is None or cached[0] != mtime:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        cached = self._cache[path] = (mtime, json.load(f))
+                snapshots.append(cached[1])
+            except (OSError, ValueError):
+                # Being replaced or removed right now; next poll will see the new version
+                continue
+        for path in set(self._cache) - seen:
+            del self._cache[path]
+        return snapshots
+
+    def publish_sketch(self, aggregator):
+        """Ghi sketch theo client của worker này (bỏ qua nếu không có request mới)"""
+        records = aggregator.stats['records']
+        if records == self._sketch_records:
+            return
+        try:
+            aggregator.save_state(self.sketch_path)
+            self._sketch_records = records
+        except OSError as e:
+            logger.warning(f"⚠️ Could not publish client sketch: {e}")
+
+    def peer_sketches(self):
+        """State sketch của các worker khác (và worker đã thoát); chỉ đọc lại file đã thay đổi"""
+        states = []
+        seen = set()
+        for path in glob.glob(os.path.join(self.directory, 'clients-*.npz')):
+            if path == self.sketch_path:
+                continue
+            seen.add(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                cached = self._sketch_cache.get(path)
+                if cached is None or cached[0] != mtime:
+                    cached = self._sketch_cache[path] = (mtime, ClientActivityAggregator.load_state(path))
+                states.append(cached[1])
+            except (OSError, ValueError, KeyError):
+                continue
+        for path in set(self._sketch_cache) - seen:
+            del self._sketch_cache[path]
+        return states
+
+    def start_publishing(self, snapshot_fn, reset_fn):
+        """Thread nền: áp dụng reset của worker khác rồi ghi snapshot mỗi publish_interval"""
+        def loop():
+            while not self._stop_event.wait(self.publish_interval):
+                try:
+                    generation = self.reset_generation()
+                    if generation != self._reset_generation:
+                        self._reset_generation = generation
+                        reset_fn()
+                    self.publish(snapshot_fn())
+                except Exception as e:
+                    logger.warning(f"⚠️ Worker state publisher error: {e}")
+        self._thread = threading.Thread(target=loop, name='cluster-publisher', daemon=True)
+        self._thread.start()
+
+    def stop_publishing(self, final_snapshot=None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        if final_snapshot is not None:
+            self.publish(final_snapshot)
+
+    def reset_generation(self):
+        try:
+            with open(os.path.join(self.directory, RESET_NAME), 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def request_reset(self):
+        """Yêu cầu mọi worker xoá trạng thái (worker gọi đã tự xoá trạng thái của nó)"""
+        self._reset_generation = self.reset_generation() + 1
+        try:
+            _write_json_atomic(os.path.join(self.directory, RESET_NAME), self._reset_generation)
+            retired = os.path.join(self.directory, RETIRED_NAME)
+            if os.path.exists(retired):
+                os.remove(retired)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not broadcast reset: {e}")
+
+    # Master side
+    @staticmethod
+    def retire(directory, pid):
+        """Gộp snapshot cuối của worker đã thoát vào retired.json rồi xoá file của nó"""
+        WorkerCluster._retire_sketch(directory, pid)
+        path = os.path.join(directory, f"worker-{pid}.json")
+        retired_path = os.path.join(directory, RETIRED_NAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+        retired = {}
+        try:
+            with open(retired_path, 'r', encoding='utf-8') as f:
+                retired = json.load(f)
+        except (OSError, ValueError):
+            pass
+        try:
+            _write_json_atomic(retired_path, merge_snapshots([retired, snapshot]))
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not retire worker {pid} state: {e}")
+
+    @staticmethod
+    def _retire_sketch(directory, pid):
+        """Gộp sketch của worker đã thoát vào clients-retired.npz (dữ liệu tự hết hạn theo cửa sổ)"""
+        path = os.path.join(directory, f"clients-{pid}.npz")
+        if not os.path.exists(path):
+            return
+        retired_path = os.path.join(directory, SKETCH_RETIRED_NAME)
+        try:
+            merged = ClientActivityAggregator.from_state(ClientActivityAggregator.load_state(path))
+            if os.path.exists(retired_path):
+                merged.merge_state(ClientActivityAggregator.load_state(retired_path))
+            merged.save_state(retired_path)
+            os.remove(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Could not retire worker {pid} client sketch: {e}")